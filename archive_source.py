@@ -0,0 +1,317 @@
+"""
+压缩包图片源模块
+直接从 zip / tar 压缩包中逐个读取图片成员送入识别流程，不解压到磁盘
+"""
+
+import json
+import logging
+import os
+import shutil
+import tarfile
+import time
+import zipfile
+from pathlib import Path, PurePosixPath
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from file_renamer import SUPPORTED_IMAGE_EXTENSIONS, FileRenamer
+from models import ReceiptRecord
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# 写出 tar 时按扩展名选择压缩方式
+TAR_WRITE_MODES = {
+    ".tar": "w",
+    ".tgz": "w:gz",
+    ".gz": "w:gz",
+    ".bz2": "w:bz2",
+    ".tbz2": "w:bz2",
+    ".xz": "w:xz",
+    ".txz": "w:xz",
+}
+
+
+def unique_member_name(name: str, used: Set[str]) -> str:
+    """生成压缩包内不重复的成员名，重复时添加序号"""
+    candidate = name
+    path = PurePosixPath(name)
+    counter = 1
+    while candidate in used:
+        candidate = str(path.with_name(f"{path.stem}_{counter:02d}{path.suffix}"))
+        counter += 1
+    used.add(candidate)
+    return candidate
+
+
+class ArchiveSource:
+    """压缩包图片源"""
+
+    def __init__(self, archive_path: Path):
+        """
+        初始化压缩包图片源
+
+        Args:
+            archive_path: zip 或 tar（含 .tar.gz/.tar.bz2/.tar.xz）文件路径
+        """
+        self.archive_path = archive_path
+        if zipfile.is_zipfile(archive_path):
+            self.kind = "zip"
+        elif tarfile.is_tarfile(archive_path):
+            self.kind = "tar"
+        else:
+            raise ValueError(f"不支持的压缩包格式: {archive_path}")
+
+    @staticmethod
+    def is_image(member_name: str) -> bool:
+        """判断成员是否为支持的图片（忽略 macOS 的 __MACOSX 元数据）"""
+        path = PurePosixPath(member_name)
+        if "__MACOSX" in path.parts or path.name.startswith("._"):
+            return False
+        return path.suffix.lower() in SUPPORTED_IMAGE_EXTENSIONS
+
+    def iter_images(self) -> Iterator[Tuple[str, bytes]]:
+        """
+        逐个读取压缩包中的图片成员，同一时间只有一张图片在内存中
+
+        Yields:
+            (成员名, 图片内容)
+        """
+        if self.kind == "zip":
+            with zipfile.ZipFile(self.archive_path) as archive:
+                for info in archive.infolist():
+                    if info.is_dir() or not self.is_image(info.filename):
+                        continue
+                    with tracer.span("read_archive_member", category="filesystem", file=info.filename):
+                        data = archive.read(info)
+                    yield info.filename, data
+        else:
+            with tarfile.open(self.archive_path, "r:*") as archive:
+                for member in archive:
+                    if not member.isfile() or not self.is_image(member.name):
+                        continue
+                    with tracer.span("read_archive_member", category="filesystem", file=member.name):
+                        data = archive.extractfile(member).read()
+                    yield member.name, data
+
+    def count_images(self) -> Optional[int]:
+        """
+        统计压缩包中的图片数量
+
+        zip 只读取中央目录；tar 没有目录，压缩的 tar 需要完整解压一遍才能计数，因此返回None（数量未知）
+        """
+        if self.kind == "zip":
+            with zipfile.ZipFile(self.archive_path) as archive:
+                return sum(
+                    1 for info in archive.infolist()
+                    if not info.is_dir() and self.is_image(info.filename)
+                )
+        return None
+
+    def write_renamed_copy(self, output_path: Path, new_names: Dict[str, str]) -> Dict[str, str]:
+        """
+        流式写出成员重命名后的压缩包副本，未出现在 new_names 中的成员原样保留
+
+        Args:
+            output_path: 输出压缩包路径
+            new_names: 成员名 -> 新文件名（不含目录）
+
+        Returns:
+            成员名 -> 副本中的最终成员名
+
+        Raises:
+            ValueError: 输出路径就是源压缩包（以写模式打开会在读取过程中截断源文件）
+        """
+        if output_path.resolve() == self.archive_path.resolve():
+            raise ValueError(f"输出压缩包不能覆盖源压缩包: {output_path}")
+        final_names: Dict[str, str] = {}
+        used: Set[str] = set()
+
+        def target_name(name: str) -> str:
+            if name in new_names:
+                name = str(PurePosixPath(name).with_name(new_names[name]))
+            return unique_member_name(name, used)
+
+        # 先写入同目录的临时文件，完成后再替换，中断时不会留下不完整的副本
+        temp_path = output_path.with_name(output_path.name + ".tmp")
+        with tracer.span("write_archive_copy", category="filesystem", file=output_path.name):
+            try:
+                if self.kind == "zip":
+                    with zipfile.ZipFile(self.archive_path) as source, \
+                            zipfile.ZipFile(temp_path, "w") as target:
+                        for info in source.infolist():
+                            original = info.filename
+                            copied = zipfile.ZipInfo(target_name(original), date_time=info.date_time)
+                            copied.compress_type = info.compress_type
+                            copied.external_attr = info.external_attr
+                            if info.is_dir():
+                                target.writestr(copied, b"")
+                                continue
+                            with source.open(info) as reader, target.open(copied, "w") as writer:
+                                shutil.copyfileobj(reader, writer)
+                            final_names[original] = copied.filename
+                else:
+                    mode = TAR_WRITE_MODES.get(output_path.suffix.lower(), "w")
+                    with tarfile.open(self.archive_path, "r:*") as source, \
+                            tarfile.open(temp_path, mode) as target:
+                        for member in source:
+                            original = member.name
+                            copied = member.replace(name=target_name(original), deep=False)
+                            final_names[original] = copied.name
+                            fileobj = source.extractfile(member) if member.isfile() else None
+                            target.addfile(copied, fileobj)
+                os.replace(temp_path, output_path)
+            except BaseException:
+                temp_path.unlink(missing_ok=True)
+                raise
+
+        logger.info(f"已写出重命名后的压缩包: {output_path}")
+        return {name: final_names.get(name, name) for name in new_names}
+
+
+def process_archive(
+    source: ArchiveSource,
+    ocr_service,
+    file_renamer: FileRenamer,
+    jsonl_path: Optional[Path] = None,
+    detector=None,
+) -> List[Tuple[str, str, ReceiptRecord]]:
+    """
+    识别压缩包中的所有图片
+
+    Args:
+        source: 压缩包图片源
+        ocr_service: OCR服务（OCRService）
+        file_renamer: 用于生成新文件名
+        jsonl_path: 逐行写出识别结果的 JSONL 文件
+        detector: 交易记录检测器（ReceiptDetector），用于二次检测
+
+    Returns:
+        (成员名, 新文件名, 识别记录) 列表
+    """
+    results: List[Tuple[str, str, ReceiptRecord]] = []
+    total = source.count_images()
+    logger.info(f"开始识别压缩包 {source.archive_path.name} 中的 {total if total is not None else '全部'} 张图片")
+
+    jsonl_file = open(jsonl_path, "w", encoding="utf-8") if jsonl_path else None
+    try:
+        for i, (member_name, data) in enumerate(source.iter_images(), 1):
+            # 添加延迟避免API限制（两次识别之间）
+            if i > 1 and ocr_service.request_interval:
+                with tracer.span("rate_limit_sleep", category="sleep"):
+                    time.sleep(ocr_service.request_interval)
+            logger.info(f"处理进度: {i}/{total if total is not None else '?'} - {member_name}")
+            member_path = PurePosixPath(member_name)
+            try:
+                with tracer.span("recognize", file=member_name):
+                    info = ocr_service.recognize_image_bytes(
+                        data, ocr_service.get_image_format(Path(member_path.name)), member_name
+                    )
+                    record = ReceiptRecord.from_info(info, ocr_service.raw_text_spill)
+            except Exception as e:
+                logger.error(f"处理图片失败 {member_name}: {e}")
+                record = ReceiptRecord(is_receipt=False, confidence=0.0, raw_text=f"处理失败: {str(e)}")
+            if detector is not None:
+                fetch_text = None
+                if getattr(ocr_service, "lean_schema", False):
+                    image_format = ocr_service.get_image_format(Path(member_path.name))
+                    fetch_text = lambda: ocr_service.transcribe_bytes(data, image_format, member_name)  # noqa: E731
+                detector.detect(record, fetch_text)
+            del data
+
+            new_name = file_renamer.generate_new_filename(record, member_path.name)
+            results.append((member_name, new_name, record))
+
+            if jsonl_file is not None:
+                line = {"archive": str(source.archive_path), "member": member_name, "new_name": new_name}
+                line.update(record.to_info().model_dump())
+                jsonl_file.write(json.dumps(line, ensure_ascii=False) + "\n")
+    finally:
+        if jsonl_file is not None:
+            jsonl_file.close()
+
+    logger.info(f"压缩包识别完成，共处理 {len(results)} 张图片")
+    return results
+
+
+def test_archive_source():
+    """测试压缩包图片源功能"""
+    import io
+    import tempfile
+
+    print("--- 测试压缩包图片源 ---")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp = Path(temp_dir)
+
+        # 构建测试压缩包
+        zip_path = temp / "bundle.zip"
+        with zipfile.ZipFile(zip_path, "w") as archive:
+            archive.writestr("chat/IMG_001.jpg", b"jpeg-1")
+            archive.writestr("chat/IMG_002.png", b"png-2")
+            archive.writestr("chat/notes.txt", b"text")
+            archive.writestr("__MACOSX/chat/._IMG_001.jpg", b"meta")
+        tar_path = temp / "bundle.tar.gz"
+        with tarfile.open(tar_path, "w:gz") as archive:
+            for name, data in [("IMG_003.jpg", b"jpeg-3"), ("readme.md", b"readme")]:
+                member = tarfile.TarInfo(name)
+                member.size = len(data)
+                archive.addfile(member, io.BytesIO(data))
+
+        # 测试用例1: 只读取图片成员
+        zip_source = ArchiveSource(zip_path)
+        images = list(zip_source.iter_images())
+        print(f"测试1 - zip 图片成员: {[name for name, _ in images]}")
+        assert images == [("chat/IMG_001.jpg", b"jpeg-1"), ("chat/IMG_002.png", b"png-2")]
+        tar_source = ArchiveSource(tar_path)
+        assert list(tar_source.iter_images()) == [("IMG_003.jpg", b"jpeg-3")]
+        assert zip_source.count_images() == 2
+        assert tar_source.count_images() is None
+
+        # 测试用例2: 写出重命名副本，同名成员自动加序号，非图片成员保留
+        zip_copy = temp / "bundle_renamed.zip"
+        final_names = zip_source.write_renamed_copy(zip_copy, {
+            "chat/IMG_001.jpg": "88.00元_支付凭证.jpg",
+            "chat/IMG_002.png": "88.00元_支付凭证.jpg",
+        })
+        print(f"测试2 - 重命名结果: {final_names}")
+        assert final_names["chat/IMG_002.png"] == "chat/88.00元_支付凭证_01.jpg"
+        with zipfile.ZipFile(zip_copy) as archive:
+            assert archive.read("chat/88.00元_支付凭证.jpg") == b"jpeg-1"
+            assert archive.read("chat/notes.txt") == b"text"
+
+        # 测试用例3: tar.gz 副本保持压缩格式
+        tar_copy = temp / "bundle_renamed.tar.gz"
+        tar_source.write_renamed_copy(tar_copy, {"IMG_003.jpg": "12.00元_支付凭证.jpg"})
+        with tarfile.open(tar_copy, "r:gz") as archive:
+            names = archive.getnames()
+            print(f"测试3 - tar 副本成员: {names}")
+            assert names == ["12.00元_支付凭证.jpg", "readme.md"]
+            assert archive.extractfile("12.00元_支付凭证.jpg").read() == b"jpeg-3"
+
+        # 测试用例4: 不能把副本写到源压缩包上，源压缩包保持不变
+        try:
+            zip_source.write_renamed_copy(temp / "." / "bundle.zip", {"chat/IMG_001.jpg": "1.00元_支付凭证.jpg"})
+            raise AssertionError("应该抛出异常")
+        except ValueError:
+            print("测试4 - 输出路径为源压缩包时被拒绝")
+        assert list(zip_source.iter_images())[0] == ("chat/IMG_001.jpg", b"jpeg-1")
+        assert sorted(path.name for path in temp.iterdir()) == [
+            "bundle.tar.gz", "bundle.zip", "bundle_renamed.tar.gz", "bundle_renamed.zip",
+        ]
+
+        # 测试用例5: 非压缩包报错
+        plain = temp / "plain.jpg"
+        plain.write_bytes(b"jpeg")
+        try:
+            ArchiveSource(plain)
+            raise AssertionError("应该抛出异常")
+        except ValueError:
+            print("测试5 - 非压缩包被拒绝")
+
+    print("✅ 所有测试用例通过！")
+
+
+if __name__ == '__main__':
+    # 配置日志以查看详细信息
+    logging.basicConfig(level=logging.INFO)
+    test_archive_source()
@@ -0,0 +1,233 @@
+"""
+内存背压模块
+按图片载荷字节数而非请求数限制同时处理的图片，保证并行处理时内存占用有上限
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# 裁剪有效区域时解码的位图每像素字节数（按 RGBA 计算）
+BITMAP_BYTES_PER_PIXEL = 4
+# JSON 请求体中图片以外的部分：消息、提示词和结构化输出格式
+REQUEST_OVERHEAD_BYTES = 16 * 1024
+
+
+def estimate_payload_bytes(file_size: int, pixels: Optional[int] = None) -> int:
+    """
+    估算一张图片处理期间占用的内存
+
+    原始字节、Base64 字符串（4/3 倍）和包含同一份 Base64 的 JSON 请求体同时存在，按 11/3 倍文件大小估算；
+    裁剪有效区域时还要解码整张位图，pixels 为图片像素数（只读取图片头部获得），不裁剪或无法读取时为None
+    """
+    nbytes = file_size * 11 // 3 + REQUEST_OVERHEAD_BYTES
+    if pixels:
+        nbytes += pixels * BITMAP_BYTES_PER_PIXEL
+    return nbytes
+
+
+class ByteBudget:
+    """在途字节预算"""
+
+    def __init__(self, limit_bytes: int):
+        """
+        初始化在途字节预算
+
+        Args:
+            limit_bytes: 同时在途的载荷字节上限
+        """
+        self.limit_bytes = limit_bytes
+        self._condition = threading.Condition()
+        self.in_flight_bytes = 0
+        self.peak_bytes = 0
+        self.waits = 0
+        self.oversized = 0
+        # 等待独占执行的超大文件数，存在时暂停接纳新的普通文件，避免超大文件饿死
+        self._exclusive_waiting = 0
+
+    def _admissible(self, nbytes: int, exclusive: bool) -> bool:
+        if exclusive:
+            return self.in_flight_bytes == 0
+        if self._exclusive_waiting:
+            return False
+        return self.in_flight_bytes + nbytes <= self.limit_bytes
+
+    def acquire(self, nbytes: int):
+        """
+        申请 nbytes 在途字节，预算不足时阻塞等待
+
+        超过整个预算的文件会排队，等所有在途文件完成后单独处理
+        """
+        with self._condition:
+            exclusive = nbytes > self.limit_bytes
+            if exclusive:
+                self.oversized += 1
+                self._exclusive_waiting += 1
+                logger.info(f"文件载荷 {nbytes / 1024 / 1024:.1f}MB 超过在途预算，等待单独处理")
+            if not self._admissible(nbytes, exclusive):
+                self.waits += 1
+                self._condition.wait_for(lambda: self._admissible(nbytes, exclusive))
+            if exclusive:
+                self._exclusive_waiting -= 1
+            self.in_flight_bytes += nbytes
+            self.peak_bytes = max(self.peak_bytes, self.in_flight_bytes)
+
+    def release(self, nbytes: int):
+        """释放 nbytes 在途字节"""
+        with self._condition:
+            self.in_flight_bytes -= nbytes
+            self._condition.notify_all()
+
+    def resize(self, held: int, nbytes: int):
+        """
+        把已占用的 held 在途字节调整为 nbytes
+
+        增加时先全部释放再重新申请：持有预算的同时等待预算，多个线程会互相等待
+        """
+        if nbytes <= held:
+            self.release(held - nbytes)
+            return
+        self.release(held)
+        self.acquire(nbytes)
+
+    @contextmanager
+    def reserve(self, nbytes: int) -> Iterator[None]:
+        """在上下文期间占用 nbytes 在途字节"""
+        self.acquire(nbytes)
+        try:
+            yield
+        finally:
+            self.release(nbytes)
+
+    def get_stats(self) -> Dict[str, int]:
+        """在途字节统计"""
+        with self._condition:
+            return {
+                "limit_bytes": self.limit_bytes,
+                "in_flight_bytes": self.in_flight_bytes,
+                "peak_bytes": self.peak_bytes,
+                "waits": self.waits,
+                "oversized": self.oversized,
+            }
+
+
+class RateLimiter:
+    """多线程共享的请求速率限制，相邻两次请求的开始时间至少间隔 interval 秒"""
+
+    def __init__(self, interval: float):
+        """
+        初始化速率限制
+
+        Args:
+            interval: 两次请求之间的最小间隔（秒）
+        """
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+        self.waits = 0
+        self.waited_seconds = 0.0
+
+    def wait(self):
+        """预约下一个请求时间片，未到时间时阻塞等待"""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+            delay = slot - now
+            if delay > 0:
+                self.waits += 1
+                self.waited_seconds += delay
+        if delay > 0:
+            time.sleep(delay)
+
+    def get_stats(self) -> Dict[str, float]:
+        """速率限制统计"""
+        with self._lock:
+            return {
+                "interval": self.interval,
+                "waits": self.waits,
+                "waited_seconds": self.waited_seconds,
+            }
+
+
+def test_byte_budget():
+    """测试在途字节预算功能"""
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    print("--- 测试内存背压 ---")
+
+    # 测试用例1: 并发处理时峰值不超过预算
+    budget = ByteBudget(limit_bytes=100)
+    active = []
+
+    def work(nbytes):
+        with budget.reserve(nbytes):
+            active.append(nbytes)
+            time.sleep(0.02)
+            active.remove(nbytes)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(work, [30] * 16))
+    stats = budget.get_stats()
+    print(f"测试1 - 统计: {stats}")
+    assert stats["peak_bytes"] <= 100
+    assert stats["in_flight_bytes"] == 0
+    assert stats["waits"] > 0
+
+    # 测试用例2: 超大文件排队后单独处理
+    budget = ByteBudget(limit_bytes=100)
+    concurrent_with_large = []
+
+    def large_work():
+        with budget.reserve(500):
+            concurrent_with_large.append(budget.get_stats()["in_flight_bytes"])
+            time.sleep(0.02)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(work, 50), executor.submit(large_work), executor.submit(work, 50)]
+        for future in futures:
+            future.result()
+    stats = budget.get_stats()
+    print(f"测试2 - 超大文件处理时在途字节: {concurrent_with_large}，统计: {stats}")
+    assert concurrent_with_large == [500]
+    assert stats["oversized"] == 1
+    assert stats["peak_bytes"] == 500
+
+    # 测试用例3: 载荷估算
+    print(f"测试3 - 3MB 图片载荷估算: {estimate_payload_bytes(3 * 1024 * 1024)} 字节")
+    assert estimate_payload_bytes(300) == 1100 + REQUEST_OVERHEAD_BYTES
+    # 裁剪时计入解码位图：4000x3000 的照片位图远大于 3MB 的文件
+    assert estimate_payload_bytes(300, pixels=12_000_000) == 1100 + REQUEST_OVERHEAD_BYTES + 48_000_000
+
+    # 测试用例4: 调整已占用的预算
+    budget = ByteBudget(limit_bytes=100)
+    budget.acquire(30)
+    budget.resize(30, 80)
+    assert budget.get_stats()["in_flight_bytes"] == 80
+    budget.resize(80, 10)
+    print(f"测试4 - 调整后在途字节: {budget.get_stats()['in_flight_bytes']}")
+    assert budget.get_stats()["in_flight_bytes"] == 10
+    budget.release(10)
+
+    # 测试用例5: 多线程共享的速率限制
+    limiter = RateLimiter(interval=0.02)
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda _: limiter.wait(), range(6)))
+    elapsed = time.monotonic() - start
+    print(f"测试5 - 6 次请求耗时 {elapsed * 1000:.0f}ms，统计: {limiter.get_stats()}")
+    assert elapsed >= 0.1
+    assert limiter.get_stats()["waits"] == 5
+
+    print("✅ 所有测试用例通过！")
+
+
+if __name__ == '__main__':
+    # 配置日志以查看详细信息
+    logging.basicConfig(level=logging.INFO)
+    test_byte_budget()
@@ -0,0 +1,528 @@
+"""
+离线批量推理模块
+把识别请求写成 JSONL 批量文件，通过 OpenAI 兼容的 files / batches 接口提交批量推理任务，
+轮询完成后一次性取回全部结果；不追求交互延迟，换取更低的调用成本和更高的配额吞吐
+"""
+
+import hashlib
+import itertools
+import json
+import logging
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Type
+
+from pydantic import BaseModel
+
+from models import ReceiptInfo, ReceiptRecord, parse_receipt_json
+from ocr_service import THINKING_DISABLED
+from result_cache import content_key_from_digest
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+# 批量任务的终止状态
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+STATE_FILENAME = "state.json"
+
+
+def strict_json_schema(schema: Any) -> Any:
+    """
+    把 pydantic 生成的 JSON Schema 转为 strict 模式：对象不允许额外字段，所有字段都列为必填
+    （可选字段本身允许 null），并去掉为 null 的默认值，与交互模式 beta.chat.completions.parse 发送的格式一致
+    """
+    if isinstance(schema, list):
+        return [strict_json_schema(item) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+    strict = {key: strict_json_schema(value) for key, value in schema.items()
+              if not (key == "default" and value is None)}
+    if "properties" in strict:
+        strict["required"] = list(strict["properties"])
+        strict["additionalProperties"] = False
+    return strict
+
+
+def response_format_schema(response_model: Type[BaseModel] = ReceiptInfo) -> Dict[str, Any]:
+    """批量请求的结构化输出格式，与交互模式使用同一个模型（ReceiptInfo 或精简的 ReceiptDecision）"""
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": response_model.__name__,
+            "schema": strict_json_schema(response_model.model_json_schema()),
+            "strict": True,
+        },
+    }
+
+
+def failed_info(reason: str = "识别失败") -> ReceiptInfo:
+    """批量任务中没有拿到结果的图片"""
+    return ReceiptInfo(is_receipt=False, confidence=0.0, raw_text=reason)
+
+
+class BatchJob:
+    """
+    离线批量推理任务
+
+    任务状态（分片、已上传的文件ID、批量任务ID）保存在工作目录的 state.json 中，
+    进程中断后再次运行会继续轮询未完成的任务，不会重复提交
+    """
+
+    def __init__(
+        self,
+        ocr_service,
+        client,
+        work_dir: Path,
+        max_requests: int = 10000,
+        max_bytes: int = 100 * 1024 * 1024,
+        poll_interval: float = 30.0,
+    ):
+        """
+        初始化批量推理任务
+
+        Args:
+            ocr_service: OCR服务（OCRService），提供请求内容、缓存和录制器
+            client: OpenAI 兼容客户端，需支持 files 和 batches 接口
+            work_dir: 保存批量文件和任务状态的目录
+            max_requests: 每个分片的最大请求数
+            max_bytes: 每个分片文件的最大字节数
+            poll_interval: 轮询任务状态的间隔（秒）
+        """
+        self.ocr_service = ocr_service
+        self.client = client
+        self.work_dir = work_dir
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.poll_interval = poll_interval
+        self.state_path = work_dir / STATE_FILENAME
+        self.state: Optional[Dict[str, Any]] = None
+        if self.state_path.exists():
+            self.state = json.loads(self.state_path.read_text(encoding="utf-8"))
+
+    @property
+    def pending(self) -> bool:
+        """是否有尚未取回结果的任务"""
+        return self.state is not None and not self.state.get("collected")
+
+    def _save_state(self):
+        temp_path = self.state_path.with_name(STATE_FILENAME + ".tmp")
+        temp_path.write_text(json.dumps(self.state, ensure_ascii=False), encoding="utf-8")
+        temp_path.replace(self.state_path)
+
+    def _request_line(self, custom_id: str, image_url: str) -> str:
+        """构建一行批量请求，请求体与交互模式的 API 调用一致"""
+        body = {
+            "model": self.ocr_service.model_id,
+            "messages": self.ocr_service.build_messages(image_url),
+            "response_format": response_format_schema(self.ocr_service.response_model),
+        }
+        body.update(THINKING_DISABLED)
+        line = {"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body}
+        return json.dumps(line, ensure_ascii=False) + "\n"
+
+    def build(self, image_paths: List[Path]) -> int:
+        """
+        逐张读取图片写出分片的 JSONL 批量文件，同一时间只有一张图片在内存中
+
+        命中识别结果缓存的图片不写入批量文件
+
+        Returns:
+            写入批量文件的请求数
+        """
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        for old_shard in self.work_dir.glob("*.jsonl"):
+            old_shard.unlink()
+        self.state = {
+            "model": self.ocr_service.model_id,
+            "cache_variant": self.ocr_service.cache_variant,
+            "created_at": time.time(),
+            "requests": {},
+            "cached": {},
+            "failed": {},
+            "shards": [],
+            "collected": False,
+        }
+        ocr = self.ocr_service
+        need_digest = ocr.cache is not None or ocr.recorder is not None
+        digests = ocr.hasher.digest_many(image_paths) if ocr.hasher is not None else {}
+
+        shard_file = None
+        shard_count = shard_bytes = 0
+        try:
+            for i, image_path in enumerate(image_paths, 1):
+                try:
+                    image_bytes = ocr.read_image(image_path)
+                except OSError as e:
+                    self.state["failed"][str(image_path)] = f"处理失败: {e}"
+                    continue
+                digest = digests.get(image_path)
+                if digest is None and need_digest:
+                    with tracer.span("hash_image", file=image_path.name):
+                        digest = hashlib.sha256(image_bytes).hexdigest()
+                cached = ocr.cached_result(digest)
+                if cached is not None:
+                    self.state["cached"][str(image_path)] = cached.model_dump_json()
+                    continue
+
+                custom_id = f"img-{i}"
+                image_url = ocr.create_base64_url(
+                    ocr.encode_bytes(image_bytes, image_path.name), ocr.get_image_format(image_path)
+                )
+                del image_bytes
+                line = self._request_line(custom_id, image_url).encode("utf-8")
+                del image_url
+
+                if shard_file is None or shard_count >= self.max_requests or \
+                        (shard_count and shard_bytes + len(line) > self.max_bytes):
+                    if shard_file is not None:
+                        shard_file.close()
+                    shard_path = self.work_dir / f"requests_{len(self.state['shards']):03d}.jsonl"
+                    self.state["shards"].append({"input": str(shard_path), "status": "built"})
+                    shard_file = open(shard_path, "wb")
+                    shard_count = shard_bytes = 0
+                shard_file.write(line)
+                shard_count += 1
+                shard_bytes += len(line)
+                self.state["requests"][custom_id] = {"path": str(image_path), "digest": digest}
+        finally:
+            if shard_file is not None:
+                shard_file.close()
+            if ocr.hasher is not None:
+                ocr.hasher.save()
+
+        self._save_state()
+        total = len(self.state["requests"])
+        logger.info(f"批量文件已写出: {total} 个请求，{len(self.state['shards'])} 个分片，"
+                    f"缓存命中 {len(self.state['cached'])} 张")
+        return total
+
+    def submit(self):
+        """上传分片文件并创建批量任务，已提交的分片不会重复提交"""
+        for shard in self.state["shards"]:
+            if shard.get("batch_id"):
+                continue
+            with tracer.span("batch_upload", category="network", file=Path(shard["input"]).name):
+                with open(shard["input"], "rb") as shard_file:
+                    uploaded = self.client.files.create(file=shard_file, purpose="batch")
+            batch = self.client.batches.create(
+                input_file_id=uploaded.id,
+                endpoint=BATCH_ENDPOINT,
+                completion_window=COMPLETION_WINDOW,
+            )
+            shard.update(file_id=uploaded.id, batch_id=batch.id, status=batch.status)
+            self._save_state()
+            logger.info(f"已提交批量任务 {batch.id}（{Path(shard['input']).name}）")
+
+    def wait(self, timeout: Optional[float] = None):
+        """
+        轮询所有批量任务直到结束
+
+        Args:
+            timeout: 最长等待时间（秒），None 表示一直等待
+
+        Raises:
+            TimeoutError: 超过等待时间仍有任务未结束
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            running = [shard for shard in self.state["shards"] if shard["status"] not in TERMINAL_STATUSES]
+            for shard in running:
+                batch = self.client.batches.retrieve(shard["batch_id"])
+                shard.update(
+                    status=batch.status,
+                    output_file_id=batch.output_file_id,
+                    error_file_id=batch.error_file_id,
+                )
+                counts = batch.request_counts
+                if counts is not None:
+                    logger.info(f"批量任务 {batch.id}: {batch.status} "
+                                f"{counts.completed + counts.failed}/{counts.total}")
+            self._save_state()
+            if all(shard["status"] in TERMINAL_STATUSES for shard in self.state["shards"]):
+                return
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError("批量任务未在等待时间内完成")
+            with tracer.span("batch_poll_sleep", category="sleep"):
+                time.sleep(self.poll_interval)
+
+    def _parse_line(self, line: Dict[str, Any]) -> Optional[ReceiptInfo]:
+        """解析一行批量结果，失败的请求返回 None"""
+        response = line.get("response") or {}
+        if line.get("error") or response.get("status_code") != 200:
+            logger.warning(f"批量请求失败 {line.get('custom_id')}: {line.get('error') or response.get('status_code')}")
+            return None
+        try:
+            content = response["body"]["choices"][0]["message"]["content"]
+            return parse_receipt_json(content)
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            logger.warning(f"批量结果无法解析 {line.get('custom_id')}: {e}")
+            return None
+
+    def collect(self) -> Dict[Path, ReceiptRecord]:
+        """
+        下载批量结果，写入缓存和录制，转换为识别记录
+
+        Returns:
+            识别结果字典，键为图片路径；没有拿到结果的图片标记为识别失败
+        """
+        ocr = self.ocr_service
+        infos: Dict[str, ReceiptInfo] = {}
+        for shard in self.state["shards"]:
+            for file_id in (shard.get("output_file_id"), shard.get("error_file_id")):
+                if not file_id:
+                    continue
+                with tracer.span("batch_download", category="network"):
+                    content = self.client.files.content(file_id).text
+                for raw_line in content.splitlines():
+                    if not raw_line.strip():
+                        continue
+                    line = json.loads(raw_line)
+                    request = self.state["requests"].get(line.get("custom_id"))
+                    info = self._parse_line(line)
+                    if request is None or info is None:
+                        continue
+                    infos[line["custom_id"]] = info
+                    digest = request["digest"]
+                    if ocr.recorder is not None:
+                        ocr.recorder.save(digest, Path(request["path"]).name, self.state["model"],
+                                          line["response"]["body"])
+                    if ocr.cache is not None:
+                        cache_key = content_key_from_digest(digest, self.state["model"], self.state.get("cache_variant"))
+                        ocr.cache.put(cache_key, info.model_dump_json())
+
+        results: Dict[Path, ReceiptRecord] = {}
+        for path, cached in self.state["cached"].items():
+            results[Path(path)] = ReceiptRecord.from_info(
+                ReceiptInfo.model_validate_json(cached), ocr.raw_text_spill
+            )
+        for path, reason in self.state["failed"].items():
+            results[Path(path)] = ReceiptRecord(is_receipt=False, confidence=0.0, raw_text=reason)
+        for custom_id, request in self.state["requests"].items():
+            info = infos.get(custom_id) or failed_info()
+            results[Path(request["path"])] = ReceiptRecord.from_info(info, ocr.raw_text_spill)
+        if ocr.cache is not None:
+            ocr.cache.flush()
+
+        self.state["collected"] = True
+        self._save_state()
+        logger.info(f"批量结果已取回: {len(infos)}/{len(self.state['requests'])} 个请求成功，"
+                    f"缓存命中 {len(self.state['cached'])} 张")
+        return results
+
+    def run(self, image_paths: List[Path]) -> Dict[Path, ReceiptRecord]:
+        """
+        执行完整的批量推理流程：写出批量文件、提交、轮询、取回结果
+
+        工作目录中有未完成的任务时继续该任务，忽略 image_paths
+        """
+        if self.pending:
+            logger.info(f"继续未完成的批量任务: {self.state_path}")
+        else:
+            self.build(image_paths)
+        self.submit()
+        self.wait()
+        return self.collect()
+
+
+class BatchStandInServer:
+    """
+    批量推理接口的本地替身服务
+    实现 OpenAI 兼容的 files / batches 接口，用于测试；每个任务第一次查询时处理中，之后完成
+    """
+
+    def __init__(self, responder: Optional[Callable[[Dict[str, Any]], str]] = None,
+                 host: str = "127.0.0.1", port: int = 0):
+        """
+        初始化替身服务
+
+        Args:
+            responder: 根据请求体返回消息内容的函数，抛出异常时该请求记为失败
+        """
+        responder = responder or (lambda body: failed_info("替身服务").model_dump_json())
+        files: Dict[str, bytes] = {}
+        batches: Dict[str, Dict[str, Any]] = {}
+        ids = itertools.count(1)
+        lock = threading.Lock()
+
+        def run_batch(batch: Dict[str, Any]):
+            output, errors = [], []
+            for raw_line in files[batch["input_file_id"]].decode("utf-8").splitlines():
+                request = json.loads(raw_line)
+                try:
+                    content = responder(request["body"])
+                    body = {
+                        "id": f"chatcmpl-{next(ids)}",
+                        "object": "chat.completion",
+                        "model": request["body"]["model"],
+                        "choices": [{
+                            "index": 0,
+                            "finish_reason": "stop",
+                            "message": {"role": "assistant", "content": content},
+                        }],
+                    }
+                    output.append({"custom_id": request["custom_id"], "error": None,
+                                   "response": {"status_code": 200, "body": body}})
+                except Exception as e:
+                    errors.append({"custom_id": request["custom_id"], "error": None,
+                                   "response": {"status_code": 500, "body": {"error": {"message": str(e)}}}})
+            for key, lines in (("output_file_id", output), ("error_file_id", errors)):
+                if lines:
+                    file_id = f"file-{next(ids)}"
+                    files[file_id] = "".join(json.dumps(line) + "\n" for line in lines).encode("utf-8")
+                    batch[key] = file_id
+            batch["request_counts"] = {"total": len(output) + len(errors),
+                                       "completed": len(output), "failed": len(errors)}
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, code: int, body: bytes = b"", content_type: str = "application/json"):
+                self.send_response(code)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _json(self, value: Dict[str, Any]):
+                self._reply(200, json.dumps(value).encode("utf-8"))
+
+            def _body(self) -> bytes:
+                return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+            def do_POST(self):
+                body = self._body()
+                with lock:
+                    if self.path == "/files":
+                        header = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8")
+                        message = BytesParser(policy=HTTP).parsebytes(header + body)
+                        data = next(part.get_content() for part in message.iter_parts()
+                                    if part.get_param("name", header="content-disposition") == "file")
+                        file_id = f"file-{next(ids)}"
+                        files[file_id] = data
+                        self._json({"id": file_id, "object": "file", "bytes": len(data), "created_at": int(time.time()),
+                                    "filename": "batch.jsonl", "purpose": "batch", "status": "processed"})
+                    elif self.path == "/batches":
+                        request = json.loads(body)
+                        batch = {
+                            "id": f"batch-{next(ids)}", "object": "batch", "endpoint": request["endpoint"],
+                            "input_file_id": request["input_file_id"],
+                            "completion_window": request["completion_window"],
+                            "status": "in_progress", "created_at": int(time.time()),
+                            "output_file_id": None, "error_file_id": None, "polls": 0,
+                        }
+                        run_batch(batch)
+                        batches[batch["id"]] = batch
+                        self._json(batch)
+                    else:
+                        self._reply(404)
+
+            def do_GET(self):
+                parts = self.path.strip("/").split("/")
+                with lock:
+                    if parts[0] == "batches" and len(parts) == 2 and parts[1] in batches:
+                        batch = batches[parts[1]]
+                        batch["polls"] += 1
+                        if batch["polls"] > 1:
+                            batch["status"] = "completed"
+                        self._json(batch)
+                    elif parts[0] == "files" and len(parts) == 3 and parts[1] in files:
+                        self._reply(200, files[parts[1]], "application/octet-stream")
+                    else:
+                        self._reply(404)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        self.files = files
+        self.batches = batches
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self.url = f"http://{host}:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def start(self) -> "BatchStandInServer":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def test_batch_job():
+    """测试离线批量推理功能"""
+    import tempfile
+    from openai import OpenAI
+    from ocr_service import OCRService
+
+    print("--- 测试离线批量推理 ---")
+
+    def responder(body: Dict[str, Any]) -> str:
+        image_url = body["messages"][0]["content"][0]["image_url"]["url"]
+        if image_url.endswith("YnJva2Vu"):  # base64("broken")
+            raise RuntimeError("模型错误")
+        return ReceiptInfo(is_receipt=True, image_type="截图", platform="微信支付",
+                           amount=len(image_url), confidence=0.9, raw_text="微信支付").model_dump_json()
+
+    server = BatchStandInServer(responder).start()
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp = Path(temp_dir)
+            images = []
+            for name, data in [("a.jpg", b"image-a"), ("b.png", b"image-bb"), ("c.jpg", b"broken")]:
+                (temp / name).write_bytes(data)
+                images.append(temp / name)
+
+            ocr_service = OCRService()
+            client = OpenAI(api_key="test", base_url=server.url)
+            job = BatchJob(ocr_service, client, temp / "batch", max_requests=2, poll_interval=0.01)
+
+            # 测试用例1: 按请求数分片，请求体与交互模式一致
+            assert job.build(images) == 3
+            print(f"测试1 - 分片数: {len(job.state['shards'])}")
+            assert len(job.state["shards"]) == 2
+            first = json.loads(Path(job.state["shards"][0]["input"]).read_text(encoding="utf-8").splitlines()[0])
+            assert first["body"]["messages"] == ocr_service.build_messages(first["body"]["messages"][0]["content"][0]["image_url"]["url"])
+            assert first["body"]["thinking"] == {"type": "disabled"}
+            schema = first["body"]["response_format"]["json_schema"]
+            assert schema["name"] == "ReceiptInfo" and schema["strict"] is True
+            assert schema["schema"]["additionalProperties"] is False
+            assert schema["schema"]["required"] == [
+                "is_receipt", "image_type", "platform", "amount", "currency",
+                "transaction_time", "merchant", "confidence", "raw_text",
+            ]
+            assert schema["schema"]["properties"]["amount"] == {
+                "anyOf": [{"type": "number"}, {"type": "null"}],
+                "description": "交易金额（元）",
+                "title": "Amount",
+            }
+            assert schema["schema"]["properties"]["currency"]["default"] == "元"
+
+            # 测试用例2: 提交后中断，新进程继续轮询而不重复提交
+            job.submit()
+            resumed = BatchJob(ocr_service, client, temp / "batch", poll_interval=0.01)
+            assert resumed.pending
+            results = resumed.run([])
+            print(f"测试2 - 提交任务数: {len(server.batches)}，结果数: {len(results)}")
+            assert len(server.batches) == 2
+            assert not BatchJob(ocr_service, client, temp / "batch").pending
+
+            # 测试用例3: 成功和失败的请求都有结果
+            assert results[images[0]].is_receipt is True
+            assert results[images[1]].platform == "微信支付"
+            print(f"测试3 - 失败请求: {results[images[2]].raw_text}")
+            assert results[images[2]].is_receipt is False
+            assert results[images[2]].raw_text == "识别失败"
+    finally:
+        server.stop()
+
+    print("✅ 所有测试用例通过！")
+
+
+if __name__ == '__main__':
+    # 配置日志以查看详细信息
+    logging.basicConfig(level=logging.INFO)
+    test_batch_job()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+结果表示内存基准
+对比逐文件 ReceiptInfo 与紧凑 ReceiptRecord 每条结果占用的字节数
+"""
+
+import argparse
+import gc
+import sys
+import tracemalloc
+from pathlib import Path
+
+# 添加当前目录到Python路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from models import RawTextSpill, ReceiptInfo, ReceiptRecord
+
+# 一张典型支付成功截图的转写文本
+SAMPLE_RAW_TEXT = (
+    "9:41 5G 100%\n支付成功\n微信支付\n¥88.00\n收款方 星巴克咖啡（国贸店）\n"
+    "支付时间 2025年03月12日 12:30:45\n支付方式 零钱\n交易单号 4200001234567890123456789\n"
+    "商户单号 SB2025031212304500001\n完成\n"
+) * 8
+
+
+def build_infos(count: int):
+    """构建 count 条 ReceiptInfo，模拟改造前的结果字典"""
+    return {
+        Path(f"/data/receipts/IMG_{i:06d}.jpg"): ReceiptInfo(
+            is_receipt=True,
+            image_type="截图",
+            platform="微信支付",
+            amount=88.0 + i % 100,
+            transaction_time=f"2025-03-12 12:{i % 60:02d}:45",
+            merchant="星巴克咖啡（国贸店）",
+            confidence=0.95,
+            raw_text=SAMPLE_RAW_TEXT + str(i),
+        )
+        for i in range(count)
+    }
+
+
+def build_records(count: int, spill: RawTextSpill):
+    """构建 count 条 ReceiptRecord，模拟改造后的结果字典"""
+    return {
+        Path(f"/data/receipts/IMG_{i:06d}.jpg"): ReceiptRecord(
+            is_receipt=True,
+            image_type="截图",
+            platform="微信支付",
+            amount=88.0 + i % 100,
+            transaction_time=f"2025-03-12 12:{i % 60:02d}:45",
+            merchant="星巴克咖啡（国贸店）",
+            confidence=0.95,
+            raw_text=SAMPLE_RAW_TEXT + str(i),
+            spill=spill,
+        )
+        for i in range(count)
+    }
+
+
+def measure(builder, count: int, *args) -> float:
+    """返回每条结果占用的字节数"""
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    results = builder(count, *args)
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del results
+    return (after - before) / count
+
+
+def main():
+    """运行基准并打印结果"""
+    parser = argparse.ArgumentParser(description="结果表示内存基准")
+    parser.add_argument("--count", type=int, default=20000, help="结果条数")
+    args = parser.parse_args()
+
+    print(f"📏 结果表示内存基准（{args.count} 条，raw_text 约 {len(SAMPLE_RAW_TEXT.encode('utf-8'))} 字节）")
+    info_bytes = measure(build_infos, args.count)
+    print(f"   ReceiptInfo（pydantic）:          {info_bytes:,.0f} 字节/条")
+
+    in_memory_bytes = measure(build_records, args.count, RawTextSpill(threshold=sys.maxsize))
+    print(f"   ReceiptRecord（文本驻留内存）:   {in_memory_bytes:,.0f} 字节/条")
+
+    spill = RawTextSpill()
+    spilled_bytes = measure(build_records, args.count, spill)
+    spill.close()
+    print(f"   ReceiptRecord（文本溢出到磁盘）: {spilled_bytes:,.0f} 字节/条")
+    print(f"   节省: {1 - spilled_bytes / info_bytes:.1%}")
+
+
+if __name__ == "__main__":
+    main()
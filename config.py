@@ -101,6 +101,150 @@ class Config:
         """获取重试延迟（秒），默认为 1"""
         return int(os.environ.get("RETRY_DELAY", "1"))
     
+    @property
+    def enable_roi_crop(self) -> bool:
+        """是否在发送前裁剪图片的有效区域，默认为关闭"""
+        return os.environ.get("ENABLE_ROI_CROP", "false").lower() in ("1", "true", "yes")
+    
+    @property
+    def lean_schema(self) -> bool:
+        """是否使用精简输出（不转写原始文本，需要时按需获取），默认为关闭"""
+        return os.environ.get("LEAN_SCHEMA", "false").lower() in ("1", "true", "yes")
+    
+    @property
+    def raw_text_spill_threshold(self) -> int:
+        """获取原始文本溢出到磁盘的阈值（字节），默认为 1024"""
+        return int(os.environ.get("RAW_TEXT_SPILL_THRESHOLD", "1024"))
+    
+    @property
+    def ledger_path(self) -> Path:
+        """获取交易台账数据库路径，默认为可执行文件目录下的 receipt_ledger.db"""
+        ledger_path = os.environ.get("LEDGER_PATH")
+        return Path(ledger_path) if ledger_path else get_executable_dir() / "receipt_ledger.db"
+    
+    @property
+    def enable_hedging(self) -> bool:
+        """是否对慢请求发送对冲请求，默认为关闭"""
+        return os.environ.get("ENABLE_HEDGING", "false").lower() in ("1", "true", "yes")
+    
+    @property
+    def hedge_percentile(self) -> float:
+        """获取触发对冲的延迟分位数，默认为 0.95"""
+        return float(os.environ.get("HEDGE_PERCENTILE", "0.95"))
+    
+    @property
+    def hedge_budget(self) -> float:
+        """获取对冲请求占总调用数的上限比例，默认为 0.05"""
+        return float(os.environ.get("HEDGE_BUDGET", "0.05"))
+    
+    @property
+    def hedge_initial_delay(self) -> float:
+        """获取延迟样本不足时的对冲延迟（秒），默认为 10"""
+        return float(os.environ.get("HEDGE_INITIAL_DELAY", "10"))
+    
+    @property
+    def result_cache_url(self) -> Optional[str]:
+        """获取团队共享缓存地址（http://... 或 redis://...），未设置时只使用本地缓存"""
+        return os.environ.get("RESULT_CACHE_URL") or None
+    
+    @property
+    def enable_result_cache(self) -> bool:
+        """是否按图片内容缓存识别结果，设置了 RESULT_CACHE_URL 时自动开启"""
+        enabled = os.environ.get("ENABLE_RESULT_CACHE", "false").lower() in ("1", "true", "yes")
+        return enabled or self.result_cache_url is not None
+    
+    @property
+    def result_cache_dir(self) -> Path:
+        """获取本地缓存目录，默认为可执行文件目录下的 .receiptname_cache"""
+        cache_dir = os.environ.get("RESULT_CACHE_DIR")
+        return Path(cache_dir) if cache_dir else get_executable_dir() / ".receiptname_cache"
+    
+    @property
+    def hash_index_path(self) -> Path:
+        """获取内容摘要索引文件路径，默认为可执行文件目录下的 .receiptname_hashes.json"""
+        index_path = os.environ.get("HASH_INDEX_PATH")
+        return Path(index_path) if index_path else get_executable_dir() / ".receiptname_hashes.json"
+    
+    @property
+    def hash_workers(self) -> int:
+        """获取并行计算图片内容摘要的线程数，默认为 4"""
+        return max(1, int(os.environ.get("HASH_WORKERS", "4")))
+    
+    @property
+    def batch_workers(self) -> int:
+        """获取批量识别的并行线程数，默认为 1（顺序处理）"""
+        return max(1, int(os.environ.get("BATCH_WORKERS", "1")))
+    
+    @property
+    def shortest_job_first(self) -> bool:
+        """批量识别是否按估算成本（文件大小和像素数）从小到大处理，默认为开启"""
+        return os.environ.get("SHORTEST_JOB_FIRST", "true").lower() in ("1", "true", "yes")
+    
+    @property
+    def show_progress(self) -> bool:
+        """批量识别时是否显示实时进度、速度和剩余时间，默认为开启"""
+        return os.environ.get("SHOW_PROGRESS", "true").lower() in ("1", "true", "yes")
+    
+    @property
+    def max_inflight_mb(self) -> int:
+        """获取同时在途的图片载荷上限（MB），默认为 256"""
+        return int(os.environ.get("MAX_INFLIGHT_MB", "256"))
+    
+    @property
+    def batch_base_url(self) -> str:
+        """获取批量推理接口地址（OpenAI 兼容的 files / batches 接口）"""
+        return os.environ.get("BATCH_BASE_URL", "https://ark.cn-beijing.volces.com/api/v3")
+    
+    @property
+    def batch_max_requests(self) -> int:
+        """获取每个批量文件分片的最大请求数，默认为 10000"""
+        return int(os.environ.get("BATCH_MAX_REQUESTS", "10000"))
+    
+    @property
+    def batch_max_mb(self) -> int:
+        """获取每个批量文件分片的最大大小（MB），默认为 100"""
+        return int(os.environ.get("BATCH_MAX_MB", "100"))
+    
+    @property
+    def batch_poll_interval(self) -> float:
+        """获取轮询批量任务状态的间隔（秒），默认为 60"""
+        return float(os.environ.get("BATCH_POLL_INTERVAL", "60"))
+    
+    @property
+    def duplicate_window_seconds(self) -> float:
+        """获取判断重复交易的交易时间容差（秒），默认为 300"""
+        return float(os.environ.get("DUPLICATE_WINDOW_SECONDS", "300"))
+    
+    @property
+    def service_host(self) -> str:
+        """获取识别服务监听地址，默认为 127.0.0.1"""
+        return os.environ.get("SERVICE_HOST", "127.0.0.1")
+    
+    @property
+    def service_port(self) -> int:
+        """获取识别服务监听端口，默认为 8765"""
+        return int(os.environ.get("SERVICE_PORT", "8765"))
+    
+    @property
+    def service_workers(self) -> int:
+        """获取识别服务的识别线程数，默认为 8"""
+        return max(1, int(os.environ.get("SERVICE_WORKERS", "8")))
+    
+    @property
+    def service_max_batch(self) -> int:
+        """获取识别服务每个微批次的最大请求数，默认为 16"""
+        return max(1, int(os.environ.get("SERVICE_MAX_BATCH", "16")))
+    
+    @property
+    def service_batch_window_ms(self) -> float:
+        """获取识别服务收集微批次的时间窗口（毫秒），默认为 20"""
+        return float(os.environ.get("SERVICE_BATCH_WINDOW_MS", "20"))
+    
+    @property
+    def service_rate_limit(self) -> float:
+        """获取识别服务每秒最多发起的API调用数，默认为 2，0 表示不限制"""
+        return float(os.environ.get("SERVICE_RATE_LIMIT", "2"))
+    
     def validate(self) -> bool:
         """验证必要的配置项"""
         if not self.ark_api_key:
@@ -127,6 +271,27 @@ class Config:
         print(f"   LOG_LEVEL: {self.log_level}")
         print(f"   MAX_RETRIES: {self.max_retries}")
         print(f"   RETRY_DELAY: {self.retry_delay}")
+        print(f"   ENABLE_ROI_CROP: {self.enable_roi_crop}")
+        print(f"   LEAN_SCHEMA: {self.lean_schema}")
+        print(f"   RAW_TEXT_SPILL_THRESHOLD: {self.raw_text_spill_threshold}")
+        print(f"   LEDGER_PATH: {self.ledger_path}")
+        print(f"   DUPLICATE_WINDOW_SECONDS: {self.duplicate_window_seconds}")
+        print(f"   ENABLE_HEDGING: {self.enable_hedging}")
+        if self.enable_hedging:
+            print(f"   HEDGE_PERCENTILE: {self.hedge_percentile}")
+            print(f"   HEDGE_BUDGET: {self.hedge_budget}")
+            print(f"   HEDGE_INITIAL_DELAY: {self.hedge_initial_delay}")
+        print(f"   BATCH_WORKERS: {self.batch_workers}")
+        print(f"   SHORTEST_JOB_FIRST: {self.shortest_job_first}")
+        print(f"   SHOW_PROGRESS: {self.show_progress}")
+        print(f"   MAX_INFLIGHT_MB: {self.max_inflight_mb}")
+        print(f"   BATCH_BASE_URL: {self.batch_base_url}")
+        print(f"   ENABLE_RESULT_CACHE: {self.enable_result_cache}")
+        if self.enable_result_cache:
+            print(f"   RESULT_CACHE_DIR: {self.result_cache_dir}")
+            print(f"   RESULT_CACHE_URL: {self.result_cache_url or '未设置'}")
+            print(f"   HASH_INDEX_PATH: {self.hash_index_path}")
+            print(f"   HASH_WORKERS: {self.hash_workers}")
 
 
 # 全局配置实例
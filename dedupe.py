@@ -0,0 +1,259 @@
+"""
+重复交易检测模块
+同一笔支付常有多张不同的截图（付款方和收款方视角、账单列表和详情页），内容不同但对应同一笔交易。
+按金额分桶、桶内按交易时间排序建立索引，每次查找只需二分定位时间窗口，不做两两比较
+"""
+
+import bisect
+import logging
+import re
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from ledger import Ledger, normalize_time, to_cents
+from models import ReceiptData
+
+logger = logging.getLogger(__name__)
+
+# 比较商户名称时忽略的空白、标点和常见后缀
+MERCHANT_NOISE = re.compile(r"[\s·•()（）\-_.,，。]|有限责任公司|有限公司|股份公司|公司")
+
+
+def normalize_merchant(merchant: Optional[str]) -> Optional[str]:
+    """规范化商户名称，无法比较时返回None"""
+    if not merchant:
+        return None
+    return MERCHANT_NOISE.sub("", merchant).lower() or None
+
+
+class IndexedTransaction(NamedTuple):
+    """索引中的一笔交易"""
+    label: str
+    timestamp: float
+    merchant: Optional[str]
+    platform: Optional[str]
+    from_ledger: bool
+
+
+class DuplicateIndex:
+    """
+    重复交易索引
+
+    金额（分）相同、交易时间相差不超过时间窗口、商户和平台不冲突的交易视为疑似重复。
+    商户或平台缺失时视为不冲突；商户名称一方包含另一方时视为同一商户。
+    没有交易时间的记录无法可靠判断，不参与检测
+    """
+
+    def __init__(self, window_seconds: float = 300):
+        """
+        初始化重复交易索引
+
+        Args:
+            window_seconds: 交易时间容差（秒）
+        """
+        self.window_seconds = window_seconds
+        # 金额（分） -> (按时间排序的时间戳列表, 对应的交易列表)
+        self._buckets: Dict[int, Tuple[List[float], List[IndexedTransaction]]] = {}
+        self.size = 0
+
+    @staticmethod
+    def transaction_key(info: ReceiptData) -> Optional[Tuple[int, float]]:
+        """交易的索引键 (金额分, 时间戳)，缺少金额或时间时返回None"""
+        cents = to_cents(info.amount)
+        tx_time = normalize_time(info.transaction_time)
+        if cents is None or tx_time is None:
+            return None
+        return cents, datetime.strptime(tx_time, "%Y-%m-%d %H:%M:%S").timestamp()
+
+    @staticmethod
+    def _compatible(a: Optional[str], b: Optional[str], partial: bool = False) -> bool:
+        if a is None or b is None or a == b:
+            return True
+        return partial and (a in b or b in a)
+
+    def _insert(self, cents: int, transaction: IndexedTransaction):
+        times, transactions = self._buckets.setdefault(cents, ([], []))
+        position = bisect.bisect_right(times, transaction.timestamp)
+        times.insert(position, transaction.timestamp)
+        transactions.insert(position, transaction)
+        self.size += 1
+
+    def _lookup(self, cents: int, timestamp: float, merchant: Optional[str],
+                platform: Optional[str]) -> List[IndexedTransaction]:
+        bucket = self._buckets.get(cents)
+        if bucket is None:
+            return []
+        times, transactions = bucket
+        start = bisect.bisect_left(times, timestamp - self.window_seconds)
+        end = bisect.bisect_right(times, timestamp + self.window_seconds)
+        return [
+            candidate for candidate in transactions[start:end]
+            if self._compatible(candidate.merchant, merchant, partial=True)
+            and self._compatible(candidate.platform, platform)
+        ]
+
+    def find(self, info: ReceiptData) -> List[IndexedTransaction]:
+        """查找与交易记录疑似重复的已索引交易"""
+        key = self.transaction_key(info)
+        if key is None:
+            return []
+        return self._lookup(*key, normalize_merchant(info.merchant), info.platform)
+
+    def add(self, label: str, info: ReceiptData, from_ledger: bool = False) -> List[IndexedTransaction]:
+        """
+        查找疑似重复后将交易加入索引
+
+        Args:
+            label: 交易的标识（文件名或路径）
+            info: 交易记录信息
+            from_ledger: 是否来自之前运行写入的交易台账
+
+        Returns:
+            加入前已索引的疑似重复交易
+        """
+        key = self.transaction_key(info)
+        if key is None:
+            return []
+        cents, timestamp = key
+        merchant = normalize_merchant(info.merchant)
+        matches = self._lookup(cents, timestamp, merchant, info.platform)
+        self._insert(cents, IndexedTransaction(label, timestamp, merchant, info.platform, from_ledger))
+        return matches
+
+    def load_ledger(self, ledger: Ledger, start: datetime, end: datetime,
+                    exclude_paths: Optional[Set[str]] = None) -> int:
+        """
+        加载交易台账中指定时间范围（含时间窗口）的交易
+
+        Args:
+            ledger: 交易台账
+            start: 本批交易的最早时间
+            end: 本批交易的最晚时间
+            exclude_paths: 不加载的文件路径（重新识别的文件不应与自己之前的记录重复）
+
+        Returns:
+            加载的交易条数
+        """
+        window = timedelta(seconds=self.window_seconds)
+        loaded = 0
+        for row in ledger.transactions_between(
+            (start - window).strftime("%Y-%m-%d %H:%M:%S"),
+            (end + window).strftime("%Y-%m-%d %H:%M:%S"),
+        ):
+            if exclude_paths and row["file_path"] in exclude_paths:
+                continue
+            timestamp = datetime.strptime(row["tx_time"], "%Y-%m-%d %H:%M:%S").timestamp()
+            label = row["file_path"] or row["original_name"]
+            self._insert(row["amount_cents"], IndexedTransaction(
+                label, timestamp, normalize_merchant(row["merchant"]), row["platform"], True
+            ))
+            loaded += 1
+        logger.info(f"从交易台账加载 {loaded} 笔交易用于重复检测")
+        return loaded
+
+
+def find_duplicates(
+    records: Dict[Path, ReceiptData],
+    window_seconds: float = 300,
+    ledger: Optional[Ledger] = None,
+) -> Dict[Path, List[IndexedTransaction]]:
+    """
+    检测本批交易记录中、以及与之前运行的交易台账之间的疑似重复交易
+
+    Args:
+        records: 交易记录字典，键为图片路径
+        window_seconds: 交易时间容差（秒）
+        ledger: 交易台账，为None时只检测本批
+
+    Returns:
+        疑似重复的交易记录，键为图片路径，值为与之重复的交易
+    """
+    index = DuplicateIndex(window_seconds)
+    keyed = [(path, info, index.transaction_key(info)) for path, info in records.items()]
+    keyed = [(path, info, key) for path, info, key in keyed if key is not None]
+    if not keyed:
+        return {}
+
+    if ledger is not None:
+        timestamps = [key[1] for _, _, key in keyed]
+        index.load_ledger(
+            ledger,
+            datetime.fromtimestamp(min(timestamps)),
+            datetime.fromtimestamp(max(timestamps)),
+            exclude_paths={str(path) for path in records},
+        )
+
+    duplicates: Dict[Path, List[IndexedTransaction]] = {}
+    for path, info, _ in keyed:
+        matches = index.add(path.name, info)
+        if matches:
+            duplicates[path] = matches
+    if duplicates:
+        logger.info(f"发现 {len(duplicates)} 个疑似重复交易")
+    return duplicates
+
+
+def test_dedupe():
+    """测试重复交易检测功能"""
+    import tempfile
+
+    from models import ReceiptInfo
+
+    print("--- 测试重复交易检测 ---")
+
+    def receipt(amount, tx_time, merchant=None, platform="微信支付"):
+        return ReceiptInfo(is_receipt=True, platform=platform, amount=amount, merchant=merchant,
+                           transaction_time=tx_time, confidence=0.9, raw_text="")
+
+    records = {
+        Path("payer.jpg"): receipt(-88.0, "2025-03-12 12:30:45", "星巴克咖啡有限公司"),
+        Path("payee.jpg"): receipt(88.0, "2025年03月12日 12:31", "星巴克咖啡"),
+        Path("later.jpg"): receipt(88.0, "2025-03-12 14:00:00", "星巴克咖啡"),
+        Path("other_shop.jpg"): receipt(88.0, "2025-03-12 12:30:45", "全家便利店"),
+        Path("list.jpg"): receipt(88.0, "2025-03-12 12:30:00"),
+        Path("alipay.jpg"): receipt(88.0, "2025-03-12 12:30:45", "星巴克咖啡", platform="支付宝"),
+        Path("no_time.jpg"): receipt(88.0, None, "星巴克咖啡"),
+    }
+
+    # 测试用例1: 付款方/收款方视角和列表页被识别为重复，时间、商户、平台不符的不算；
+    # 列表页没有商户名称，与时间窗口内的所有同额交易都不冲突
+    duplicates = find_duplicates(records, window_seconds=300)
+    print(f"测试1 - 疑似重复: {sorted(path.name for path in duplicates)}")
+    assert set(duplicates) == {Path("payee.jpg"), Path("list.jpg")}
+    assert {match.label for match in duplicates[Path("list.jpg")]} == {"payer.jpg", "payee.jpg", "other_shop.jpg"}
+
+    # 测试用例2: 商户名称规范化
+    print(f"测试2 - 商户规范化: {normalize_merchant('星巴克（中国）咖啡有限公司')}")
+    assert normalize_merchant("星巴克（中国）咖啡有限公司") == "星巴克中国咖啡"
+    assert normalize_merchant("  ") is None
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        ledger = Ledger(Path(temp_dir) / "ledger.db")
+        ledger.record_many([
+            ("IMG_001.jpg", Path(temp_dir) / "88.00元_支付凭证.jpg",
+             receipt(88.0, "2025-03-12 12:30:45", "星巴克")),
+            ("IMG_002.jpg", Path(temp_dir) / "88.00元_支付凭证_01.jpg",
+             receipt(88.0, "2025-06-01 09:00:00", "星巴克")),
+        ])
+
+        # 测试用例3: 与之前运行写入台账的交易重复
+        new_batch = {Path(temp_dir) / "detail.jpg": receipt(88.0, "2025-03-12 12:32:00", "星巴克咖啡")}
+        duplicates = find_duplicates(new_batch, ledger=ledger)
+        matches = duplicates[Path(temp_dir) / "detail.jpg"]
+        print(f"测试3 - 台账中的重复交易: {[match.label for match in matches]}")
+        assert len(matches) == 1 and matches[0].from_ledger
+
+        # 测试用例4: 重新识别的文件不与自己之前的台账记录重复
+        reprocessed = {Path(temp_dir) / "88.00元_支付凭证.jpg": receipt(88.0, "2025-03-12 12:30:45", "星巴克")}
+        assert find_duplicates(reprocessed, ledger=ledger) == {}
+        print("测试4 - 重新识别的文件不与自身重复")
+        ledger.close()
+
+    print("✅ 所有测试用例通过！")
+
+
+if __name__ == '__main__':
+    # 配置日志以查看详细信息
+    logging.basicConfig(level=logging.INFO)
+    test_dedupe()
@@ -4,14 +4,97 @@
 """
 
 import os
+import re
+import json
 import logging
+import threading
 from pathlib import Path
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Tuple
 
-from models import ReceiptInfo
+from models import ReceiptData, ReceiptInfo
+from tracing import tracer
 
 logger = logging.getLogger(__name__)
 
+# 支持的图片扩展名
+SUPPORTED_IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff', '.webp'}
+
+# 本工具生成的文件名：金额或未知金额 + 支付凭证，重名时带序号
+PROCESSED_NAME_PATTERN = re.compile(r'^(?:\d+\.\d{2}元|未知金额)_支付凭证(?:_\d{2,3})?\.[^.]+$')
+
+# 记录已处理文件的清单文件名，保存在图片所在目录
+MANIFEST_FILENAME = '.receiptname_manifest.json'
+
+# 清单中非交易记录条目的标记：这类文件保持原文件名，不检查命名规则
+NON_RECEIPT_MARK = 'non_receipt'
+
+
+class ProcessedManifest:
+    """
+    已处理文件清单
+
+    记录重命名后文件的大小和修改时间。再次运行时文件名符合生成规则、
+    且大小和修改时间与清单一致的文件视为已处理，只需 stat 不需要读取或哈希文件内容。
+    识别为非交易记录的文件保持原文件名，单独标记，只比较大小和修改时间
+    """
+
+    def __init__(self, directory: Path):
+        """
+        初始化已处理文件清单
+
+        Args:
+            directory: 图片所在目录
+        """
+        self.path = directory / MANIFEST_FILENAME
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.entries: Dict[str, List[int]] = {}
+        try:
+            self.entries = json.loads(self.path.read_text(encoding='utf-8'))
+        except FileNotFoundError:
+            pass
+        except (ValueError, OSError) as e:
+            logger.warning(f"已处理文件清单读取失败，将重新识别所有文件: {e}")
+
+    def mark(self, file_path: Path, non_receipt: bool = False):
+        """记录文件已处理，non_receipt 表示识别为非交易记录、未重命名的文件"""
+        stat = file_path.stat()
+        entry = [stat.st_size, stat.st_mtime_ns]
+        if non_receipt:
+            entry.append(NON_RECEIPT_MARK)
+        with self._lock:
+            self.entries[file_path.name] = entry
+            self._dirty = True
+
+    def is_processed(self, file_path: Path) -> bool:
+        """判断文件是否已处理：交易记录的文件名符合生成规则，且大小和修改时间未变"""
+        entry = self.entries.get(file_path.name)
+        if entry is None:
+            return False
+        non_receipt = entry[2:] == [NON_RECEIPT_MARK]
+        if not non_receipt and not PROCESSED_NAME_PATTERN.match(file_path.name):
+            return False
+        try:
+            stat = file_path.stat()
+        except OSError:
+            return False
+        return entry[:2] == [stat.st_size, stat.st_mtime_ns]
+
+    def save(self):
+        """保存清单，只保留仍然存在的文件"""
+        with self._lock:
+            if not self._dirty:
+                return
+            directory = self.path.parent
+            self.entries = {name: entry for name, entry in self.entries.items() if (directory / name).exists()}
+            temp_path = self.path.with_name(self.path.name + '.tmp')
+            try:
+                temp_path.write_text(json.dumps(self.entries, ensure_ascii=False), encoding='utf-8')
+                os.replace(temp_path, self.path)
+                self._dirty = False
+            except OSError as e:
+                logger.warning(f"已处理文件清单保存失败: {e}")
+
 
 class FileRenamer:
     """文件重命名器"""
@@ -24,9 +107,17 @@ class FileRenamer:
             target_directory: 目标目录，默认为当前工作目录
         """
         self.target_directory = target_directory or Path.cwd()
+        self._manifests: Dict[Path, ProcessedManifest] = {}
         logger.info(f"文件重命名器初始化，目标目录: {self.target_directory}")
     
-    def generate_new_filename(self, receipt_info: ReceiptInfo, original_filename: str) -> str:
+    def manifest_for(self, directory: Path) -> ProcessedManifest:
+        """获取目录的已处理文件清单"""
+        manifest = self._manifests.get(directory)
+        if manifest is None:
+            manifest = self._manifests[directory] = ProcessedManifest(directory)
+        return manifest
+    
+    def generate_new_filename(self, receipt_info: ReceiptData, original_filename: str) -> str:
         """
         根据交易记录信息生成新的文件名
         
@@ -62,7 +153,7 @@ class FileRenamer:
         logger.info(f"生成新文件名: {original_filename} -> {final_name}")
         return final_name
     
-    def rename_file(self, original_path: Path, receipt_info: ReceiptInfo) -> Optional[Path]:
+    def rename_file(self, original_path: Path, receipt_info: ReceiptData) -> Optional[Path]:
         """
         重命名单个文件
         
@@ -73,6 +164,11 @@ class FileRenamer:
         Returns:
             新的文件路径，如果重命名失败则返回None
         """
+        with tracer.span("rename_file", category="filesystem", file=original_path.name):
+            return self._rename_file(original_path, receipt_info)
+    
+    def _rename_file(self, original_path: Path, receipt_info: ReceiptData) -> Optional[Path]:
+        """重命名单个文件的具体实现"""
         try:
             # 检查原始文件是否存在
             if not original_path.exists():
@@ -83,9 +179,10 @@ class FileRenamer:
             new_filename = self.generate_new_filename(receipt_info, original_path.name)
             new_path = original_path.parent / new_filename
             
-            # 如果新文件名与原文件名相同，不需要重命名
-            if new_filename == original_path.name:
+            # 如果原文件名就是新文件名（或重名时加了序号的新文件名），不需要重命名
+            if self._is_already_named(original_path.name, new_filename):
                 logger.info(f"文件名无需更改: {original_path.name}")
+                self.manifest_for(original_path.parent).mark(original_path)
                 return original_path
             
             # 检查目标文件是否已存在，如果存在则添加序号
@@ -105,13 +202,24 @@ class FileRenamer:
             # 执行重命名
             original_path.rename(new_path)
             logger.info(f"文件重命名成功: {original_path.name} -> {new_path.name}")
+            self.manifest_for(new_path.parent).mark(new_path)
             return new_path
             
         except Exception as e:
             logger.error(f"重命名文件失败 {original_path}: {e}")
             return None
     
-    def batch_rename(self, rename_tasks: Dict[Path, ReceiptInfo]) -> Dict[Path, Optional[Path]]:
+    @staticmethod
+    def _is_already_named(current_name: str, new_filename: str) -> bool:
+        """当前文件名是否为新文件名本身或带序号的新文件名，重新识别时不应再次改名"""
+        if current_name == new_filename:
+            return True
+        if not PROCESSED_NAME_PATTERN.match(current_name):
+            return False
+        new_stem, extension = os.path.splitext(new_filename)
+        return re.fullmatch(re.escape(new_stem) + r'_\d{2,3}' + re.escape(extension), current_name) is not None
+
+    def batch_rename(self, rename_tasks: Dict[Path, ReceiptData]) -> Dict[Path, Optional[Path]]:
         """
         批量重命名文件
         
@@ -133,6 +241,7 @@ class FileRenamer:
             if new_path is not None:
                 success_count += 1
         
+        self.save_manifests()
         logger.info(f"批量重命名完成，成功: {success_count}/{len(rename_tasks)}")
         return results
     
@@ -147,15 +256,48 @@ class FileRenamer:
             图片文件路径列表
         """
         scan_directory = directory or self.target_directory
-        supported_extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff', '.webp'}
         
         image_files = []
         for file_path in scan_directory.iterdir():
-            if file_path.is_file() and file_path.suffix.lower() in supported_extensions:
+            if file_path.is_file() and file_path.suffix.lower() in SUPPORTED_IMAGE_EXTENSIONS:
                 image_files.append(file_path)
         
         logger.info(f"在 {scan_directory} 中找到 {len(image_files)} 个图片文件")
         return sorted(image_files)
+    
+    def exclude_processed(self, image_files: List[Path]) -> Tuple[List[Path], List[Path]]:
+        """
+        排除之前运行已经识别并重命名的文件
+        
+        Args:
+            image_files: 图片文件路径列表
+            
+        Returns:
+            (待处理文件列表, 已处理文件列表)
+        """
+        pending, processed = [], []
+        for file_path in image_files:
+            if self.manifest_for(file_path.parent).is_processed(file_path):
+                processed.append(file_path)
+            else:
+                pending.append(file_path)
+        if processed:
+            logger.info(f"跳过 {len(processed)} 个已处理的文件")
+        return pending, processed
+    
+    def mark_non_receipts(self, file_paths: List[Path]):
+        """记录识别为非交易记录的文件，再次运行时不再识别"""
+        for file_path in file_paths:
+            try:
+                self.manifest_for(file_path.parent).mark(file_path, non_receipt=True)
+            except OSError as e:
+                logger.warning(f"记录已处理文件失败 {file_path}: {e}")
+        self.save_manifests()
+    
+    def save_manifests(self):
+        """保存所有目录的已处理文件清单"""
+        for manifest in self._manifests.values():
+            manifest.save()
 
 
 def test_file_renamer():
@@ -220,6 +362,45 @@ def test_file_renamer():
         assert "未知金额" in new_name4
         assert "支付凭证" in new_name4
         
+        # 测试用例5: 重命名后的文件再次扫描时被跳过
+        original = test_dir / "IMG_0001.jpg"
+        original.write_bytes(b"jpeg")
+        renamed = renamer.batch_rename({original: receipt1})[original]
+        rescan = FileRenamer(test_dir)
+        pending, processed = rescan.exclude_processed(rescan.get_supported_image_files())
+        print(f"测试5 - 已处理: {[p.name for p in processed]}，待处理: {[p.name for p in pending]}")
+        assert processed == [renamed]
+        assert pending == []
+        
+        # 测试用例6: 文件内容变化或手工命名的文件仍会处理
+        renamed.write_bytes(b"edited jpeg")
+        (test_dir / "12.00元_支付凭证.png").write_bytes(b"png")
+        rescan = FileRenamer(test_dir)
+        pending, processed = rescan.exclude_processed(rescan.get_supported_image_files())
+        print(f"测试6 - 待处理: {[p.name for p in pending]}")
+        assert processed == []
+        assert len(pending) == 2
+        
+        # 测试用例7: 识别为非交易记录的文件保持原文件名，再次运行时也被跳过
+        landscape = test_dir / "landscape.jpg"
+        landscape.write_bytes(b"photo")
+        rescan.mark_non_receipts([landscape])
+        rescan = FileRenamer(test_dir)
+        pending, processed = rescan.exclude_processed(rescan.get_supported_image_files())
+        print(f"测试7 - 已处理: {[p.name for p in processed]}")
+        assert processed == [landscape]
+        landscape.write_bytes(b"edited photo")
+        assert not FileRenamer(test_dir).exclude_processed([landscape])[1]
+        
+        # 测试用例8: 重新识别时带序号的文件名保持不变
+        numbered = test_dir / "123.45元_支付凭证_02.jpg"
+        numbered.write_bytes(b"another jpeg")
+        (test_dir / "123.45元_支付凭证_01.jpg").write_bytes(b"third jpeg")
+        assert renamer.rename_file(numbered, receipt1) == numbered
+        moved = renamer.rename_file(numbered, receipt2)
+        print(f"测试8 - 带序号文件: {numbered.name} 保持不变，金额变化时改为 {moved.name}")
+        assert moved.name == "88.00元_支付凭证.jpg"
+        
         print("✅ 所有测试用例通过！")
         
     finally:
@@ -0,0 +1,232 @@
+"""
+内容哈希模块
+为识别结果缓存和录制回放计算图片内容的 SHA-256 摘要：用 mmap 映射文件、线程池并行计算（hashlib 计算时释放 GIL），
+并持久化 (路径, 大小, 修改时间) -> 摘要 的索引，未改动的文件在之后的运行中不再读取
+"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# 快速预哈希读取的文件头尾字节数
+PREHASH_SPAN = 64 * 1024
+
+
+def sha256_file(file_path: Path) -> str:
+    """用 mmap 计算文件的 SHA-256 摘要，不把文件内容复制到 Python 内存"""
+    with open(file_path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        if size == 0:
+            return hashlib.sha256(b"").hexdigest()
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return hashlib.sha256(mapped).hexdigest()
+
+
+def prehash_file(file_path: Path, size: int) -> int:
+    """
+    快速非加密预哈希：文件大小和头尾各 64KB 的 CRC32
+
+    只用于确认文件被重命名或移动（原路径已不存在），不作为缓存键，也不用来判断两个现存文件内容相同
+    """
+    with open(file_path, "rb") as file:
+        checksum = zlib.crc32(size.to_bytes(8, "little"))
+        checksum = zlib.crc32(file.read(PREHASH_SPAN), checksum)
+        if size > PREHASH_SPAN:
+            file.seek(max(PREHASH_SPAN, size - PREHASH_SPAN))
+            checksum = zlib.crc32(file.read(PREHASH_SPAN), checksum)
+    return checksum
+
+
+class ContentHasher:
+    """
+    带持久化索引的内容哈希
+
+    索引以绝对路径为键，记录 [大小, 修改时间(ns), 预哈希, 摘要]。路径、大小和修改时间都一致时直接使用索引中的摘要；
+    路径不在索引中时，只有索引里大小、修改时间和预哈希都一致的条目对应的原路径已不存在（文件被重命名或移动）
+    才沿用该条目的摘要，条目随之移到新路径；其余情况都完整计算摘要
+    """
+
+    def __init__(self, index_path: Optional[Path] = None, workers: int = 4):
+        """
+        初始化内容哈希
+
+        Args:
+            index_path: 索引文件路径，None 表示不持久化
+            workers: 并行计算摘要的线程数
+        """
+        self.index_path = index_path
+        self.workers = max(1, workers)
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.entries: Dict[str, List] = {}
+        if index_path is not None:
+            try:
+                self.entries = json.loads(index_path.read_text(encoding="utf-8"))
+            except FileNotFoundError:
+                pass
+            except (ValueError, OSError) as e:
+                logger.warning(f"内容哈希索引读取失败，将重新计算: {e}")
+        # (大小, 修改时间, 预哈希) -> 索引中的路径，用于确认重命名
+        self._by_fingerprint: Dict[Tuple[int, int, int], str] = {
+            (size, mtime_ns, prehash): key for key, (size, mtime_ns, prehash, _) in self.entries.items()
+        }
+        self.stats = {"indexed": 0, "moved": 0, "hashed": 0, "hashed_bytes": 0}
+
+    def digest(self, file_path: Path) -> str:
+        """计算单个文件的内容摘要，优先使用索引"""
+        key = str(file_path.resolve())
+        stat = file_path.stat()
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            with self._lock:
+                self.stats["indexed"] += 1
+            return entry[3]
+
+        prehash = prehash_file(file_path, stat.st_size)
+        fingerprint = (stat.st_size, stat.st_mtime_ns, prehash)
+        digest = self._claim_moved(fingerprint, key)
+        if digest is not None:
+            counter = "moved"
+        else:
+            with tracer.span("hash_image", file=file_path.name):
+                digest = sha256_file(file_path)
+            counter = "hashed"
+
+        with self._lock:
+            self.stats[counter] += 1
+            if counter == "hashed":
+                self.stats["hashed_bytes"] += stat.st_size
+            self.entries[key] = [stat.st_size, stat.st_mtime_ns, prehash, digest]
+            self._by_fingerprint[fingerprint] = key
+            self._dirty = True
+        return digest
+
+    def _claim_moved(self, fingerprint: Tuple[int, int, int], key: str) -> Optional[str]:
+        """指纹一致的索引条目的原路径已不存在时，认定文件是被重命名过来的，取走该条目的摘要"""
+        with self._lock:
+            old_key = self._by_fingerprint.get(fingerprint)
+            if old_key is None or old_key == key or old_key not in self.entries or os.path.exists(old_key):
+                return None
+            return self.entries.pop(old_key)[3]
+
+    def digest_many(self, file_paths: List[Path]) -> Dict[Path, str]:
+        """
+        并行计算一批文件的内容摘要
+
+        Returns:
+            路径 -> 摘要，无法读取的文件不在结果中
+        """
+        def safe_digest(file_path: Path) -> Optional[str]:
+            try:
+                return self.digest(file_path)
+            except OSError as e:
+                logger.warning(f"计算内容摘要失败 {file_path}: {e}")
+                return None
+
+        with tracer.span("hash_batch", category="filesystem", files=len(file_paths)):
+            if self.workers <= 1 or len(file_paths) <= 1:
+                digests = [safe_digest(file_path) for file_path in file_paths]
+            else:
+                with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="hash") as executor:
+                    digests = list(executor.map(safe_digest, file_paths))
+        return {file_path: digest for file_path, digest in zip(file_paths, digests) if digest is not None}
+
+    def save(self):
+        """保存索引，只保留仍然存在的文件"""
+        if self.index_path is None:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            self.entries = {key: entry for key, entry in self.entries.items() if os.path.exists(key)}
+            temp_path = self.index_path.with_name(self.index_path.name + ".tmp")
+            try:
+                self.index_path.parent.mkdir(parents=True, exist_ok=True)
+                temp_path.write_text(json.dumps(self.entries, ensure_ascii=False), encoding="utf-8")
+                os.replace(temp_path, self.index_path)
+                self._dirty = False
+            except OSError as e:
+                logger.warning(f"内容哈希索引保存失败: {e}")
+
+    def get_stats(self) -> Dict[str, int]:
+        """哈希统计：索引命中、重命名后复用、实际计算的文件数和字节数"""
+        with self._lock:
+            return dict(self.stats)
+
+
+def test_hashing():
+    """测试内容哈希功能"""
+    import tempfile
+
+    print("--- 测试内容哈希 ---")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp = Path(temp_dir)
+        contents = {
+            "small.jpg": b"jpeg",
+            "large.png": os.urandom(300 * 1024),
+            "empty.jpg": b"",
+        }
+        for name, data in contents.items():
+            (temp / name).write_bytes(data)
+        paths = [temp / name for name in contents] + [temp / "missing.jpg"]
+        index_path = temp / "index" / "hashes.json"
+
+        # 测试用例1: 并行计算的摘要与 hashlib 一致，无法读取的文件被跳过
+        hasher = ContentHasher(index_path, workers=4)
+        digests = hasher.digest_many(paths)
+        print(f"测试1 - 计算摘要: {len(digests)} 个文件，统计 {hasher.get_stats()}")
+        assert digests == {temp / name: hashlib.sha256(data).hexdigest() for name, data in contents.items()}
+        assert hasher.get_stats()["hashed"] == 3
+        hasher.save()
+
+        # 测试用例2: 再次运行时未改动的文件直接使用索引
+        hasher = ContentHasher(index_path)
+        assert hasher.digest_many(paths) == digests
+        print(f"测试2 - 索引命中: {hasher.get_stats()}")
+        assert hasher.get_stats()["indexed"] == 3 and hasher.get_stats()["hashed"] == 0
+
+        # 测试用例3: 重命名后通过预哈希复用摘要，修改内容后重新计算
+        renamed = temp / "88.00元_支付凭证.png"
+        (temp / "large.png").rename(renamed)
+        assert hasher.digest(renamed) == digests[temp / "large.png"]
+        (temp / "small.jpg").write_bytes(b"jpeg-edited")
+        assert hasher.digest(temp / "small.jpg") == hashlib.sha256(b"jpeg-edited").hexdigest()
+        print(f"测试3 - 重命名和修改: {hasher.get_stats()}")
+        assert hasher.get_stats()["moved"] == 1 and hasher.get_stats()["hashed"] == 1
+
+        # 测试用例4: 头尾和修改时间相同但中间内容不同的文件，原文件仍在时完整计算摘要
+        source = renamed.read_bytes()
+        lookalike = temp / "lookalike.png"
+        lookalike.write_bytes(source[:PREHASH_SPAN] + os.urandom(len(source) - 2 * PREHASH_SPAN) + source[-PREHASH_SPAN:])
+        source_stat = renamed.stat()
+        os.utime(lookalike, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+        assert hasher.digest(lookalike) == hashlib.sha256(lookalike.read_bytes()).hexdigest()
+        print(f"测试4 - 相似文件: {hasher.get_stats()}")
+        assert hasher.get_stats()["moved"] == 1 and hasher.get_stats()["hashed"] == 2
+        lookalike.unlink()
+
+        # 测试用例5: 保存时清理已不存在的路径
+        hasher.save()
+        saved = json.loads(index_path.read_text(encoding="utf-8"))
+        print(f"测试5 - 索引条目: {len(saved)}")
+        assert str((temp / "large.png").resolve()) not in saved and len(saved) == 3
+
+    print("✅ 所有测试用例通过！")
+
+
+if __name__ == '__main__':
+    # 配置日志以查看详细信息
+    logging.basicConfig(level=logging.INFO)
+    test_hashing()
@@ -0,0 +1,257 @@
+"""
+请求对冲模块
+API调用超过自适应延迟分位数仍未返回时，发送一份重复请求，采用先返回的结果以降低长尾延迟
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Deque, Dict, Optional
+
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyTracker:
+    """滑动窗口延迟统计"""
+
+    def __init__(self, window: int = 200, percentile: float = 0.95,
+                 min_samples: int = 20, initial_delay: float = 10.0, min_delay: float = 1.0):
+        """
+        初始化延迟统计
+
+        Args:
+            window: 保留最近多少次调用的延迟
+            percentile: 触发对冲的延迟分位数
+            min_samples: 样本不足时使用 initial_delay
+            initial_delay: 样本不足时的对冲延迟（秒）
+            min_delay: 对冲延迟下限（秒），避免对所有请求都发起对冲
+        """
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        """记录一次调用延迟"""
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """计算延迟分位数，没有样本时返回None"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(q * len(samples)))
+        return samples[index]
+
+    def threshold(self) -> float:
+        """当前的对冲延迟（秒）"""
+        with self._lock:
+            sample_count = len(self._samples)
+        if sample_count < self.min_samples:
+            return self.initial_delay
+        return max(self.min_delay, self.quantile(self.percentile))
+
+
+class HedgedCaller:
+    """
+    对冲调用器
+
+    对冲请求数不超过 budget × 总调用数，因此前 1/budget 次调用（默认预算 0.1 时为前 10 次）不会发送对冲请求。
+    对冲胜出时尚未开始的主请求被取消，已在进行的请求无法中止，会继续运行并消耗API配额，计入 wasted_calls
+    """
+
+    def __init__(self, tracker: LatencyTracker, budget: float = 0.1, max_workers: int = 8):
+        """
+        初始化对冲调用器
+
+        Args:
+            tracker: 延迟统计
+            budget: 对冲请求数占总调用数的上限比例（第 n 次调用时最多已发送 budget × n 次对冲）
+            max_workers: 执行调用的线程数，应不少于调用方线程数的两倍（每个调用最多同时占用主请求和对冲请求两个线程），
+                否则主请求在线程池中排队，排队时间被误算为API延迟而触发无效的对冲
+        """
+        self.tracker = tracker
+        self.budget = budget
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedges_sent = 0
+        self.hedges_won = 0
+        self.budget_exhausted = 0
+        self.wasted_calls = 0
+
+    def _timed(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """执行调用并记录延迟"""
+        start = time.perf_counter()
+        result = fn(*args)
+        self.tracker.observe(time.perf_counter() - start)
+        return result
+
+    def _try_reserve_hedge(self) -> bool:
+        """检查对冲预算，允许时占用一次"""
+        with self._lock:
+            if self.hedges_sent + 1 > self.budget * self.calls:
+                self.budget_exhausted += 1
+                return False
+            self.hedges_sent += 1
+            return True
+
+    def call(self, fn: Callable[..., Any], *args: Any,
+             throttle: Optional[Callable[[], None]] = None) -> Any:
+        """
+        执行调用，超过对冲延迟时发送重复请求
+
+        Args:
+            fn: 要执行的调用
+            *args: 调用参数
+            throttle: 发送对冲请求前调用的限速函数（如 RateLimiter.wait），对冲请求和主请求一样受速率限制
+
+        Returns:
+            先成功返回的结果；两个请求都失败时抛出主请求的异常
+        """
+        with self._lock:
+            self.calls += 1
+        delay = self.tracker.threshold()
+        primary = self._executor.submit(self._timed, fn, *args)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._try_reserve_hedge():
+            return primary.result()
+
+        if throttle is not None:
+            with tracer.span("rate_limit_wait", category="sleep"):
+                throttle()
+            if primary.done():
+                return primary.result()
+
+        logger.info(f"API调用超过 {delay:.1f}s 未返回，发送对冲请求")
+        with tracer.span("hedge", category="network", delay_s=round(delay, 3)):
+            hedge = self._executor.submit(self._timed, fn, *args)
+            return self._first_success(primary, hedge)
+
+    def _first_success(self, primary: Future, hedge: Future) -> Any:
+        """返回先成功的结果，并取消另一个请求"""
+        pending = {primary, hedge}
+        first_error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                error = future.exception()
+                if error is None:
+                    if future is hedge:
+                        with self._lock:
+                            self.hedges_won += 1
+                    # 未开始的请求直接取消；已在进行的请求无法中止，结果被丢弃
+                    for loser in pending:
+                        if not loser.cancel():
+                            with self._lock:
+                                self.wasted_calls += 1
+                    return future.result()
+                if future is primary or first_error is None:
+                    first_error = error
+        raise first_error
+
+    def get_stats(self) -> Dict[str, Any]:
+        """对冲统计信息"""
+        with self._lock:
+            stats = {
+                "calls": self.calls,
+                "hedges_sent": self.hedges_sent,
+                "hedges_won": self.hedges_won,
+                "budget_exhausted": self.budget_exhausted,
+                "wasted_calls": self.wasted_calls,
+            }
+        stats["hedge_delay_s"] = self.tracker.threshold()
+        stats["latency_p50_s"] = self.tracker.quantile(0.50)
+        stats["latency_p99_s"] = self.tracker.quantile(0.99)
+        return stats
+
+    def shutdown(self):
+        """关闭线程池，不等待被丢弃的请求"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def test_hedged_caller():
+    """测试对冲调用器功能"""
+    print("--- 测试请求对冲 ---")
+
+    # 测试用例1: 分位数和样本不足时的默认延迟
+    tracker = LatencyTracker(percentile=0.9, min_samples=5, initial_delay=2.0, min_delay=0.01)
+    assert tracker.threshold() == 2.0
+    for seconds in [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]:
+        tracker.observe(seconds)
+    print(f"测试1 - p90 对冲延迟: {tracker.threshold()}")
+    assert tracker.threshold() == 1.0
+
+    # 测试用例2: 首次调用卡住，对冲请求先返回
+    tracker = LatencyTracker(min_samples=1000, initial_delay=0.05)
+    caller = HedgedCaller(tracker, budget=1.0)
+    attempts = []
+
+    def flaky_call(value):
+        attempts.append(value)
+        if len(attempts) == 1:
+            time.sleep(1.0)
+            return "slow"
+        return "fast"
+
+    start = time.perf_counter()
+    result = caller.call(flaky_call, "x")
+    elapsed = time.perf_counter() - start
+    print(f"测试2 - 对冲结果: {result}，耗时 {elapsed:.2f}s")
+    assert result == "fast"
+    assert elapsed < 0.5
+    assert caller.hedges_won == 1
+    # 被超越的主请求已在进行，无法取消
+    assert caller.get_stats()["wasted_calls"] == 1
+
+    # 测试用例3: 预算用尽时不再对冲
+    caller = HedgedCaller(LatencyTracker(min_samples=1000, initial_delay=0.01), budget=0.0)
+    result = caller.call(lambda: (time.sleep(0.05), "only")[1])
+    print(f"测试3 - 预算为0时结果: {result}，预算拒绝 {caller.budget_exhausted} 次")
+    assert result == "only"
+    assert caller.hedges_sent == 0 and caller.budget_exhausted == 1
+
+    # 测试用例4: 主请求失败时采用对冲结果，都失败时抛出异常
+    caller = HedgedCaller(LatencyTracker(min_samples=1000, initial_delay=0.01), budget=1.0)
+    calls = []
+
+    def failing_primary():
+        calls.append(1)
+        if len(calls) == 1:
+            time.sleep(0.05)
+            raise ConnectionError("primary failed")
+        time.sleep(0.1)
+        return "hedge ok"
+
+    assert caller.call(failing_primary) == "hedge ok"
+    try:
+        caller.call(lambda: (time.sleep(0.05), 1 / 0))
+        raise AssertionError("应该抛出异常")
+    except ZeroDivisionError:
+        print("测试4 - 两个请求都失败时抛出异常")
+    caller.shutdown()
+
+    # 测试用例5: 对冲请求发送前经过限速
+    caller = HedgedCaller(LatencyTracker(min_samples=1000, initial_delay=0.01), budget=1.0)
+    throttled = []
+    attempts.clear()
+    assert caller.call(flaky_call, "y", throttle=lambda: throttled.append(1)) == "fast"
+    print(f"测试5 - 对冲前限速 {len(throttled)} 次")
+    assert throttled == [1] and len(attempts) == 2
+    caller.shutdown()
+
+    print("✅ 所有测试用例通过！")
+
+
+if __name__ == '__main__':
+    # 配置日志以查看详细信息
+    logging.basicConfig(level=logging.INFO)
+    test_hedged_caller()
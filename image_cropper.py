@@ -0,0 +1,203 @@
+"""
+图片区域裁剪模块
+使用本地图像分析裁掉状态栏、纯色边框和空白区域，只把有信息量的区域发送给OCR服务
+"""
+
+import io
+import logging
+from typing import Optional, Tuple
+
+from PIL import Image, ImageChops, ImageOps
+
+logger = logging.getLogger(__name__)
+
+
+class ImageCropper:
+    """交易截图感兴趣区域裁剪器"""
+
+    # 高宽比达到该值时视为手机竖屏截图，顶部状态栏会被裁掉
+    TALL_ASPECT_RATIO = 1.6
+    # 状态栏占图片高度的比例（1170×2532 截图约 110px）
+    STATUS_BAR_RATIO = 0.045
+    # 与背景色的灰度差超过该值的像素视为有内容
+    BACKGROUND_TOLERANCE = 12
+    # 分析时使用的缩略图最长边，降低本地计算量
+    ANALYSIS_MAX_SIDE = 512
+    # 裁剪区域四周保留的边距（原图像素）
+    PADDING = 16
+    # 面积节省低于该比例时不裁剪，直接使用原图
+    MIN_AREA_SAVING = 0.15
+    # 裁剪图被判为非交易记录、且置信度低于该值时回退原图重新识别
+    FALLBACK_CONFIDENCE = 0.6
+
+    def needs_full_image(self, result) -> Optional[str]:
+        """
+        判断裁剪图的识别结果是否需要回退原图重新识别
+
+        裁剪可能切掉了金额或平台标识，这类结果和低置信度的非交易记录判断值得用原图再试一次；
+        明确的非交易记录（照片、聊天截图等）用原图识别结论也不会改变，不重复调用
+
+        Args:
+            result: 裁剪图的识别结果（ReceiptInfo 或 ReceiptDecision）
+
+        Returns:
+            回退原因，不需要回退时返回None
+        """
+        if result.is_receipt:
+            if result.amount is None or result.platform is None:
+                return "缺少金额或平台"
+            return None
+        if result.confidence < self.FALLBACK_CONFIDENCE:
+            return "非交易记录判断置信度低"
+        return None
+
+    def find_region(self, image: Image.Image) -> Optional[Tuple[int, int, int, int]]:
+        """
+        计算图片中有信息量的区域
+
+        Args:
+            image: 原始图片
+
+        Returns:
+            原图坐标系下的裁剪框 (left, top, right, bottom)，无需裁剪时返回None
+        """
+        width, height = image.size
+        if width == 0 or height == 0:
+            return None
+
+        analysis = image.convert("L")
+        analysis.thumbnail((self.ANALYSIS_MAX_SIDE, self.ANALYSIS_MAX_SIDE))
+        scale = width / analysis.width
+
+        # 竖屏截图去掉顶部状态栏
+        top_offset = 0
+        if height / width >= self.TALL_ASPECT_RATIO:
+            top_offset = int(analysis.height * self.STATUS_BAR_RATIO)
+        region = analysis.crop((0, top_offset, analysis.width, analysis.height))
+
+        # 以四个角的灰度中位数作为背景色，找出与背景差异明显的内容范围
+        corners = sorted(
+            region.getpixel((x, y))
+            for x in (0, region.width - 1)
+            for y in (0, region.height - 1)
+        )
+        background = corners[len(corners) // 2]
+        diff = ImageChops.difference(region, Image.new("L", region.size, background))
+        mask = diff.point(lambda p: 255 if p > self.BACKGROUND_TOLERANCE else 0)
+        bbox = mask.getbbox()
+        if bbox is None:
+            logger.debug("未找到有效内容区域，跳过裁剪")
+            return None
+
+        left, top, right, bottom = bbox
+        box = (
+            max(0, int(left * scale) - self.PADDING),
+            max(0, int((top + top_offset) * scale) - self.PADDING),
+            min(width, int(right * scale) + self.PADDING),
+            min(height, int((bottom + top_offset) * scale) + self.PADDING),
+        )
+
+        cropped_area = (box[2] - box[0]) * (box[3] - box[1])
+        saving = 1 - cropped_area / (width * height)
+        if saving < self.MIN_AREA_SAVING:
+            logger.debug(f"裁剪仅节省 {saving:.1%} 面积，保留原图")
+            return None
+        return box
+
+    def crop(self, image_bytes: bytes, image_format: str) -> Optional[bytes]:
+        """
+        裁剪图片中有信息量的区域
+
+        Args:
+            image_bytes: 原始图片字节
+            image_format: 图片格式（jpeg/png/...）
+
+        Returns:
+            裁剪后的图片字节（与原图格式一致），无需裁剪或无法解析时返回None
+        """
+        try:
+            with Image.open(io.BytesIO(image_bytes)) as opened:
+                image = ImageOps.exif_transpose(opened)
+                box = self.find_region(image)
+                if box is None:
+                    return None
+
+                cropped = image.crop(box)
+                output = io.BytesIO()
+                if image_format == "png":
+                    cropped.save(output, format="PNG", optimize=True)
+                else:
+                    # 其他格式统一按JPEG输出，调用方需使用jpeg作为图片格式
+                    cropped.convert("RGB").save(output, format="JPEG", quality=95)
+        except Exception as e:
+            logger.warning(f"图片裁剪失败，使用原图: {e}")
+            return None
+
+        logger.info(
+            f"裁剪图片 {image.size[0]}x{image.size[1]} -> "
+            f"{box[2] - box[0]}x{box[3] - box[1]}"
+        )
+        return output.getvalue()
+
+    def output_format(self, image_format: str) -> str:
+        """获取裁剪结果对应的图片格式"""
+        return "png" if image_format == "png" else "jpeg"
+
+
+def test_image_cropper():
+    """测试图片裁剪器功能"""
+    from PIL import ImageDraw
+
+    print("--- 测试图片裁剪器 ---")
+    cropper = ImageCropper()
+
+    # 测试用例1: 竖屏截图，顶部状态栏 + 中部金额区域 + 大面积空白
+    screenshot = Image.new("RGB", (1170, 2532), "white")
+    draw = ImageDraw.Draw(screenshot)
+    draw.rectangle((0, 0, 1170, 100), fill=(30, 30, 30))  # 状态栏
+    draw.rectangle((200, 600, 970, 1200), fill=(20, 160, 60))  # 金额区域
+    buffer = io.BytesIO()
+    screenshot.save(buffer, format="PNG")
+    cropped_bytes = cropper.crop(buffer.getvalue(), "png")
+    assert cropped_bytes is not None
+    with Image.open(io.BytesIO(cropped_bytes)) as cropped:
+        print(f"测试1 - 裁剪结果尺寸: {cropped.size}")
+        assert cropped.width < 1170 and cropped.height < 1000
+        assert cropped.height >= 600
+
+    # 测试用例2: 内容铺满全图，不值得裁剪
+    full = Image.new("RGB", (800, 800), "white")
+    ImageDraw.Draw(full).rectangle((5, 5, 795, 795), fill=(200, 0, 0))
+    buffer = io.BytesIO()
+    full.save(buffer, format="JPEG")
+    print("测试2 - 内容铺满的图片不裁剪")
+    assert cropper.crop(buffer.getvalue(), "jpeg") is None
+
+    # 测试用例3: 纯色图片没有可识别内容
+    blank = Image.new("RGB", (400, 900), "white")
+    buffer = io.BytesIO()
+    blank.save(buffer, format="PNG")
+    print("测试3 - 纯色图片不裁剪")
+    assert cropper.crop(buffer.getvalue(), "png") is None
+
+    # 测试用例4: 无法解析的数据回退到原图
+    print("测试4 - 无效图片数据回退")
+    assert cropper.crop(b"not an image", "jpeg") is None
+
+    # 测试用例5: 只有可能被裁剪影响的结果回退原图
+    from models import ReceiptInfo
+    print("测试5 - 回退原图的判断")
+    assert cropper.needs_full_image(ReceiptInfo(is_receipt=False, confidence=0.95, raw_text="风景")) is None
+    assert cropper.needs_full_image(ReceiptInfo(is_receipt=False, confidence=0.3, raw_text="")) is not None
+    assert cropper.needs_full_image(ReceiptInfo(is_receipt=True, platform="微信支付", confidence=0.9, raw_text="")) is not None
+    assert cropper.needs_full_image(
+        ReceiptInfo(is_receipt=True, platform="微信支付", amount=12.0, confidence=0.9, raw_text="")
+    ) is None
+
+    print("✅ 所有测试用例通过！")
+
+
+if __name__ == '__main__':
+    # 配置日志以查看详细信息
+    logging.basicConfig(level=logging.INFO)
+    test_image_cropper()
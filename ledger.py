@@ -0,0 +1,361 @@
+"""
+交易台账模块
+将每条识别出的交易记录写入本地SQLite台账，支持按时间、商户、金额快速查询
+"""
+
+import logging
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from models import ReceiptData
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS receipts (
+    id INTEGER PRIMARY KEY,
+    original_name TEXT NOT NULL,
+    file_path TEXT,
+    amount_cents INTEGER,
+    currency TEXT NOT NULL DEFAULT '元',
+    transaction_time TEXT,
+    tx_time TEXT,
+    merchant TEXT,
+    platform TEXT,
+    confidence REAL,
+    processed_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_receipts_tx_time ON receipts (tx_time);
+CREATE INDEX IF NOT EXISTS idx_receipts_merchant ON receipts (merchant, tx_time);
+CREATE INDEX IF NOT EXISTS idx_receipts_amount ON receipts (amount_cents, tx_time);
+-- 每个文件在台账中只有一条记录，重新识别时更新而不是追加
+CREATE UNIQUE INDEX IF NOT EXISTS idx_receipts_file_path ON receipts (file_path);
+"""
+
+UPSERT_RECEIPT = """
+INSERT INTO receipts (
+    original_name, file_path, amount_cents, currency, transaction_time,
+    tx_time, merchant, platform, confidence, processed_at
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (file_path) DO UPDATE SET
+    amount_cents = excluded.amount_cents,
+    currency = excluded.currency,
+    transaction_time = excluded.transaction_time,
+    tx_time = excluded.tx_time,
+    merchant = excluded.merchant,
+    platform = excluded.platform,
+    confidence = excluded.confidence,
+    processed_at = excluded.processed_at
+"""
+
+# 匹配 "2025-03-12 12:30:45"、"2025年3月12日 12:30"、"2025/03/12" 等时间格式
+TIME_PATTERN = re.compile(
+    r"(\d{4})\s*[年\-/.]\s*(\d{1,2})\s*[月\-/.]\s*(\d{1,2})\s*日?"
+    r"(?:\s*(\d{1,2})\s*[:：]\s*(\d{2})(?:\s*[:：]\s*(\d{2}))?)?"
+)
+
+
+def normalize_time(text: Optional[str]) -> Optional[str]:
+    """
+    将模型返回的交易时间规范化为 "YYYY-MM-DD HH:MM:SS"
+
+    Returns:
+        规范化后的时间字符串，无法解析时返回None
+    """
+    if not text:
+        return None
+    match = TIME_PATTERN.search(text)
+    if not match:
+        return None
+    year, month, day, hour, minute, second = (int(g) if g else 0 for g in match.groups())
+    try:
+        return datetime(year, month, day, hour, minute, second).strftime("%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return None
+
+
+def to_cents(amount: Optional[float]) -> Optional[int]:
+    """金额转换为分，避免浮点比较误差"""
+    if amount is None:
+        return None
+    return int(round(amount * 100))
+
+
+def month_range(month: str) -> Tuple[str, str]:
+    """
+    计算月份对应的时间范围
+
+    Args:
+        month: 月份，格式为 YYYY-MM
+
+    Returns:
+        (起始时间, 结束时间)，左闭右开
+    """
+    start = datetime.strptime(month, "%Y-%m")
+    if start.month == 12:
+        end = start.replace(year=start.year + 1, month=1)
+    else:
+        end = start.replace(month=start.month + 1)
+    return start.strftime("%Y-%m-%d %H:%M:%S"), end.strftime("%Y-%m-%d %H:%M:%S")
+
+
+class Ledger:
+    """本地交易台账"""
+
+    def __init__(self, db_path: Path):
+        """
+        初始化交易台账
+
+        Args:
+            db_path: SQLite数据库文件路径，不存在时自动创建
+        """
+        self.db_path = db_path
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.executescript(SCHEMA)
+        logger.info(f"交易台账已打开: {db_path}")
+
+    def record(self, source: Union[str, Path], file_path: Optional[Path], receipt_info: ReceiptData):
+        """写入单条交易记录"""
+        self.record_many([(source, file_path, receipt_info)])
+
+    def record_many(self, entries: Iterable[Tuple[Union[str, Path], Optional[Path], ReceiptData]]) -> int:
+        """
+        在一个事务中批量写入交易记录
+
+        以文件路径为唯一标识：同一文件重新识别时更新已有记录而不是追加。
+        文件本次运行前的路径已在台账中时（之前运行重命名过的文件），该记录移到新路径，保留最初的原始文件名
+
+        Args:
+            entries: (本次运行前的文件路径或原始文件名, 重命名后路径, 交易记录信息) 列表
+
+        Returns:
+            写入的记录条数
+        """
+        processed_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        moves = []
+        rows = []
+        for source, file_path, info in entries:
+            if file_path and isinstance(source, Path) and source != file_path:
+                moves.append((str(file_path), str(source)))
+            rows.append((
+                Path(source).name,
+                str(file_path) if file_path else None,
+                to_cents(info.amount),
+                info.currency,
+                info.transaction_time,
+                normalize_time(info.transaction_time),
+                info.merchant,
+                info.platform,
+                info.confidence,
+                processed_at,
+            ))
+        with self._lock, self._conn:
+            # 目标路径上的旧记录属于已不在该路径的文件，被移动过来的记录替换
+            self._conn.executemany("UPDATE OR REPLACE receipts SET file_path = ? WHERE file_path = ?", moves)
+            self._conn.executemany(UPSERT_RECEIPT, rows)
+        logger.info(f"交易台账写入 {len(rows)} 条记录")
+        return len(rows)
+
+    def totals_by_merchant_month(self, month: Optional[str] = None) -> List[Dict]:
+        """
+        按月份和商户汇总交易金额
+
+        Args:
+            month: 只统计指定月份（YYYY-MM），默认统计全部
+
+        Returns:
+            汇总行列表，包含 month、merchant、count、total
+        """
+        sql = """
+            SELECT substr(tx_time, 1, 7) AS month, merchant,
+                   COUNT(*) AS count, SUM(amount_cents) AS total_cents
+            FROM receipts
+            WHERE tx_time IS NOT NULL
+        """
+        params: List = []
+        if month:
+            start, end = month_range(month)
+            sql += " AND tx_time >= ? AND tx_time < ?"
+            params.extend([start, end])
+        sql += " GROUP BY month, merchant ORDER BY month, total_cents DESC"
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [
+            {
+                "month": row["month"],
+                "merchant": row["merchant"],
+                "count": row["count"],
+                "total": (row["total_cents"] or 0) / 100,
+            }
+            for row in rows
+        ]
+
+    def find(
+        self,
+        amount: Optional[float] = None,
+        month: Optional[str] = None,
+        merchant: Optional[str] = None,
+        platform: Optional[str] = None,
+        limit: int = 100,
+    ) -> List[Dict]:
+        """
+        按条件查找交易记录
+
+        Args:
+            amount: 精确金额（元）
+            month: 交易月份（YYYY-MM）
+            merchant: 商户名称（模糊匹配）
+            platform: 支付平台
+            limit: 最多返回条数
+
+        Returns:
+            交易记录列表，按交易时间排序
+        """
+        clauses = []
+        params: List = []
+        if amount is not None:
+            clauses.append("amount_cents = ?")
+            params.append(to_cents(amount))
+        if month:
+            start, end = month_range(month)
+            clauses.append("tx_time >= ? AND tx_time < ?")
+            params.extend([start, end])
+        if merchant:
+            clauses.append("merchant LIKE ?")
+            params.append(f"%{merchant}%")
+        if platform:
+            clauses.append("platform = ?")
+            params.append(platform)
+
+        sql = "SELECT * FROM receipts"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY tx_time LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def transactions_between(self, start: str, end: str) -> List[Dict]:
+        """
+        查找交易时间在范围内、金额已知的交易记录
+
+        Args:
+            start: 起始时间（含）
+            end: 结束时间（含）
+
+        Returns:
+            交易记录行，金额保留为分
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT original_name, file_path, amount_cents, tx_time, merchant, platform
+                FROM receipts
+                WHERE tx_time >= ? AND tx_time <= ? AND amount_cents IS NOT NULL
+                """,
+                (start, end),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def _row_to_dict(self, row: sqlite3.Row) -> Dict:
+        """数据库行转换为字典，金额还原为元"""
+        record = dict(row)
+        cents = record.pop("amount_cents")
+        record["amount"] = cents / 100 if cents is not None else None
+        return record
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+
+
+def test_ledger():
+    """测试交易台账功能"""
+    import tempfile
+
+    from models import ReceiptInfo
+
+    print("--- 测试交易台账 ---")
+
+    # 测试用例1: 时间规范化
+    print("测试1 - 时间规范化")
+    assert normalize_time("2025年03月12日 12:30:45") == "2025-03-12 12:30:45"
+    assert normalize_time("2025/3/5 9:05") == "2025-03-05 09:05:00"
+    assert normalize_time("支付时间 2025-03-12") == "2025-03-12 00:00:00"
+    assert normalize_time("昨天") is None
+    assert normalize_time(None) is None
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        ledger = Ledger(Path(temp_dir) / "ledger.db")
+        ledger.record_many([
+            ("IMG_001.jpg", Path("88.00元_支付凭证.jpg"), ReceiptInfo(
+                is_receipt=True, platform="微信支付", amount=88.00, merchant="星巴克",
+                transaction_time="2025年03月12日 12:30:45", confidence=0.9, raw_text="")),
+            ("IMG_002.jpg", Path("32.50元_支付凭证.jpg"), ReceiptInfo(
+                is_receipt=True, platform="支付宝", amount=32.50, merchant="星巴克",
+                transaction_time="2025-03-20 08:00:00", confidence=0.9, raw_text="")),
+            ("IMG_003.jpg", Path("88.00元_支付凭证_01.jpg"), ReceiptInfo(
+                is_receipt=True, platform="微信支付", amount=88.00, merchant="全家",
+                transaction_time="2025-04-01 19:00", confidence=0.9, raw_text="")),
+        ])
+
+        # 测试用例2: 按商户和月份汇总
+        totals = ledger.totals_by_merchant_month()
+        print(f"测试2 - 商户月度汇总: {totals}")
+        assert totals[0] == {"month": "2025-03", "merchant": "星巴克", "count": 2, "total": 120.5}
+        assert totals[1]["month"] == "2025-04"
+
+        # 测试用例3: 查找三月份的88元交易
+        found = ledger.find(amount=88.00, month="2025-03")
+        print(f"测试3 - 三月份88元交易: {[row['original_name'] for row in found]}")
+        assert len(found) == 1
+        assert found[0]["original_name"] == "IMG_001.jpg"
+        assert found[0]["amount"] == 88.00
+
+        # 测试用例4: 查询使用索引
+        with ledger._lock:
+            plan = ledger._conn.execute(
+                "EXPLAIN QUERY PLAN SELECT * FROM receipts WHERE amount_cents = ? AND tx_time >= ?",
+                (8800, "2025-03-01"),
+            ).fetchall()
+        print(f"测试4 - 查询计划: {[row[-1] for row in plan]}")
+        assert any("idx_receipts_amount" in row[-1] for row in plan)
+
+        # 测试用例5: 按时间范围查找交易
+        rows = ledger.transactions_between("2025-03-12 00:00:00", "2025-03-31 23:59:59")
+        print(f"测试5 - 三月份交易: {[row['original_name'] for row in rows]}")
+        assert sorted(row["original_name"] for row in rows) == ["IMG_001.jpg", "IMG_002.jpg"]
+        assert rows[0]["amount_cents"] in (8800, 3250)
+
+        # 测试用例6: 重新识别同一文件时更新记录，重命名后的记录移到新路径并保留原始文件名
+        ledger.record_many([
+            (Path("88.00元_支付凭证.jpg"), Path("88.00元_支付凭证.jpg"), ReceiptInfo(
+                is_receipt=True, platform="微信支付", amount=88.00, merchant="星巴克",
+                transaction_time="2025-03-12 12:30:45", confidence=0.95, raw_text="")),
+            (Path("32.50元_支付凭证.jpg"), Path("35.00元_支付凭证.jpg"), ReceiptInfo(
+                is_receipt=True, platform="支付宝", amount=35.00, merchant="星巴克",
+                transaction_time="2025-03-20 08:00:00", confidence=0.9, raw_text="")),
+        ])
+        totals = ledger.totals_by_merchant_month("2025-03")
+        print(f"测试6 - 重新识别后的汇总: {totals}")
+        assert totals == [{"month": "2025-03", "merchant": "星巴克", "count": 2, "total": 123.0}]
+        moved = ledger.find(amount=35.00)
+        assert moved[0]["original_name"] == "IMG_002.jpg" and moved[0]["file_path"] == "35.00元_支付凭证.jpg"
+        ledger.close()
+
+    print("✅ 所有测试用例通过！")
+
+
+if __name__ == '__main__':
+    # 配置日志以查看详细信息
+    logging.basicConfig(level=logging.INFO)
+    test_ledger()
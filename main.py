@@ -3,14 +3,28 @@ ReceiptName 主程序
 交易记录图片识别和自动重命名工具
 """
 
+import argparse
+import cProfile
 import logging
+import pstats
+from functools import partial
 from pathlib import Path
-from typing import Dict, List
+from typing import Any, Dict, List, Optional
 
+from openai import OpenAI
+
+from archive_source import ArchiveSource, process_archive
+from batch_job import BatchJob
 from config import config, get_executable_dir
+from dedupe import IndexedTransaction, find_duplicates
 from ocr_service import OCRService
 from file_renamer import FileRenamer
-from models import ReceiptInfo
+from ledger import Ledger
+from models import ReceiptData
+from receipt_detector import ReceiptDetector
+from recorder import RECORD_MODE, REPLAY_MODE, ResponseRecorder
+from service import MicroBatcher, RecognitionServer
+from tracing import tracer
 
 # 配置日志
 logging.basicConfig(level=getattr(logging, config.log_level))
@@ -26,7 +40,7 @@ def print_banner():
     print("=" * 50)
 
 
-def print_statistics(results: Dict[Path, ReceiptInfo], rename_results: Dict[Path, Path]):
+def print_statistics(results: Dict[Path, ReceiptData], rename_results: Dict[Path, Path]):
     """打印处理统计信息"""
     total_files = len(results)
     receipt_count = sum(1 for info in results.values() if info.is_receipt)
@@ -41,7 +55,69 @@ def print_statistics(results: Dict[Path, ReceiptInfo], rename_results: Dict[Path
     print(f"重命名成功率: {renamed_count/receipt_count*100:.1f}%" if receipt_count > 0 else "重命名成功率: 0%")
 
 
-def print_details(results: Dict[Path, ReceiptInfo], rename_results: Dict[Path, Path]):
+def print_service_stats(stats: Dict[str, Any]):
+    """打印OCR服务运行统计"""
+    memory = stats.get("memory")
+    if memory:
+        print("\n🧠 在途载荷")
+        print("=" * 30)
+        print(f"当前/峰值: {memory['in_flight_bytes'] / 1024 / 1024:.1f}MB / "
+              f"{memory['peak_bytes'] / 1024 / 1024:.1f}MB（上限 {memory['limit_bytes'] / 1024 / 1024:.0f}MB）")
+        print(f"排队等待: {memory['waits']} 次 | 超大文件单独处理: {memory['oversized']} 个")
+    
+    api = stats.get("api")
+    if api:
+        labels = {"full": "完整输出", "lean": "精简输出", "transcribe": "按需转写"}
+        print("\n📈 API用量")
+        print("=" * 30)
+        for kind, usage in api.items():
+            print(f"{labels.get(kind, kind)}: {usage['calls']} 次 | 平均延迟 {usage['avg_latency_s']:.2f}s | "
+                  f"平均token 输入 {usage['avg_prompt_tokens']:.0f} / 输出 {usage['avg_completion_tokens']:.0f}")
+        if "lean" in api and "transcribe" in api:
+            # 按需转写的输出token近似于完整输出模式下 raw_text 的开销
+            saved = (api["lean"]["calls"] - api["transcribe"]["calls"]) * api["transcribe"]["avg_completion_tokens"]
+            print(f"精简输出估计节省输出token: 约 {max(saved, 0):.0f}")
+    
+    hedging = stats.get("hedging")
+    if hedging:
+        print("\n🪁 请求对冲")
+        print("=" * 30)
+        print(f"API调用次数: {hedging['calls']}")
+        print(f"对冲请求: {hedging['hedges_sent']}（对冲胜出 {hedging['hedges_won']}，预算拒绝 {hedging['budget_exhausted']}，"
+              f"结果被丢弃的请求 {hedging['wasted_calls']}）")
+        print(f"当前对冲延迟: {hedging['hedge_delay_s']:.2f}s")
+        if hedging["latency_p50_s"] is not None:
+            print(f"调用延迟 p50/p99: {hedging['latency_p50_s']:.2f}s / {hedging['latency_p99_s']:.2f}s")
+    print_cache_stats(stats)
+    
+    recorder = stats.get("recorder")
+    if recorder:
+        print("\n📼 录制回放")
+        print("=" * 30)
+        if recorder["mode"] == RECORD_MODE:
+            print(f"已录制响应: {recorder['recorded']}")
+        else:
+            print(f"已回放响应: {recorder['replayed']} | 缺少录制: {recorder['missing']}")
+
+
+def print_cache_stats(stats: Dict[str, Any]):
+    """打印识别结果缓存统计"""
+    cache = stats.get("cache")
+    if cache:
+        print("\n🗃️  结果缓存")
+        print("=" * 30)
+        print(f"本地命中: {cache['hits_local']} | 远程命中: {cache['hits_remote']} | 未命中: {cache['misses']}")
+        if cache["remote_errors"]:
+            print(f"远程缓存错误: {cache['remote_errors']}（已降级为本地缓存）")
+        if cache["remote_writes_dropped"]:
+            print(f"未写入远程缓存: {cache['remote_writes_dropped']} 条（只保存在本地缓存）")
+    hashing = stats.get("hashing")
+    if hashing:
+        print(f"内容摘要: 索引命中 {hashing['indexed']} | 重命名后复用 {hashing['moved']} | "
+              f"重新计算 {hashing['hashed']}（{hashing['hashed_bytes'] / 1024 / 1024:.1f}MB）")
+
+
+def print_details(results: Dict[Path, ReceiptData], rename_results: Dict[Path, Path]):
     """打印详细处理结果"""
     print("\n📋 详细结果")
     print("=" * 50)
@@ -71,12 +147,404 @@ def print_details(results: Dict[Path, ReceiptInfo], rename_results: Dict[Path, P
         print()
 
 
-def main():
-    """主程序入口"""
+def print_duplicates(duplicates: Dict[Path, List[IndexedTransaction]]):
+    """打印疑似重复的交易"""
+    if not duplicates:
+        return
+    
+    print(f"\n🔁 疑似重复交易（{len(duplicates)} 个，请确认是否同一笔支付的不同截图）")
+    print("=" * 50)
+    for path, matches in duplicates.items():
+        print(f"⚠️  {path.name}")
+        for match in matches:
+            source = "之前运行" if match.from_ledger else "本批"
+            print(f"    ↔ {match.label}（{source}）")
+    print()
+
+
+def detect_duplicates(receipt_files: Dict[Path, ReceiptData]) -> Dict[Path, List[IndexedTransaction]]:
+    """检测本批交易记录之间、以及与交易台账中之前运行的记录之间的疑似重复交易"""
+    ledger = None
+    try:
+        if config.ledger_path.exists():
+            ledger = Ledger(config.ledger_path)
+        with tracer.span("detect_duplicates", count=len(receipt_files)):
+            return find_duplicates(receipt_files, config.duplicate_window_seconds, ledger)
+    except Exception as e:
+        # 重复检测失败不影响重命名
+        logger.error(f"重复交易检测失败: {e}")
+        return {}
+    finally:
+        if ledger is not None:
+            ledger.close()
+
+
+def record_to_ledger(receipt_files: Dict[Path, ReceiptData], rename_results: Dict[Path, Optional[Path]]):
+    """将重命名成功的交易记录写入交易台账"""
+    entries = [
+        (original_path, new_path, receipt_files[original_path])
+        for original_path, new_path in rename_results.items()
+        if new_path is not None
+    ]
+    if not entries:
+        return
+    
+    try:
+        ledger = Ledger(config.ledger_path)
+        try:
+            with tracer.span("ledger_write", category="filesystem", count=len(entries)):
+                ledger.record_many(entries)
+        finally:
+            ledger.close()
+        print(f"📒 已写入交易台账: {config.ledger_path}（{len(entries)} 条）")
+    except Exception as e:
+        # 台账写入失败不影响重命名结果
+        logger.error(f"写入交易台账失败: {e}")
+        print(f"⚠️  写入交易台账失败: {e}")
+
+
+def run_query(args: argparse.Namespace):
+    """查询交易台账"""
+    if not config.ledger_path.exists():
+        print(f"⚠️  交易台账不存在: {config.ledger_path}")
+        return
+    
+    ledger = Ledger(config.ledger_path)
+    try:
+        if args.by_merchant_month:
+            rows = ledger.totals_by_merchant_month(args.month)
+            print("\n📊 商户月度汇总")
+            print("=" * 50)
+            for row in rows:
+                merchant = row["merchant"] or "未知商户"
+                print(f"{row['month']} | {merchant} | {row['count']} 笔 | {row['total']:.2f}元")
+        else:
+            rows = ledger.find(
+                amount=args.amount,
+                month=args.month,
+                merchant=args.merchant,
+                platform=args.platform,
+                limit=args.limit,
+            )
+            print("\n🔎 查询结果")
+            print("=" * 50)
+            for row in rows:
+                amount_str = f"{row['amount']:.2f}元" if row["amount"] is not None else "未知金额"
+                print(f"{row['tx_time'] or row['transaction_time'] or '未知时间'} | {amount_str} | "
+                      f"{row['merchant'] or '未知商户'} | {row['platform'] or '未知平台'}")
+                print(f"    📝 文件: {row['file_path'] or row['original_name']}")
+        
+        if not rows:
+            print("没有找到匹配的交易记录")
+        else:
+            print(f"\n共 {len(rows)} 条")
+    finally:
+        ledger.close()
+
+
+def create_ocr_service(args: argparse.Namespace) -> OCRService:
+    """根据 --record / --replay 参数创建OCR服务"""
+    recorder = None
+    if args.record:
+        recorder = ResponseRecorder(args.record, RECORD_MODE)
+        print(f"🎙️  录制模式：API响应保存到 {args.record}")
+    elif args.replay:
+        recorder = ResponseRecorder(args.replay, REPLAY_MODE)
+        print(f"📼 回放模式：使用 {args.replay} 中的录制响应，不调用API")
+    return OCRService(recorder=recorder)
+
+
+def validate_config(args: argparse.Namespace) -> bool:
+    """验证配置，回放模式不需要API配置"""
+    if args.replay:
+        return True
+    return config.validate()
+
+
+def run_archive(args: argparse.Namespace):
+    """识别压缩包中的图片，结果写入重命名副本、交易台账和 JSONL"""
     print_banner()
     
-    # 验证配置
+    if not validate_config(args):
+        print("\n❌ 配置验证失败")
+        return
+    
+    if args.output_archive and args.output_archive.resolve() == args.archive.resolve():
+        print("❌ --output-archive 不能与输入压缩包相同，否则写出副本时会截断正在读取的源文件")
+        return
+    
+    try:
+        source = ArchiveSource(args.archive)
+    except (OSError, ValueError) as e:
+        print(f"❌ 无法打开压缩包: {e}")
+        return
+    
+    ocr_service = None
+    try:
+        print("\n🔧 初始化服务...")
+        ocr_service = create_ocr_service(args)
+        file_renamer = FileRenamer(target_directory=args.archive.parent)
+        
+        print(f"\n🔍 开始识别压缩包: {args.archive.name}")
+        results = process_archive(source, ocr_service, file_renamer, args.jsonl, ReceiptDetector())
+        receipts = [(member, new_name, record) for member, new_name, record in results if record.is_receipt]
+        print(f"✅ 共 {len(results)} 张图片，识别到 {len(receipts)} 个交易记录")
+        
+        # 交易记录在压缩包中的位置：有重命名副本时指向副本中的新成员
+        locations = {member: args.archive / member for member, _, _ in receipts}
+        if args.output_archive and receipts:
+            final_names = source.write_renamed_copy(
+                args.output_archive,
+                {member: new_name for member, new_name, _ in receipts}
+            )
+            locations = {member: args.output_archive / final_names[member] for member in locations}
+            print(f"📦 已写出重命名后的压缩包: {args.output_archive}")
+        if args.jsonl:
+            print(f"📄 已写出识别结果: {args.jsonl}")
+        
+        print_duplicates(detect_duplicates({args.archive / member: record for member, _, record in receipts}))
+        
+        if not args.no_ledger and receipts:
+            record_to_ledger(
+                {args.archive / member: record for member, _, record in receipts},
+                {args.archive / member: locations[member] for member, _, _ in receipts}
+            )
+        
+        print_service_stats(ocr_service.get_stats())
+        print("🎉 处理完成！")
+        
+    except KeyboardInterrupt:
+        print("\n\n⚠️  用户中断操作")
+    except Exception as e:
+        logger.error(f"程序执行出错: {e}")
+        print(f"\n❌ 程序执行出错: {e}")
+    finally:
+        if ocr_service is not None:
+            ocr_service.close()
+
+
+def apply_results(
+    args: argparse.Namespace,
+    ocr_results: Dict[Path, ReceiptData],
+    ocr_service: OCRService,
+    file_renamer: FileRenamer,
+    detector: ReceiptDetector,
+):
+    """对识别结果做二次检测，重命名交易记录文件并写入交易台账"""
+    # 关键字和正则二次检测，精简输出模式下需要文本回退时按需转写
+    for path, info in ocr_results.items():
+        fetch_text = partial(ocr_service.transcribe, path) if ocr_service.lean_schema else None
+        detector.detect(info, fetch_text)
+    
+    # 过滤出交易记录
+    receipt_files = {path: info for path, info in ocr_results.items() if info.is_receipt}
+    
+    if not args.dry_run:
+        # 识别成功的非交易记录也记入已处理清单；识别失败的结果置信度为0，下次运行重试
+        file_renamer.mark_non_receipts([
+            path for path, info in ocr_results.items() if not info.is_receipt and info.confidence > 0
+        ])
+    
+    if not receipt_files:
+        print("⚠️  没有识别到交易记录")
+        print_statistics(ocr_results, {})
+        print_service_stats(ocr_service.get_stats())
+        return
+    
+    print(f"✅ 识别到 {len(receipt_files)} 个交易记录")
+    
+    # 写入交易台账之前检测重复，避免与本批自己的记录匹配
+    duplicates = detect_duplicates(receipt_files)
+    
+    if args.dry_run:
+        # 演练模式只生成新文件名，不改动文件和交易台账
+        print("\n🧪 演练模式：只生成新文件名，不实际重命名")
+        rename_results = {
+            path: path.parent / file_renamer.generate_new_filename(info, path.name)
+            for path, info in receipt_files.items()
+        }
+    else:
+        # 文件重命名
+        print(f"\n📝 开始重命名 {len(receipt_files)} 个交易记录文件...")
+        rename_results = file_renamer.batch_rename(receipt_files)
+        record_to_ledger(receipt_files, rename_results)
+    
+    # 显示结果
+    print_statistics(ocr_results, rename_results)
+    print_service_stats(ocr_service.get_stats())
+    print_details(ocr_results, rename_results)
+    print_duplicates(duplicates)
+    
+    print("🎉 处理完成！")
+
+
+def scan_pending_images(args: argparse.Namespace, file_renamer: FileRenamer) -> List[Path]:
+    """
+    扫描待处理的图片文件，默认跳过之前运行已经处理过的文件
+
+    回放模式用于按新规则重跑录制过的文件，录制时这些文件已经处理过，因此回放隐含 --reprocess
+    """
+    image_files = file_renamer.get_supported_image_files()
+    if image_files and not (args.reprocess or args.replay):
+        image_files, processed_files = file_renamer.exclude_processed(image_files)
+        if processed_files:
+            print(f"⏭️  跳过 {len(processed_files)} 个已处理的文件（使用 --reprocess 重新识别）")
+    return image_files
+
+
+def run_batch(args: argparse.Namespace):
+    """以离线批量推理任务识别目录中的图片，完成后批量重命名"""
+    print_banner()
+    
+    if args.replay:
+        print("❌ 回放模式不需要提交批量任务，请直接运行 python main.py --replay DIR")
+        return
     if not config.validate():
+        print("\n❌ 配置验证失败")
+        return
+    
+    ocr_service = None
+    try:
+        work_directory = get_executable_dir()
+        batch_dir = args.batch_dir or work_directory / ".receiptname_batch"
+        
+        print("\n🔧 初始化服务...")
+        ocr_service = create_ocr_service(args)
+        file_renamer = FileRenamer(target_directory=work_directory)
+        client = OpenAI(api_key=config.ark_api_key, base_url=config.batch_base_url)
+        job = BatchJob(
+            ocr_service,
+            client,
+            batch_dir,
+            max_requests=config.batch_max_requests,
+            max_bytes=config.batch_max_mb * 1024 * 1024,
+            poll_interval=config.batch_poll_interval,
+        )
+        if args.restart:
+            job.state = None
+        
+        if job.pending:
+            print(f"\n♻️  继续未完成的批量任务: {job.state_path}")
+            image_files = []
+        else:
+            print("\n📂 扫描图片文件...")
+            image_files = scan_pending_images(args, file_renamer)
+            if not image_files:
+                print("✅ 没有需要处理的图片文件")
+                return
+            print(f"✅ 找到 {len(image_files)} 个图片文件")
+        
+        print(f"\n📦 提交批量推理任务（分片目录: {batch_dir}），完成前可以中断，再次运行会继续等待")
+        ocr_results = job.run(image_files)
+        
+        apply_results(args, ocr_results, ocr_service, file_renamer, ReceiptDetector())
+        
+    except KeyboardInterrupt:
+        print("\n\n⚠️  用户中断操作，再次运行 batch 子命令会继续等待已提交的任务")
+    except Exception as e:
+        logger.error(f"程序执行出错: {e}")
+        print(f"\n❌ 程序执行出错: {e}")
+    finally:
+        if ocr_service is not None:
+            ocr_service.close()
+
+
+def run_serve(args: argparse.Namespace):
+    """启动常驻的识别 HTTP 服务"""
+    print_banner()
+    
+    if not validate_config(args):
+        print("\n❌ 配置验证失败")
+        return
+    
+    print("\n🔧 初始化服务...")
+    ocr_service = create_ocr_service(args)
+    batcher = MicroBatcher(
+        ocr_service,
+        detector=ReceiptDetector(),
+        max_batch=config.service_max_batch,
+        window=config.service_batch_window_ms / 1000,
+        workers=config.service_workers,
+        rate_limit=config.service_rate_limit,
+    ).start()
+    server = RecognitionServer(
+        batcher,
+        host=args.host or config.service_host,
+        port=args.port if args.port is not None else config.service_port,
+    )
+    
+    print(f"\n🌐 识别服务已启动: {server.url}")
+    print(f"   POST {server.url}/recognize   上传图片（原始请求体或 multipart 的 file 字段），返回识别结果 JSON")
+    print(f"   GET  {server.url}/health      健康检查")
+    print(f"   GET  {server.url}/latency     批次和延迟统计")
+    print("按 Ctrl+C 停止服务")
+    
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n\n⚠️  正在停止服务...")
+    finally:
+        server.stop()
+        batcher.close()
+        if ocr_service.cache is not None:
+            ocr_service.cache.flush()
+    
+    stats = batcher.get_stats()
+    print(f"\n📨 共处理 {stats['requests']} 个请求，{stats['batches']} 个批次，合并重复图片 {stats['coalesced']} 张")
+    print_service_stats(ocr_service.get_stats())
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """构建命令行参数解析器"""
+    parser = argparse.ArgumentParser(
+        prog="receiptname",
+        description="交易记录图片识别和自动重命名工具"
+    )
+    parser.add_argument("--trace", type=Path, metavar="PATH",
+                        help="记录各阶段耗时并导出 Chrome trace JSON（可在 Perfetto 中查看）")
+    parser.add_argument("--profile", action="store_true", help="使用 cProfile 运行并打印最耗时的函数")
+    parser.add_argument("--profile-top", type=int, default=25, metavar="N", help="--profile 打印的函数数量")
+    parser.add_argument("--profile-output", type=Path, metavar="PATH", help="保存 cProfile 原始数据，供 snakeviz 等工具分析")
+    recording = parser.add_mutually_exclusive_group()
+    recording.add_argument("--record", type=Path, metavar="DIR", help="按图片内容哈希保存每次API原始响应")
+    recording.add_argument("--replay", type=Path, metavar="DIR", help="使用录制的API响应代替API调用，不产生网络请求")
+    parser.add_argument("--dry-run", action="store_true", help="只生成新文件名，不实际重命名也不写入交易台账")
+    parser.add_argument("--reprocess", action="store_true", help="重新识别之前运行已经处理过的文件（--replay 时自动开启）")
+    subparsers = parser.add_subparsers(dest="command")
+    
+    query_parser = subparsers.add_parser("query", help="查询交易台账，无需重新识别")
+    query_parser.add_argument("--by-merchant-month", action="store_true", help="按月份和商户汇总金额")
+    query_parser.add_argument("--month", help="交易月份，格式为 YYYY-MM")
+    query_parser.add_argument("--amount", type=float, help="交易金额（元）")
+    query_parser.add_argument("--merchant", help="商户名称（模糊匹配）")
+    query_parser.add_argument("--platform", help="支付平台")
+    query_parser.add_argument("--limit", type=int, default=100, help="最多显示条数")
+    
+    archive_parser = subparsers.add_parser("archive", help="直接识别 zip/tar 压缩包中的图片，不解压到磁盘")
+    archive_parser.add_argument("archive", type=Path, help="zip 或 tar(.gz/.bz2/.xz) 压缩包路径")
+    archive_parser.add_argument("--output-archive", type=Path, metavar="PATH",
+                                help="写出交易记录成员已重命名的压缩包副本")
+    archive_parser.add_argument("--jsonl", type=Path, metavar="PATH", help="逐行写出每张图片的识别结果")
+    archive_parser.add_argument("--no-ledger", action="store_true", help="不写入交易台账")
+    
+    batch_parser = subparsers.add_parser("batch", help="以离线批量推理任务识别目录中的图片，成本更低但需要等待")
+    batch_parser.add_argument("--batch-dir", type=Path, metavar="DIR",
+                              help="批量文件和任务状态目录，默认为可执行文件目录下的 .receiptname_batch")
+    batch_parser.add_argument("--restart", action="store_true", help="放弃未完成的批量任务，重新提交")
+    
+    serve_parser = subparsers.add_parser("serve", help="启动常驻的识别 HTTP 服务，供其他应用上传图片识别")
+    serve_parser.add_argument("--host", help="监听地址，默认为 SERVICE_HOST")
+    serve_parser.add_argument("--port", type=int, help="监听端口，默认为 SERVICE_PORT")
+    
+    return parser
+
+
+def run_pipeline(args: argparse.Namespace):
+    """识别并重命名可执行文件目录下的交易记录图片"""
+    print_banner()
+    
+    # 验证配置
+    if not validate_config(args):
         print("\n❌ 配置验证失败")
         print("\n📝 配置说明：")
         print("1. 复制 env.example 为 .env")
@@ -87,21 +555,23 @@ def main():
     # 显示当前配置
     config.print_config()
     
+    ocr_service = None
     try:
         # 获取可执行文件所在目录作为工作目录
         work_directory = get_executable_dir()
         
         # 初始化服务
         print("\n🔧 初始化服务...")
-        ocr_service = OCRService()
+        ocr_service = create_ocr_service(args)
         file_renamer = FileRenamer(target_directory=work_directory)
+        detector = ReceiptDetector()
         
         # 扫描图片文件
         print("\n📂 扫描图片文件...")
-        image_files = file_renamer.get_supported_image_files()
+        image_files = scan_pending_images(args, file_renamer)
         
         if not image_files:
-            print("⚠️  当前目录下没有找到支持的图片文件")
+            print("⚠️  当前目录下没有找到需要处理的图片文件")
             print("支持的格式: .jpg, .jpeg, .png, .bmp, .gif, .tiff, .webp")
             print(f"📁 扫描目录: {work_directory}")
             return
@@ -119,25 +589,7 @@ def main():
         print("\n🔍 开始OCR识别...")
         ocr_results = ocr_service.batch_recognize(image_files)
         
-        # 过滤出交易记录
-        receipt_files = {path: info for path, info in ocr_results.items() if info.is_receipt}
-        
-        if not receipt_files:
-            print("⚠️  没有识别到交易记录")
-            print_statistics(ocr_results, {})
-            return
-        
-        print(f"✅ 识别到 {len(receipt_files)} 个交易记录")
-        
-        # 文件重命名
-        print(f"\n📝 开始重命名 {len(receipt_files)} 个交易记录文件...")
-        rename_results = file_renamer.batch_rename(receipt_files)
-        
-        # 显示结果
-        print_statistics(ocr_results, rename_results)
-        print_details(ocr_results, rename_results)
-        
-        print("🎉 处理完成！")
+        apply_results(args, ocr_results, ocr_service, file_renamer, detector)
         
     except KeyboardInterrupt:
         print("\n\n⚠️  用户中断操作")
@@ -145,6 +597,79 @@ def main():
         logger.error(f"程序执行出错: {e}")
         print(f"\n❌ 程序执行出错: {e}")
         print("请检查日志文件获取详细错误信息")
+    finally:
+        if ocr_service is not None:
+            ocr_service.close()
+
+
+def print_trace_summary():
+    """打印各阶段耗时汇总"""
+    summary = tracer.summary()
+    if not summary:
+        return
+    
+    print("\n⏱️  阶段耗时")
+    print("=" * 30)
+    for name, stage in sorted(summary.items(), key=lambda item: item[1]["total_ms"], reverse=True):
+        print(f"{name}: {stage['count']} 次 | 共 {stage['total_ms']:.1f}ms | "
+              f"平均 {stage['total_ms'] / stage['count']:.1f}ms")
+
+
+def run_command(args: argparse.Namespace):
+    """执行子命令"""
+    if args.command == "query":
+        run_query(args)
+        return
+    if args.command == "archive":
+        run_archive(args)
+        return
+    if args.command == "batch":
+        run_batch(args)
+        return
+    if args.command == "serve":
+        run_serve(args)
+        return
+    
+    run_pipeline(args)
+
+
+def run_profiled(args: argparse.Namespace):
+    """在 cProfile 下执行子命令并打印最耗时的函数"""
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(run_command, args)
+    finally:
+        if args.profile_output:
+            profiler.dump_stats(str(args.profile_output))
+            print(f"\n💾 cProfile 数据已保存: {args.profile_output}")
+        
+        stats = pstats.Stats(profiler)
+        stats.strip_dirs()
+        print(f"\n🔥 最耗时的函数（按累计时间，前 {args.profile_top} 个）")
+        print("=" * 50)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(args.profile_top)
+        print(f"🔥 最耗时的函数（按自身时间，前 {args.profile_top} 个）")
+        print("=" * 50)
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(args.profile_top)
+
+
+def main(argv: Optional[List[str]] = None):
+    """主程序入口"""
+    args = build_parser().parse_args(argv)
+    
+    if args.trace:
+        tracer.enable()
+    
+    try:
+        if args.profile:
+            run_profiled(args)
+        else:
+            run_command(args)
+    finally:
+        if args.trace:
+            print_trace_summary()
+            tracer.export(args.trace)
+            print(f"\n🧭 追踪结果已导出: {args.trace}")
 
 
 if __name__ == "__main__":
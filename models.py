@@ -1,12 +1,23 @@
 """
 数据模型模块
-定义项目中使用的Pydantic数据模型
+定义项目中使用的Pydantic数据模型，以及批量处理流水线使用的紧凑结果记录
 """
 
-from typing import Optional
+import json
+import sys
+import tempfile
+import threading
+from typing import IO, Optional, Tuple, Union
 from pydantic import BaseModel, Field, field_validator
 
 
+def positive_amount(v: Optional[float]) -> Optional[float]:
+    """金额取绝对值，付款方截图中的金额可能带负号"""
+    if v is not None and v < 0:
+        return abs(v)
+    return v
+
+
 class ReceiptInfo(BaseModel):
     """交易记录信息结构"""
     is_receipt: bool = Field(description="是否为交易记录")
@@ -23,6 +34,177 @@ class ReceiptInfo(BaseModel):
     @classmethod
     def validate_amount(cls, v):
         """验证金额字段，确保为正数"""
-        if v is not None and v < 0:
-            return abs(v)
-        return v 
\ No newline at end of file
+        return positive_amount(v)
+
+
+class ReceiptDecision(BaseModel):
+    """
+    精简的交易记录判断结构
+    只包含判断和命名所需的字段，不要求模型转写图片中的全部文字，输出token更少
+    """
+    is_receipt: bool = Field(description="是否为交易记录")
+    image_type: Optional[str] = Field(description="图片类型（截图/拍照）", default=None)
+    platform: Optional[str] = Field(description="支付平台（微信支付/支付宝/其他）", default=None)
+    amount: Optional[float] = Field(description="交易金额（元）", default=None)
+    transaction_time: Optional[str] = Field(description="交易时间", default=None)
+    merchant: Optional[str] = Field(description="商户名称", default=None)
+    confidence: float = Field(description="识别置信度（0-1）")
+    
+    @field_validator('amount')
+    @classmethod
+    def validate_amount(cls, v):
+        """验证金额字段，确保为正数"""
+        return positive_amount(v)
+    
+    def to_info(self, raw_text: str = "") -> ReceiptInfo:
+        """转换为 ReceiptInfo，原始文本按需另行获取"""
+        return ReceiptInfo(raw_text=raw_text, **self.model_dump())
+
+
+def parse_receipt_json(content: str) -> ReceiptInfo:
+    """解析模型返回的结构化结果，兼容完整（ReceiptInfo）和精简（ReceiptDecision）两种输出"""
+    data = json.loads(content)
+    if isinstance(data, dict) and "raw_text" not in data:
+        return ReceiptDecision.model_validate(data).to_info()
+    return ReceiptInfo.model_validate(data)
+
+
+class RawTextSpill:
+    """
+    原始文本溢出存储
+    超过阈值的 raw_text 追加写入匿名临时文件，记录中只保留 (偏移, 长度)
+    """
+    
+    def __init__(self, threshold: int = 1024):
+        """
+        初始化溢出存储
+        
+        Args:
+            threshold: 超过该字节数的文本写入磁盘
+        """
+        self.threshold = threshold
+        self._file: Optional[IO[bytes]] = None
+        self._lock = threading.Lock()
+    
+    def store(self, text: str) -> Tuple[int, int]:
+        """写入文本，返回 (偏移, 长度)"""
+        data = text.encode('utf-8')
+        with self._lock:
+            if self._file is None:
+                self._file = tempfile.TemporaryFile(prefix="receiptname_raw_text_")
+            offset = self._file.seek(0, 2)
+            self._file.write(data)
+        return offset, len(data)
+    
+    def load(self, ref: Tuple[int, int]) -> str:
+        """根据 (偏移, 长度) 读回文本"""
+        offset, length = ref
+        with self._lock:
+            self._file.seek(offset)
+            data = self._file.read(length)
+        return data.decode('utf-8')
+    
+    def close(self):
+        """关闭并删除临时文件"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class ReceiptRecord:
+    """
+    交易记录的紧凑内部表示
+    批量流水线中替代 ReceiptInfo 保存结果，不带校验器；较长的 raw_text 溢出到磁盘
+    """
+    
+    __slots__ = (
+        "is_receipt", "image_type", "platform", "amount", "currency",
+        "transaction_time", "merchant", "confidence",
+        "_raw_text", "_spill", "_spill_ref",
+    )
+    
+    def __init__(
+        self,
+        is_receipt: bool,
+        confidence: float,
+        raw_text: str = "",
+        image_type: Optional[str] = None,
+        platform: Optional[str] = None,
+        amount: Optional[float] = None,
+        currency: str = "元",
+        transaction_time: Optional[str] = None,
+        merchant: Optional[str] = None,
+        spill: Optional[RawTextSpill] = None,
+    ):
+        self.is_receipt = is_receipt
+        # 取值有限的字段做字符串驻留，多条记录共享同一对象
+        self.image_type = sys.intern(image_type) if image_type else image_type
+        self.platform = sys.intern(platform) if platform else platform
+        self.amount = amount
+        self.currency = sys.intern(currency)
+        self.transaction_time = transaction_time
+        self.merchant = merchant
+        self.confidence = confidence
+        self._spill = spill
+        self.raw_text = raw_text
+    
+    @property
+    def raw_text(self) -> str:
+        """识别的原始文本，溢出到磁盘时按需读回"""
+        if self._spill_ref is not None:
+            return self._spill.load(self._spill_ref)
+        return self._raw_text
+    
+    @raw_text.setter
+    def raw_text(self, text: str):
+        """保存原始文本，超过阈值时溢出到磁盘"""
+        self._spill_ref = None
+        self._raw_text = None
+        spill = self._spill
+        if spill is not None and len(text) * 3 > spill.threshold:
+            # 粗略按UTF-8最坏情况估算后再精确判断，避免对短文本做编码
+            if len(text.encode('utf-8')) > spill.threshold:
+                self._spill_ref = spill.store(text)
+                return
+        self._raw_text = text
+    
+    @classmethod
+    def from_info(cls, info: ReceiptInfo, spill: Optional[RawTextSpill] = None) -> "ReceiptRecord":
+        """从API返回的 ReceiptInfo 构建紧凑记录"""
+        return cls(
+            is_receipt=info.is_receipt,
+            confidence=info.confidence,
+            raw_text=info.raw_text,
+            image_type=info.image_type,
+            platform=info.platform,
+            amount=info.amount,
+            currency=info.currency,
+            transaction_time=info.transaction_time,
+            merchant=info.merchant,
+            spill=spill,
+        )
+    
+    def to_info(self) -> ReceiptInfo:
+        """转换回 ReceiptInfo，用于对外接口和序列化"""
+        return ReceiptInfo(
+            is_receipt=self.is_receipt,
+            image_type=self.image_type,
+            platform=self.platform,
+            amount=self.amount,
+            currency=self.currency,
+            transaction_time=self.transaction_time,
+            merchant=self.merchant,
+            confidence=self.confidence,
+            raw_text=self.raw_text,
+        )
+    
+    def __repr__(self) -> str:
+        return (
+            f"ReceiptRecord(is_receipt={self.is_receipt}, platform={self.platform!r}, "
+            f"amount={self.amount}, confidence={self.confidence})"
+        )
+
+
+# 流水线各阶段同时接受两种结果表示
+ReceiptData = Union[ReceiptInfo, ReceiptRecord]
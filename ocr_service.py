@@ -4,10 +4,15 @@ ReceiptName OCR服务模块
 """
 
 import base64
+import hashlib
+import io
 import logging
+import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import IO, Dict, Any, Iterable, List, Optional, Union
 
 try:
     from openai import OpenAI
@@ -16,38 +21,171 @@ except ImportError:
     print("   请运行：pip install openai")
     raise
 
+from backpressure import ByteBudget, RateLimiter, estimate_payload_bytes
 from config import config
-from models import ReceiptInfo
+from hashing import ContentHasher
+from hedging import HedgedCaller, LatencyTracker
+from image_cropper import ImageCropper
+from models import RawTextSpill, ReceiptDecision, ReceiptInfo, ReceiptRecord, parse_receipt_json
+from recorder import RecordingNotFound, ResponseRecorder
+from result_cache import LocalCache, TieredCache, content_key_from_digest, create_remote_backend
+from scheduler import ProgressTracker, file_size, image_pixels, order_by_cost
+from tracing import tracer
 
 # 配置日志
 logging.basicConfig(level=getattr(logging, config.log_level))
 logger = logging.getLogger(__name__)
 
+# 识别提示词
+RECEIPT_PROMPT = """
+请分析这张图片，并执行以下任务：
+
+1. 首先判断图片类型：
+   - 这是手机截图（屏幕截图）还是用相机拍摄的照片？
+   - 判断依据：截图通常边缘整齐、像素完美、无物理环境背景；拍照通常有透视变形、光线反射、可能有周围环境
+
+2. 判断是否为交易记录：
+   - 只有手机截图才可能是有效的支付凭证
+   - 如果是拍照的图片，即使包含交易信息，也将is_receipt设为false
+   - 如果是截图且包含交易信息（微信支付、支付宝等），则为有效交易记录
+
+3. 如果是有效的交易记录截图，请提取以下信息：
+   - 支付平台（微信支付/支付宝/其他）
+   - 交易金额
+   - 交易时间
+   - 商户名称
+
+4. 如果不是交易记录或是拍照的图片，请将is_receipt设为false，其他字段设为null。
+
+请仔细分析图片特征，确保准确识别截图与拍照的区别。
+"""
+
+# 按需转写原始文本的提示词（精简输出模式下文本回退检测使用）
+TRANSCRIBE_PROMPT = "请按从上到下的顺序逐行转写这张图片中的全部文字，只输出文字内容，不要添加任何解释。"
+
+# 不使用深度思考能力
+THINKING_DISABLED = {
+    "thinking": {
+        "type": "disabled"
+    }
+}
+
+
+class ApiUsage:
+    """按调用类型（完整输出 / 精简输出 / 原始文本转写）统计API延迟和token用量"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._kinds: Dict[str, Dict[str, float]] = {}
+    
+    def observe(self, kind: str, seconds: float, usage: Any = None):
+        """
+        记录一次成功的API调用
+        
+        Args:
+            kind: 调用类型
+            seconds: 调用耗时
+            usage: 响应中的 usage（prompt_tokens / completion_tokens），可能为None
+        """
+        with self._lock:
+            totals = self._kinds.setdefault(kind, {
+                "calls": 0, "seconds": 0.0, "prompt_tokens": 0, "completion_tokens": 0
+            })
+            totals["calls"] += 1
+            totals["seconds"] += seconds
+            if usage is not None:
+                totals["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+                totals["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+    
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        """各调用类型的次数、平均延迟和平均token数"""
+        with self._lock:
+            return {
+                kind: {
+                    **totals,
+                    "avg_latency_s": totals["seconds"] / totals["calls"],
+                    "avg_prompt_tokens": totals["prompt_tokens"] / totals["calls"],
+                    "avg_completion_tokens": totals["completion_tokens"] / totals["calls"],
+                }
+                for kind, totals in self._kinds.items()
+            }
+
 
 class OCRService:
     """OCR服务类"""
     
-    def __init__(self):
-        """初始化OCR服务"""
-        self.client = OpenAI(
-            api_key=config.ark_api_key,
-            base_url="https://ark.cn-beijing.volces.com/api/v3"
-        )
+    def __init__(self, recorder: Optional[ResponseRecorder] = None):
+        """
+        初始化OCR服务
+        
+        Args:
+            recorder: API响应录制器；回放模式下不创建API客户端，也不产生网络请求
+        """
+        self.recorder = recorder
+        self.client = None
+        if recorder is None or not recorder.replaying:
+            self.client = OpenAI(
+                api_key=config.ark_api_key,
+                base_url="https://ark.cn-beijing.volces.com/api/v3"
+            )
         self.model_id = config.ark_model_id
+        # 精简输出模式只请求判断字段，不让模型转写全部文字
+        self.lean_schema = config.lean_schema
+        self.response_model = ReceiptDecision if self.lean_schema else ReceiptInfo
+        self.usage = ApiUsage()
         self.max_retries = config.max_retries
         self.retry_delay = config.retry_delay
+        self.cropper = ImageCropper() if config.enable_roi_crop else None
+        self.raw_text_spill = RawTextSpill(config.raw_text_spill_threshold)
+        self.hedger = None
+        if config.enable_hedging:
+            self.hedger = HedgedCaller(
+                LatencyTracker(
+                    percentile=config.hedge_percentile,
+                    initial_delay=config.hedge_initial_delay
+                ),
+                budget=config.hedge_budget,
+                # 每个识别线程最多同时占用主请求和对冲请求两个线程
+                max_workers=2 * max(config.batch_workers, config.service_workers)
+            )
+        self.cache = None
+        if config.enable_result_cache:
+            remote = create_remote_backend(config.result_cache_url) if config.result_cache_url else None
+            self.cache = TieredCache(LocalCache(config.result_cache_dir), remote)
+        # 缓存和录制回放以图片内容摘要为键，批量识别前并行计算，未改动的文件复用上次运行的摘要
+        self.hasher = None
+        if self.cache is not None or self.recorder is not None:
+            self.hasher = ContentHasher(config.hash_index_path, config.hash_workers)
+        self.batch_workers = config.batch_workers
+        self.shortest_job_first = config.shortest_job_first
+        self.show_progress = config.show_progress
+        self.byte_budget = ByteBudget(config.max_inflight_mb * 1024 * 1024)
+        # 多线程共享的API速率限制，服务模式下设置
+        self.rate_limiter: Optional[RateLimiter] = None
+        # 批量识别时两次API调用之间的间隔（秒），回放模式不需要限速
+        self.request_interval = 0.0 if self.client is None else 0.5
         
         logger.info(f"OCR服务初始化完成，模型ID: {self.model_id}")
     
-    def encode_image(self, image_path: Path) -> str:
-        """将图片转换为Base64编码"""
+    def read_image(self, image_path: Path) -> bytes:
+        """读取图片文件内容"""
         try:
-            with open(image_path, "rb") as image_file:
-                return base64.b64encode(image_file.read()).decode('utf-8')
+            with tracer.span("read_image", category="filesystem", file=image_path.name):
+                with open(image_path, "rb") as image_file:
+                    return image_file.read()
         except Exception as e:
-            logger.error(f"图片编码失败 {image_path}: {e}")
+            logger.error(f"图片读取失败 {image_path}: {e}")
             raise
     
+    def encode_image(self, image_path: Path) -> str:
+        """将图片转换为Base64编码"""
+        return self.encode_bytes(self.read_image(image_path), image_path.name)
+    
+    def encode_bytes(self, image_bytes: bytes, name: str = "") -> str:
+        """将图片内容转换为Base64编码"""
+        with tracer.span("encode_image", file=name):
+            return base64.b64encode(image_bytes).decode('utf-8')
+    
     def get_image_format(self, image_path: Path) -> str:
         """获取图片格式"""
         suffix = image_path.suffix.lower()
@@ -65,122 +203,370 @@ class OCRService:
         """创建Base64编码的图片URL"""
         return f"data:image/{image_format};base64,{base64_image}"
     
-    def recognize_receipt(self, image_path: Path) -> ReceiptInfo:
-        """识别交易记录图片"""
+    @property
+    def cache_variant(self) -> Optional[str]:
+        """精简输出的识别结果不含原始文本，与完整结果分开缓存"""
+        return "lean" if self.lean_schema else None
+    
+    @property
+    def reads_cache(self) -> bool:
+        """是否使用缓存的识别结果；录制模式需要每张图片的API原始响应，只写缓存不读缓存"""
+        return self.cache is not None and not (self.recorder is not None and self.recorder.recording)
+    
+    def cache_key(self, digest: str, variant: Optional[str] = None) -> str:
+        """根据图片内容摘要生成缓存键，variant 默认为当前输出模式"""
+        return content_key_from_digest(digest, self.model_id, variant or self.cache_variant)
+    
+    def recognize_receipt(self, image_path: Path, digest: Optional[str] = None) -> ReceiptInfo:
+        """识别交易记录图片（已计算过内容摘要时可传入 digest）"""
         logger.info(f"开始识别图片: {image_path}")
         
         # 验证文件存在
         if not image_path.exists():
             raise FileNotFoundError(f"图片文件不存在: {image_path}")
         
-        # 编码图片
-        base64_image = self.encode_image(image_path)
-        image_format = self.get_image_format(image_path)
-        image_url = self.create_base64_url(base64_image, image_format)
+        if digest is None and self.hasher is not None:
+            digest = self.hasher.digest(image_path)
         
-        # 构建提示词
-        prompt = """
-请分析这张图片，并执行以下任务：
-
-1. 首先判断图片类型：
-   - 这是手机截图（屏幕截图）还是用相机拍摄的照片？
-   - 判断依据：截图通常边缘整齐、像素完美、无物理环境背景；拍照通常有透视变形、光线反射、可能有周围环境
-
-2. 判断是否为交易记录：
-   - 只有手机截图才可能是有效的支付凭证
-   - 如果是拍照的图片，即使包含交易信息，也将is_receipt设为false
-   - 如果是截图且包含交易信息（微信支付、支付宝等），则为有效交易记录
-
-3. 如果是有效的交易记录截图，请提取以下信息：
-   - 支付平台（微信支付/支付宝/其他）
-   - 交易金额
-   - 交易时间
-   - 商户名称
-
-4. 如果不是交易记录或是拍照的图片，请将is_receipt设为false，其他字段设为null。
-
-请仔细分析图片特征，确保准确识别截图与拍照的区别。
-"""
+        # 摘要已知时先查回放和缓存，命中时不读取文件
+        if digest is not None:
+            known = self._lookup(digest, image_path.name)
+            if known is not None:
+                return known
+        
+        # 按载荷字节数申请在途预算，读取、编码和API调用期间保持占用
+        payload_bytes = self.estimate_payload(image_path.stat().st_size, image_path)
+        with self.byte_budget.reserve(payload_bytes):
+            image_bytes = self.read_image(image_path)
+            return self._recognize_uncached(image_bytes, self.get_image_format(image_path), image_path.name, digest)
+    
+    def recognize_image_bytes(self, image_bytes: bytes, image_format: str, name: str = "") -> ReceiptInfo:
+        """识别内存中的交易记录图片"""
+        with self.byte_budget.reserve(self.estimate_payload(len(image_bytes), io.BytesIO(image_bytes))):
+            return self.recognize_bytes(image_bytes, image_format, name)
+    
+    def estimate_payload(self, size: int, image: Union[Path, IO[bytes]]) -> int:
+        """估算识别一张图片占用的在途字节；启用有效区域裁剪时读取图片头部，计入解码后的位图"""
+        pixels = image_pixels(image) if self.cropper is not None else None
+        return estimate_payload_bytes(size, pixels)
+    
+    def recognize_bytes(self, image_bytes: bytes, image_format: str, name: str = "",
+                        digest: Optional[str] = None) -> ReceiptInfo:
+        """识别内存中的图片内容，不申请在途预算（调用方已申请）；已计算过内容摘要时可传入 digest"""
+        if digest is None and (self.cache is not None or self.recorder is not None):
+            with tracer.span("hash_image", file=name):
+                digest = hashlib.sha256(image_bytes).hexdigest()
+        
+        if digest is not None:
+            known = self._lookup(digest, name)
+            if known is not None:
+                return known
+        return self._recognize_uncached(image_bytes, image_format, name, digest)
+    
+    def _lookup(self, digest: str, name: str) -> Optional[ReceiptInfo]:
+        """回放模式返回录制的结果；否则按内容摘要查询缓存，未命中时返回None"""
+        if self.recorder is not None and self.recorder.replaying:
+            return self._replay(digest, name)
+        cached = self.cached_result(digest)
+        if cached is not None:
+            logger.info(f"命中识别结果缓存: {name}")
+        return cached
+    
+    def cached_result(self, digest: Optional[str]) -> Optional[ReceiptInfo]:
+        """按内容摘要读取缓存的识别结果；未启用缓存、录制模式下或未命中时返回None"""
+        if digest is None or not self.reads_cache:
+            return None
+        return self._get_cached(self.cache_key(digest))
+    
+    def _recognize_uncached(self, image_bytes: bytes, image_format: str, name: str,
+                            digest: Optional[str]) -> ReceiptInfo:
+        """调用API识别图片，并写入录制和缓存（调用方已查过回放和缓存）"""
+        cache_key = self.cache_key(digest) if self.cache is not None else None
+        
+        # 优先发送裁剪后的有效区域，识别失败时回退到原图
+        completion = None
+        if self.cropper is not None:
+            completion = self._recognize_cropped(image_bytes, image_format, name)
         
+        if completion is None:
+            # 编码图片
+            image_url = self.create_base64_url(self.encode_bytes(image_bytes, name), image_format)
+            completion = self._request_with_retry(image_url)
+        
+        if completion is None:
+            # 返回默认结果（识别失败不写入缓存）
+            return ReceiptInfo(
+                is_receipt=False,
+                confidence=0.0,
+                raw_text="识别失败"
+            )
+        
+        result = completion.choices[0].message.parsed
+        if isinstance(result, ReceiptDecision):
+            result = result.to_info()
+        if self.recorder is not None:
+            self.recorder.save(digest, name, self.model_id, completion.model_dump(mode="json"))
+        if cache_key is not None:
+            self.cache.put(cache_key, result.model_dump_json())
+        return result
+    
+    def _replay(self, digest: str, name: str) -> ReceiptInfo:
+        """从录制的响应中读取识别结果，没有录制时返回非交易记录"""
+        try:
+            with tracer.span("replay", file=name):
+                result = self.recorder.load(digest)
+            logger.info(f"回放录制响应: {name}")
+            return result
+        except RecordingNotFound:
+            logger.warning(f"没有找到录制响应，跳过: {name}")
+            return ReceiptInfo(
+                is_receipt=False,
+                confidence=0.0,
+                raw_text="无录制响应"
+            )
+    
+    def _get_cached(self, cache_key: str) -> Optional[ReceiptInfo]:
+        """读取缓存的识别结果，缓存内容损坏时视为未命中"""
+        with tracer.span("cache_get", category="cache"):
+            cached = self.cache.get(cache_key)
+        if cached is None:
+            return None
+        try:
+            return parse_receipt_json(cached)
+        except ValueError as e:
+            logger.warning(f"缓存内容无法解析，重新识别: {e}")
+            return None
+    
+    def _recognize_cropped(self, image_bytes: bytes, image_format: str, name: str):
+        """使用裁剪后的图片识别，返回API响应；无法裁剪、调用失败或结果可能受裁剪影响时返回None"""
+        with tracer.span("roi_crop", file=name):
+            cropped = self.cropper.crop(image_bytes, image_format)
+        if cropped is None:
+            return None
+        
+        image_url = self.create_base64_url(
+            self.encode_bytes(cropped, name),
+            self.cropper.output_format(image_format)
+        )
+        completion = self._request_with_retry(image_url)
+        if completion is None:
+            logger.info(f"裁剪图片识别失败，回退到原图: {name}")
+            return None
+        reason = self.cropper.needs_full_image(completion.choices[0].message.parsed)
+        if reason is not None:
+            logger.info(f"裁剪图片识别结果{reason}，回退到原图: {name}")
+            return None
+        return completion
+    
+    def _request_with_retry(self, image_url: str, call=None, kind: Optional[str] = None):
+        """
+        调用API识别图片，返回API响应；重试耗尽后返回None
+        
+        Args:
+            image_url: Base64编码的图片URL
+            call: 实际发起调用的函数，默认为结构化识别 _call_api
+            kind: 用量统计中的调用类型，默认为当前输出模式（full / lean）
+        """
+        call = call or self._call_api
+        kind = kind or ("lean" if self.lean_schema else "full")
         # 重试机制
         for attempt in range(self.max_retries):
             try:
                 logger.info(f"OCR识别尝试 {attempt + 1}/{self.max_retries}")
                 
-                # 调用火山引擎API
-                completion = self.client.beta.chat.completions.parse(
-                    model=self.model_id,
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": [
-                                {
-                                    "type": "image_url",
-                                    "image_url": {
-                                        "url": image_url,
-                                        "detail": "high"  # 使用高分辨率模式
-                                    }
-                                },
-                                {
-                                    "type": "text",
-                                    "text": prompt
-                                }
-                            ]
-                        }
-                    ],
-                    response_format=ReceiptInfo,  # 使用结构化输出
-                    extra_body={
-                        "thinking": {
-                            "type": "disabled"  # 不使用深度思考能力
-                        }
-                    }
-                )
+                if self.rate_limiter is not None:
+                    with tracer.span("rate_limit_wait", category="sleep"):
+                        self.rate_limiter.wait()
                 
-                # 提取结果
-                result = completion.choices[0].message.parsed
-                logger.info(f"OCR识别成功: {result.is_receipt}")
-                return result
+                start = time.perf_counter()
+                with tracer.span("api_call", category="network", attempt=attempt + 1, kind=kind):
+                    if self.hedger is not None:
+                        throttle = self.rate_limiter.wait if self.rate_limiter is not None else None
+                        completion = self.hedger.call(call, image_url, throttle=throttle)
+                    else:
+                        completion = call(image_url)
+                self.usage.observe(kind, time.perf_counter() - start, getattr(completion, "usage", None))
+                
+                logger.info(f"OCR识别成功（{kind}）")
+                return completion
                 
             except Exception as e:
                 logger.warning(f"OCR识别失败 (尝试 {attempt + 1}): {e}")
                 if attempt < self.max_retries - 1:
-                    time.sleep(self.retry_delay)
+                    with tracer.span("retry_sleep", category="sleep", attempt=attempt + 1):
+                        time.sleep(self.retry_delay)
                 else:
                     logger.error(f"OCR识别最终失败: {e}")
-                    # 返回默认结果
-                    return ReceiptInfo(
-                        is_receipt=False,
-                        confidence=0.0,
-                        raw_text="识别失败"
-                    )
-    
-    def batch_recognize(self, image_paths: List[Path]) -> Dict[Path, ReceiptInfo]:
-        """批量识别图片"""
-        results = {}
+        return None
+    
+    def build_messages(self, image_url: str, prompt: str = RECEIPT_PROMPT) -> List[Dict[str, Any]]:
+        """构建识别请求的消息列表"""
+        return [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": image_url,
+                            "detail": "high"  # 使用高分辨率模式
+                        }
+                    },
+                    {
+                        "type": "text",
+                        "text": prompt
+                    }
+                ]
+            }
+        ]
+    
+    def _call_api(self, image_url: str):
+        """调用火山引擎API，返回结构化解析后的响应"""
+        return self.client.beta.chat.completions.parse(
+            model=self.model_id,
+            messages=self.build_messages(image_url),
+            response_format=self.response_model,  # 使用结构化输出
+            extra_body=THINKING_DISABLED
+        )
+    
+    def _call_transcribe(self, image_url: str):
+        """调用火山引擎API转写图片中的全部文字"""
+        return self.client.chat.completions.create(
+            model=self.model_id,
+            messages=self.build_messages(image_url, TRANSCRIBE_PROMPT),
+            extra_body=THINKING_DISABLED
+        )
+    
+    def transcribe(self, image_path: Path) -> str:
+        """按需转写图片中的全部文字，失败时返回空字符串"""
+        with self.byte_budget.reserve(estimate_payload_bytes(image_path.stat().st_size)):
+            image_bytes = self.read_image(image_path)
+            return self.transcribe_bytes(image_bytes, self.get_image_format(image_path), image_path.name)
+    
+    def transcribe_bytes(self, image_bytes: bytes, image_format: str, name: str = "") -> str:
+        """按需转写内存中图片的全部文字（调用方负责在途预算），失败或回放模式下返回空字符串"""
+        if self.client is None:
+            return ""
+        
+        cache_key = None
+        if self.cache is not None:
+            with tracer.span("hash_image", file=name):
+                cache_key = self.cache_key(hashlib.sha256(image_bytes).hexdigest(), "text")
+            with tracer.span("cache_get", category="cache"):
+                cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+        
+        logger.info(f"按需转写原始文本: {name}")
+        image_url = self.create_base64_url(self.encode_bytes(image_bytes, name), image_format)
+        with tracer.span("transcribe", file=name):
+            completion = self._request_with_retry(image_url, self._call_transcribe, "transcribe")
+        if completion is None:
+            return ""
+        text = completion.choices[0].message.content or ""
+        if cache_key is not None:
+            self.cache.put(cache_key, text)
+        return text
+    
+    def batch_recognize(self, image_paths: List[Path]) -> Dict[Path, ReceiptRecord]:
+        """批量识别图片，结果以紧凑记录保存，按传入顺序返回"""
         total = len(image_paths)
         
         logger.info(f"开始批量识别 {total} 张图片")
+        digests = self.hasher.digest_many(image_paths) if self.hasher is not None else {}
+        self.prefetch_cache(digests.values())
         
-        for i, image_path in enumerate(image_paths, 1):
-            try:
-                logger.info(f"处理进度: {i}/{total} - {image_path.name}")
-                result = self.recognize_receipt(image_path)
-                results[image_path] = result
-                
-                # 添加延迟避免API限制
-                if i < total:
-                    time.sleep(0.5)
-                    
-            except Exception as e:
-                logger.error(f"处理图片失败 {image_path}: {e}")
-                results[image_path] = ReceiptInfo(
-                    is_receipt=False,
-                    confidence=0.0,
-                    raw_text=f"处理失败: {str(e)}"
-                )
+        # 最短作业优先：先处理小图，尽早产出结果，超大扫描件放到最后
+        schedule = order_by_cost(image_paths) if self.shortest_job_first else list(image_paths)
+        sizes = {image_path: file_size(image_path) for image_path in schedule}
+        progress = ProgressTracker(total, sum(sizes.values()), sys.stderr if self.show_progress else None)
+        
+        # 终端显示进度行期间，逐个文件的 INFO 日志不输出
+        with progress.capture_logging():
+            if self.batch_workers <= 1:
+                done = {
+                    image_path: self._recognize_one(image_path, i, total, progress, sizes[image_path],
+                                                    digests.get(image_path))
+                    for i, image_path in enumerate(schedule, 1)
+                }
+            else:
+                # 并行处理，同时在途的图片数由在途字节预算限制
+                with ThreadPoolExecutor(max_workers=self.batch_workers, thread_name_prefix="recognize") as executor:
+                    futures = {
+                        image_path: executor.submit(
+                            self._recognize_one, image_path, i, total, progress, sizes[image_path],
+                            digests.get(image_path)
+                        )
+                        for i, image_path in enumerate(schedule, 1)
+                    }
+                    done = {image_path: future.result() for image_path, future in futures.items()}
+        results = {image_path: done[image_path] for image_path in image_paths}
+        
+        if self.cache is not None:
+            self.cache.flush()
+        if self.hasher is not None:
+            self.hasher.save()
         
         logger.info(f"批量识别完成，成功处理 {len(results)} 张图片")
         return results
+    
+    def _recognize_one(self, image_path: Path, index: int, total: int,
+                       progress: Optional[ProgressTracker] = None, nbytes: int = 0,
+                       digest: Optional[str] = None) -> ReceiptRecord:
+        """识别批量中的一张图片，失败时返回非交易记录"""
+        start = time.monotonic()
+        try:
+            logger.info(f"处理进度: {index}/{total} - {image_path.name}")
+            with tracer.span("recognize", file=image_path.name):
+                result = self.recognize_receipt(image_path, digest)
+                record = ReceiptRecord.from_info(result, self.raw_text_spill)
+            
+            # 添加延迟避免API限制
+            if index < total and self.request_interval:
+                with tracer.span("rate_limit_sleep", category="sleep"):
+                    time.sleep(self.request_interval)
+            
+        except Exception as e:
+            logger.error(f"处理图片失败 {image_path}: {e}")
+            record = ReceiptRecord(
+                is_receipt=False,
+                confidence=0.0,
+                raw_text=f"处理失败: {str(e)}"
+            )
+        
+        if progress is not None:
+            progress.advance(nbytes, time.monotonic() - start)
+        return record
+    
+    def prefetch_cache(self, digests: Iterable[str]):
+        """运行开始前按内容摘要从远程缓存批量拉取这批图片的识别结果"""
+        if not self.reads_cache or self.cache.remote is None or self.client is None:
+            return
+        
+        keys = [self.cache_key(digest) for digest in digests]
+        with tracer.span("cache_prefetch", category="cache", files=len(keys)):
+            self.cache.prefetch(keys)
+    
+    def close(self):
+        """释放后台资源：关闭对冲线程池"""
+        if self.hedger is not None:
+            self.hedger.shutdown()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取服务运行统计（在途字节、API用量、对冲、缓存等）"""
+        stats: Dict[str, Any] = {"memory": self.byte_budget.get_stats()}
+        usage = self.usage.get_stats()
+        if usage:
+            stats["api"] = usage
+        if self.hedger is not None:
+            stats["hedging"] = self.hedger.get_stats()
+        if self.cache is not None:
+            stats["cache"] = self.cache.get_stats()
+        if self.hasher is not None:
+            stats["hashing"] = self.hasher.get_stats()
+        if self.recorder is not None:
+            stats["recorder"] = self.recorder.get_stats()
+        return stats
 
 
 def test_ocr_service():
@@ -6,9 +6,10 @@
 
 import re
 import logging
-from typing import Optional
+from typing import Callable, Optional
 
-from models import ReceiptInfo
+from models import RawTextSpill, ReceiptData, ReceiptInfo, ReceiptRecord
+from tracing import tracer
 
 logger = logging.getLogger(__name__)
 
@@ -23,14 +24,30 @@ class ReceiptDetector:
     # 正则表达式，用于匹配如 "¥123.45" 或 "123.45元" 的金额格式，支持负数
     AMOUNT_PATTERN = re.compile(r"(?:￥|¥|RMB)\s*(-?\d+\.\d{2})|(-?\d+\.\d{2})\s*元")
 
-    def detect(self, ocr_result: ReceiptInfo) -> ReceiptInfo:
+    def detect(self, ocr_result: ReceiptData, fetch_text: Optional[Callable[[], str]] = None) -> ReceiptData:
         """
         对OCR结果进行二次检测和精炼。
         - 首先检查图片类型，如果是拍照则直接设为非交易记录
         - 如果平台信息缺失，通过关键字识别。
         - 如果金额信息缺失，通过正则表达式提取。
         - 基于提取到的信息，最终确认是否为交易凭证。
+        
+        精简输出模式下结果不含原始文本，需要文本回退时通过 fetch_text 按需获取。
+        """
+        with tracer.span("detect"):
+            return self._detect(ocr_result, fetch_text)
+
+    def _needs_text(self, ocr_result: ReceiptData) -> bool:
+        """
+        是否需要原始文本做回退检测：平台或金额缺失，且模型判断为交易记录或已识别出其中一项
+        （两项都没有的非交易记录截图几乎不可能靠文本回退改判，不值得额外调用）
         """
+        if ocr_result.platform and ocr_result.amount is not None:
+            return False
+        return ocr_result.is_receipt or bool(ocr_result.platform) or ocr_result.amount is not None
+
+    def _detect(self, ocr_result: ReceiptData, fetch_text: Optional[Callable[[], str]] = None) -> ReceiptData:
+        """二次检测和精炼的具体实现"""
         logger.debug(f"开始精炼OCR结果: {ocr_result.raw_text[:50]}...")
 
         # 0. 首先检查图片类型 - 如果是拍照的图片，直接设为非交易记录
@@ -39,6 +56,10 @@ class ReceiptDetector:
             logger.info("检测到拍照图片，设置为非交易记录")
             return ocr_result
 
+        # 精简输出没有原始文本，需要回退检测时按需获取
+        if fetch_text is not None and not ocr_result.raw_text and self._needs_text(ocr_result):
+            ocr_result.raw_text = fetch_text()
+
         # 1. 如果平台未识别，则尝试通过关键字识别
         if not ocr_result.platform:
             platform = self._detect_platform(ocr_result.raw_text)
@@ -162,6 +183,40 @@ def test_detector():
     assert result7.platform == "微信支付"
     assert result7.amount == 55.88  # 负数应该被转换为正数
 
+    # 测试用例8: 紧凑记录，原始文本溢出到磁盘
+    spill = RawTextSpill(threshold=16)
+    text8 = "微信支付收款凭证\n收款金额\n¥42.50\n当前状态\n已收款\n付款方\n王五"
+    info8 = ReceiptRecord(is_receipt=False, image_type="截图", confidence=0.9, raw_text=text8, spill=spill)
+    result8 = detector.detect(info8)
+    print(f"测试8 - 检测结果: is_receipt={result8.is_receipt}, platform='{result8.platform}', amount={result8.amount}")
+    assert result8.raw_text == text8
+    assert result8.is_receipt is True
+    assert result8.platform == "微信支付"
+    assert result8.amount == 42.50
+    assert result8.to_info().amount == 42.50
+
+    # 测试用例9: 精简输出缺少金额时按需获取原始文本
+    fetched = []
+
+    def fetch_text():
+        fetched.append(True)
+        return "支付宝\n付款金额\n¥18.80\n交易成功"
+
+    info9 = ReceiptRecord(is_receipt=True, image_type="截图", platform="支付宝", confidence=0.9, spill=spill)
+    result9 = detector.detect(info9, fetch_text)
+    print(f"测试9 - 按需获取文本后金额: {result9.amount}")
+    assert fetched == [True]
+    assert result9.amount == 18.80
+    assert "交易成功" in result9.raw_text
+
+    # 测试用例10: 平台和金额都已识别、或什么都没识别出的非交易记录不获取文本
+    detector.detect(ReceiptInfo(is_receipt=True, image_type="截图", platform="微信支付", amount=5.0,
+                                confidence=0.9, raw_text=""), fetch_text)
+    detector.detect(ReceiptInfo(is_receipt=False, image_type="截图", confidence=0.9, raw_text=""), fetch_text)
+    print(f"测试10 - 获取文本次数: {len(fetched)}")
+    assert len(fetched) == 1
+    spill.close()
+
     print("✅ 所有测试用例通过！")
 
 if __name__ == '__main__':
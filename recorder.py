@@ -0,0 +1,169 @@
+"""
+API响应录制回放模块
+录制模式下按图片内容哈希保存每次API原始响应；回放模式下直接用录制的响应代替API调用，不产生任何网络请求
+"""
+
+import json
+import logging
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from models import ReceiptInfo, parse_receipt_json
+
+logger = logging.getLogger(__name__)
+
+RECORD_MODE = "record"
+REPLAY_MODE = "replay"
+
+
+class RecordingNotFound(Exception):
+    """回放时没有找到对应图片的录制响应"""
+
+
+class ResponseRecorder:
+    """API响应录制器"""
+
+    def __init__(self, directory: Path, mode: str):
+        """
+        初始化录制器
+
+        Args:
+            directory: 录制文件目录
+            mode: record（录制）或 replay（回放）
+        """
+        if mode not in (RECORD_MODE, REPLAY_MODE):
+            raise ValueError(f"未知的录制模式: {mode}")
+        self.directory = directory
+        self.mode = mode
+        self._lock = threading.Lock()
+        self.recorded = 0
+        self.replayed = 0
+        self.missing = 0
+        if mode == RECORD_MODE:
+            self.directory.mkdir(parents=True, exist_ok=True)
+        elif not self.directory.is_dir():
+            raise FileNotFoundError(f"录制目录不存在: {directory}")
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == REPLAY_MODE
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == RECORD_MODE
+
+    def _path(self, digest: str) -> Path:
+        return self.directory / digest[:2] / f"{digest}.json"
+
+    def save(self, digest: str, name: str, model_id: Optional[str], response: Dict[str, Any]):
+        """
+        保存一次API原始响应
+
+        Args:
+            digest: 图片内容的 SHA-256 摘要
+            name: 图片文件名（仅用于排查）
+            model_id: 模型ID
+            response: API原始响应（completion.model_dump()）
+        """
+        path = self._path(digest)
+        path.parent.mkdir(exist_ok=True)
+        recording = {
+            "image": name,
+            "model": model_id,
+            "recorded_at": datetime.now().isoformat(timespec="seconds"),
+            "response": response,
+        }
+        path.write_text(json.dumps(recording, ensure_ascii=False), encoding="utf-8")
+        with self._lock:
+            self.recorded += 1
+
+    def load(self, digest: str) -> ReceiptInfo:
+        """
+        从录制的响应中解析识别结果
+
+        Raises:
+            RecordingNotFound: 没有该图片的录制
+        """
+        try:
+            recording = json.loads(self._path(digest).read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            with self._lock:
+                self.missing += 1
+            raise RecordingNotFound(digest) from None
+        content = recording["response"]["choices"][0]["message"]["content"]
+        with self._lock:
+            self.replayed += 1
+        return parse_receipt_json(content)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """录制回放统计"""
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "recorded": self.recorded,
+                "replayed": self.replayed,
+                "missing": self.missing,
+            }
+
+
+def test_recorder():
+    """测试录制回放功能"""
+    import hashlib
+    import tempfile
+
+    print("--- 测试API响应录制回放 ---")
+
+    digest = hashlib.sha256(b"image").hexdigest()
+    response = {
+        "id": "chatcmpl-1",
+        "choices": [{
+            "index": 0,
+            "message": {
+                "role": "assistant",
+                "content": ReceiptInfo(
+                    is_receipt=True, image_type="截图", platform="支付宝",
+                    amount=66.5, confidence=0.93, raw_text="支付宝 ¥66.50"
+                ).model_dump_json(),
+            },
+        }],
+        "usage": {"prompt_tokens": 1200, "completion_tokens": 80},
+    }
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # 测试用例1: 录制响应
+        recorder = ResponseRecorder(Path(temp_dir), RECORD_MODE)
+        recorder.save(digest, "IMG_001.jpg", "model-a", response)
+        print(f"测试1 - 录制统计: {recorder.get_stats()}")
+        assert recorder.recorded == 1
+
+        # 测试用例2: 回放解析出相同结果
+        player = ResponseRecorder(Path(temp_dir), REPLAY_MODE)
+        result = player.load(digest)
+        print(f"测试2 - 回放结果: platform={result.platform}, amount={result.amount}")
+        assert result.is_receipt is True
+        assert result.amount == 66.5
+
+        # 测试用例3: 没有录制时抛出异常
+        try:
+            player.load(hashlib.sha256(b"other").hexdigest())
+            raise AssertionError("应该抛出异常")
+        except RecordingNotFound:
+            print(f"测试3 - 缺少录制: {player.get_stats()}")
+        assert player.missing == 1
+
+    # 测试用例4: 回放目录不存在时报错
+    try:
+        ResponseRecorder(Path(temp_dir) / "missing", REPLAY_MODE)
+        raise AssertionError("应该抛出异常")
+    except FileNotFoundError:
+        print("测试4 - 回放目录不存在时报错")
+
+    print("✅ 所有测试用例通过！")
+
+
+if __name__ == '__main__':
+    # 配置日志以查看详细信息
+    logging.basicConfig(level=logging.INFO)
+    test_recorder()
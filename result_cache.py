@@ -0,0 +1,480 @@
+"""
+识别结果缓存模块
+以图片内容哈希为键缓存识别结果：本地磁盘作为快速层，团队共享的 HTTP / Redis 服务作为远程层
+"""
+
+import hashlib
+import json
+import logging
+import queue
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# 结果结构变化时递增，避免读到旧格式的缓存
+CACHE_SCHEMA_VERSION = "v1"
+
+
+def content_key(image_bytes: bytes, model_id: Optional[str], variant: Optional[str] = None) -> str:
+    """根据图片内容和模型ID生成缓存键"""
+    return content_key_from_digest(hashlib.sha256(image_bytes).hexdigest(), model_id, variant)
+
+
+def content_key_from_digest(digest: str, model_id: Optional[str], variant: Optional[str] = None) -> str:
+    """
+    根据图片内容的 SHA-256 摘要和模型ID生成缓存键
+
+    Args:
+        variant: 同一张图片的不同结果（如精简输出、原始文本转写），默认为完整识别结果
+    """
+    if variant:
+        return f"receiptname:{CACHE_SCHEMA_VERSION}:{model_id or 'default'}:{variant}:{digest}"
+    return f"receiptname:{CACHE_SCHEMA_VERSION}:{model_id or 'default'}:{digest}"
+
+
+class CacheUnavailable(Exception):
+    """远程缓存不可用"""
+
+
+class LocalCache:
+    """本地磁盘缓存，每个键一个文件，按哈希前两位分目录"""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return self.directory / digest[:2] / f"{digest}.json"
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存，未命中返回None"""
+        try:
+            return self._path(key).read_text(encoding="utf-8")
+        except FileNotFoundError:
+            return None
+
+    def set(self, key: str, value: str):
+        """写入缓存（先写临时文件再替换，避免并发读到半个文件）"""
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        temp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        temp_path.write_text(value, encoding="utf-8")
+        temp_path.replace(path)
+
+
+class HttpCacheBackend:
+    """
+    HTTP 远程缓存
+    协议：GET /cache/<key> 读取，PUT /cache/<key> 写入，POST /cache/mget 批量读取，
+    POST /cache/mset 批量写入（请求体为 {"values": {键: 值}}）
+    """
+
+    def __init__(self, base_url: str, timeout: float = 2.0):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def _request(self, method: str, path: str, body: Optional[bytes] = None) -> Optional[bytes]:
+        request = urllib.request.Request(
+            f"{self.base_url}{path}",
+            data=body,
+            method=method,
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.read()
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return None
+            raise CacheUnavailable(f"HTTP {e.code}") from e
+        except (urllib.error.URLError, OSError) as e:
+            raise CacheUnavailable(str(e)) from e
+
+    def get_many(self, keys: List[str]) -> Dict[str, str]:
+        """批量读取，只返回命中的键"""
+        body = self._request("POST", "/cache/mget", json.dumps({"keys": keys}).encode("utf-8"))
+        if body is None:
+            return {}
+        return json.loads(body)["values"]
+
+    def set_many(self, items: Dict[str, str]):
+        """批量写入，一次往返"""
+        self._request("POST", "/cache/mset", json.dumps({"values": items}).encode("utf-8"))
+
+
+class RedisCacheBackend:
+    """Redis 协议远程缓存（兼容 Redis / KeyDB / Dragonfly 等 RESP 服务）"""
+
+    def __init__(self, url: str, timeout: float = 2.0, ttl: int = 90 * 24 * 3600):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self.ttl = ttl
+        self._sock: Optional[socket.socket] = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        try:
+            self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        except OSError as e:
+            raise CacheUnavailable(str(e)) from e
+        self._reader = self._sock.makefile("rb")
+        if self.password:
+            self._send("AUTH", self.password)
+        if self.db:
+            self._send("SELECT", str(self.db))
+
+    def _close(self):
+        if self._sock is not None:
+            self._sock.close()
+        self._sock = None
+        self._reader = None
+
+    def _encode(self, *parts: str) -> bytes:
+        encoded = [f"*{len(parts)}\r\n".encode("utf-8")]
+        for part in parts:
+            data = part.encode("utf-8")
+            encoded.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(encoded)
+
+    def _read_reply(self):
+        line = self._reader.readline()
+        if not line:
+            raise CacheUnavailable("连接已关闭")
+        prefix, payload = line[:1], line[1:-2]
+        if prefix == b"+":
+            return payload.decode("utf-8")
+        if prefix == b"-":
+            raise CacheUnavailable(payload.decode("utf-8"))
+        if prefix == b":":
+            return int(payload)
+        if prefix == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2].decode("utf-8")
+        if prefix == b"*":
+            return [self._read_reply() for _ in range(int(payload))]
+        raise CacheUnavailable(f"无法解析的响应: {line!r}")
+
+    def _send(self, *parts: str):
+        self._sock.sendall(self._encode(*parts))
+        return self._read_reply()
+
+    def _pipeline(self, commands: List[Tuple[str, ...]]) -> list:
+        """发送一组命令并按顺序读取响应，连接异常时重连一次"""
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    self._sock.sendall(b"".join(self._encode(*command) for command in commands))
+                    return [self._read_reply() for _ in commands]
+                except (OSError, CacheUnavailable) as e:
+                    self._close()
+                    if attempt == 1:
+                        raise CacheUnavailable(str(e)) from e
+        return []
+
+    def get_many(self, keys: List[str]) -> Dict[str, str]:
+        """批量读取（MGET），只返回命中的键"""
+        values = self._pipeline([("MGET", *keys)])[0]
+        return {key: value for key, value in zip(keys, values) if value is not None}
+
+    def set_many(self, items: Dict[str, str]):
+        """批量写入（流水线 SET ... EX）"""
+        self._pipeline([("SET", key, value, "EX", str(self.ttl)) for key, value in items.items()])
+
+
+def create_remote_backend(url: str):
+    """根据URL创建远程缓存后端"""
+    scheme = urlparse(url).scheme
+    if scheme in ("http", "https"):
+        return HttpCacheBackend(url)
+    if scheme in ("redis", "tcp"):
+        return RedisCacheBackend(url)
+    raise ValueError(f"不支持的缓存地址: {url}")
+
+
+class TieredCache:
+    """
+    分层缓存
+    读取顺序为本地层 → 远程层；写入时同步写本地层，远程层由后台线程批量写入。
+    远程层连接失败后在冷却期内跳过，不影响识别流程。
+    """
+
+    MGET_CHUNK_SIZE = 500
+    WRITE_BATCH_SIZE = 50
+    COOLDOWN_SECONDS = 30.0
+
+    def __init__(self, local: LocalCache, remote=None):
+        self.local = local
+        self.remote = remote
+        self._unavailable_until = 0.0
+        self._lock = threading.Lock()
+        self.hits_local = 0
+        self.hits_remote = 0
+        self.misses = 0
+        self.remote_errors = 0
+        # 远程层不可用时未写入远程层的条数（本地层已保存）
+        self.remote_writes_dropped = 0
+        # 预取时远程层未命中的键，运行中不再逐个查询
+        self._remote_misses: set = set()
+        self._write_queue: "queue.Queue[Tuple[str, str]]" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        if remote is not None:
+            self._writer = threading.Thread(target=self._write_behind, name="cache-writer", daemon=True)
+            self._writer.start()
+
+    def _remote_available(self) -> bool:
+        return self.remote is not None and time.monotonic() >= self._unavailable_until
+
+    def _mark_unavailable(self, error: Exception):
+        with self._lock:
+            self.remote_errors += 1
+            self._unavailable_until = time.monotonic() + self.COOLDOWN_SECONDS
+        logger.warning(f"远程缓存不可用，{self.COOLDOWN_SECONDS:.0f}秒内仅使用本地缓存: {error}")
+
+    def _count(self, counter: str, amount: int = 1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存，未命中返回None"""
+        value = self.local.get(key)
+        if value is not None:
+            self._count("hits_local")
+            return value
+        if key not in self._remote_misses and self._remote_available():
+            try:
+                value = self.remote.get_many([key]).get(key)
+            except CacheUnavailable as e:
+                self._mark_unavailable(e)
+            if value is not None:
+                self.local.set(key, value)
+                self._count("hits_remote")
+                return value
+        self._count("misses")
+        return None
+
+    def prefetch(self, keys: Iterable[str]) -> int:
+        """
+        运行开始前批量拉取远程缓存到本地层
+
+        Returns:
+            从远程层拉取到的条数
+        """
+        missing = [key for key in keys if self.local.get(key) is None]
+        fetched = 0
+        for start in range(0, len(missing), self.MGET_CHUNK_SIZE):
+            if not self._remote_available():
+                break
+            chunk = missing[start:start + self.MGET_CHUNK_SIZE]
+            try:
+                values = self.remote.get_many(chunk)
+            except CacheUnavailable as e:
+                self._mark_unavailable(e)
+                break
+            for key, value in values.items():
+                self.local.set(key, value)
+            self._remote_misses.update(key for key in chunk if key not in values)
+            fetched += len(values)
+        if fetched:
+            logger.info(f"从远程缓存预取 {fetched} 条结果")
+        return fetched
+
+    def put(self, key: str, value: str):
+        """写入缓存，远程层异步写入"""
+        self.local.set(key, value)
+        if self.remote is not None:
+            self._write_queue.put((key, value))
+
+    def _write_behind(self):
+        """后台线程：批量写入远程层"""
+        while True:
+            batch = dict([self._write_queue.get()])
+            while len(batch) < self.WRITE_BATCH_SIZE:
+                try:
+                    key, value = self._write_queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch[key] = value
+            written = False
+            if self._remote_available():
+                try:
+                    self.remote.set_many(batch)
+                    written = True
+                except CacheUnavailable as e:
+                    self._mark_unavailable(e)
+            if not written:
+                self._count("remote_writes_dropped", len(batch))
+                logger.warning(f"远程缓存不可用，{len(batch)} 条结果只写入了本地缓存")
+            for _ in range(len(batch)):
+                self._write_queue.task_done()
+
+    def flush(self, timeout: float = 10.0):
+        """等待远程写入完成，最多等待 timeout 秒"""
+        if self.remote is None:
+            return
+        deadline = time.monotonic() + timeout
+        while self._write_queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        if self._write_queue.unfinished_tasks:
+            logger.warning(f"远程缓存仍有 {self._write_queue.unfinished_tasks} 条结果未写入")
+
+    def get_stats(self) -> Dict[str, int]:
+        """缓存命中统计"""
+        with self._lock:
+            return {
+                "hits_local": self.hits_local,
+                "hits_remote": self.hits_remote,
+                "misses": self.misses,
+                "remote_errors": self.remote_errors,
+                "remote_writes_dropped": self.remote_writes_dropped,
+            }
+
+
+class CacheStandInServer:
+    """
+    HTTP 远程缓存的本地替身服务
+    内存字典实现 HttpCacheBackend 的协议，用于测试，也可作为小团队的共享缓存
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        store: Dict[str, str] = {}
+        requests: List[str] = []
+        lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, code: int, body: bytes = b""):
+                self.send_response(code)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _body(self) -> bytes:
+                return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+            def do_GET(self):
+                with lock:
+                    requests.append(f"GET {self.path}")
+                    value = store.get(self.path[len("/cache/"):])
+                if value is None:
+                    self._reply(404)
+                else:
+                    self._reply(200, value.encode("utf-8"))
+
+            def do_PUT(self):
+                value = self._body().decode("utf-8")
+                with lock:
+                    requests.append(f"PUT {self.path}")
+                    store[self.path[len("/cache/"):]] = value
+                self._reply(204)
+
+            def do_POST(self):
+                payload = json.loads(self._body())
+                with lock:
+                    requests.append(f"POST {self.path}")
+                    if self.path == "/cache/mset":
+                        store.update(payload["values"])
+                    else:
+                        values = {key: store[key] for key in payload["keys"] if key in store}
+                if self.path == "/cache/mset":
+                    self._reply(204)
+                else:
+                    self._reply(200, json.dumps({"values": values}).encode("utf-8"))
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        self.store = store
+        self.requests = requests
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self.url = f"http://{host}:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def start(self) -> "CacheStandInServer":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def test_result_cache():
+    """测试分层缓存功能"""
+    import tempfile
+
+    print("--- 测试识别结果缓存 ---")
+
+    # 测试用例1: 相同内容得到相同的键，不同模型得到不同的键
+    key = content_key(b"image-bytes", "model-a")
+    assert key == content_key(b"image-bytes", "model-a")
+    assert key != content_key(b"image-bytes", "model-b")
+    assert key != content_key(b"image-bytes", "model-a", "lean")
+    print(f"测试1 - 缓存键: {key[:40]}...")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        server = CacheStandInServer().start()
+        try:
+            # 测试用例2: 写入后远程层由后台线程写入
+            writer = TieredCache(LocalCache(Path(temp_dir) / "alice"), HttpCacheBackend(server.url))
+            writer.put(key, '{"is_receipt": true}')
+            writer.flush()
+            print(f"测试2 - 远程层条目数: {len(server.store)}")
+            assert server.store[key] == '{"is_receipt": true}'
+
+            # 测试用例3: 另一位成员批量预取后从本地层命中
+            reader = TieredCache(LocalCache(Path(temp_dir) / "bob"), HttpCacheBackend(server.url))
+            assert reader.prefetch([key, content_key(b"other", "model-a")]) == 1
+            assert reader.get(key) == '{"is_receipt": true}'
+            print(f"测试3 - 预取后统计: {reader.get_stats()}")
+            assert reader.get_stats()["hits_local"] == 1
+
+            # 测试用例4: 批量写入只需一次往返
+            server.requests.clear()
+            HttpCacheBackend(server.url).set_many({"k1": "v1", "k2": "v2"})
+            print(f"测试4 - 批量写入请求: {server.requests}")
+            assert server.requests == ["POST /cache/mset"]
+            assert server.store["k1"] == "v1" and server.store["k2"] == "v2"
+        finally:
+            server.stop()
+
+        # 测试用例5: 远程层不可达时降级为本地缓存，冷却期内未写入远程层的结果计入统计
+        offline = TieredCache(LocalCache(Path(temp_dir) / "carol"), HttpCacheBackend(server.url, timeout=0.5))
+        assert offline.get(key) is None
+        offline.put(key, "{}")
+        assert offline.get(key) == "{}"
+        offline.flush(timeout=2.0)
+        print(f"测试5 - 远程不可达时统计: {offline.get_stats()}")
+        assert offline.get_stats()["remote_errors"] == 1
+        assert offline.get_stats()["remote_writes_dropped"] == 1
+
+    # 测试用例6: Redis 协议编码
+    backend = RedisCacheBackend("redis://:secret@cache.local:6380/2")
+    assert (backend.host, backend.port, backend.db, backend.password) == ("cache.local", 6380, 2, "secret")
+    assert backend._encode("MGET", "a") == b"*2\r\n$4\r\nMGET\r\n$1\r\na\r\n"
+    print("测试6 - Redis 协议编码正确")
+
+    print("✅ 所有测试用例通过！")
+
+
+if __name__ == '__main__':
+    # 配置日志以查看详细信息
+    logging.basicConfig(level=logging.INFO)
+    test_result_cache()
@@ -0,0 +1,322 @@
+"""
+任务调度模块
+按估算成本（文件大小和像素数）从小到大安排识别顺序，并根据已完成文件的耗时实时显示进度、速度和剩余时间
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, Dict, Iterator, List, NamedTuple, Optional, Union
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+class JobCost(NamedTuple):
+    """一张图片的估算成本"""
+    size: int
+    pixels: Optional[int]
+
+
+def estimate_cost(image_path: Path) -> JobCost:
+    """
+    估算识别一张图片的成本：文件大小决定读取、编码和上传耗时，像素数决定模型处理的图片分块数
+
+    像素数只读取图片头部获得，不解码图片；无法读取时为None
+    """
+    size = image_path.stat().st_size
+    return JobCost(size, image_pixels(image_path))
+
+
+def image_pixels(source: Union[Path, IO[bytes]]) -> Optional[int]:
+    """只读取图片头部获得像素数，不解码图片；无法读取时为None"""
+    try:
+        with Image.open(source) as image:
+            width, height = image.size
+        return width * height
+    except Exception:
+        return None
+
+
+def file_size(image_path: Path) -> int:
+    """文件字节数，无法读取时为0"""
+    try:
+        return image_path.stat().st_size
+    except OSError:
+        return 0
+
+
+def order_by_cost(image_paths: List[Path]) -> List[Path]:
+    """
+    最短作业优先：按估算成本从小到大排序，小文件先出结果，超大扫描件不会拖慢其他文件
+
+    成本为文件大小和像素数分别相对于本批平均值的比值之和；无法读取像素数的图片只按文件大小计算
+    """
+    costs: Dict[Path, JobCost] = {}
+    for image_path in image_paths:
+        try:
+            costs[image_path] = estimate_cost(image_path)
+        except OSError:
+            # 无法读取的文件排在最前，尽早报告失败
+            costs[image_path] = JobCost(0, None)
+    if not costs:
+        return []
+
+    mean_size = max(1.0, sum(cost.size for cost in costs.values()) / len(costs))
+    known_pixels = [cost.pixels for cost in costs.values() if cost.pixels]
+    mean_pixels = max(1.0, sum(known_pixels) / len(known_pixels)) if known_pixels else 1.0
+
+    def relative_cost(image_path: Path) -> float:
+        cost = costs[image_path]
+        relative_size = cost.size / mean_size
+        if cost.pixels is None:
+            return relative_size * 2
+        return relative_size + cost.pixels / mean_pixels
+
+    return sorted(image_paths, key=relative_cost)
+
+
+class ProgressTracker:
+    """
+    批量识别进度
+
+    把单个文件耗时拟合为「固定开销 + 每字节耗时 × 文件大小」，再按观察到的并行度折算剩余时间。
+    最短作业优先时先完成的都是小文件，单纯按已处理字节外推会高估剩余时间
+    """
+
+    def __init__(self, total_files: int, total_bytes: int, stream: Optional[IO[str]] = None,
+                 interval: float = 0.5):
+        """
+        初始化进度统计
+
+        Args:
+            total_files: 文件总数
+            total_bytes: 文件总字节数
+            stream: 进度输出流，None 表示不显示
+            interval: 两次刷新显示之间的最小间隔（秒）
+        """
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.stream = stream
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self._last_render = 0.0
+        self.done_files = 0
+        self.done_bytes = 0
+        # 最小二乘拟合所需的累加量：x 为文件字节数，y 为文件耗时
+        self._sum_x = 0.0
+        self._sum_y = 0.0
+        self._sum_xx = 0.0
+        self._sum_xy = 0.0
+
+    def advance(self, nbytes: int, seconds: float):
+        """
+        记录一个文件完成
+
+        Args:
+            nbytes: 文件字节数
+            seconds: 该文件的处理耗时
+        """
+        with self._lock:
+            self.done_files += 1
+            self.done_bytes += nbytes
+            self._sum_x += nbytes
+            self._sum_y += seconds
+            self._sum_xx += nbytes * nbytes
+            self._sum_xy += nbytes * seconds
+            now = time.monotonic()
+            finished = self.done_files == self.total_files
+            if self.stream is None or (now - self._last_render < self.interval and not finished):
+                return
+            self._last_render = now
+            line = self._format_line(now)
+        end = "\n" if finished else ""
+        if self.stream.isatty():
+            self.stream.write(f"\r\033[K{line}{end}")
+        else:
+            self.stream.write(f"{line}\n")
+        self.stream.flush()
+
+    @contextmanager
+    def capture_logging(self) -> Iterator[None]:
+        """
+        在终端显示进度行期间接管日志输出
+
+        日志级别为 INFO 及以上时，逐个文件的 INFO 日志会不断冲掉原地刷新的进度行，期间只输出警告和错误；
+        每条日志输出前先清除当前进度行，下次刷新时重新绘制。LOG_LEVEL=DEBUG 时保留全部日志
+        """
+        if self.stream is None or not self.stream.isatty():
+            yield
+            return
+        log_filter = _ProgressLogFilter(self, quiet=logging.getLogger().getEffectiveLevel() >= logging.INFO)
+        handlers = list(logging.getLogger().handlers)
+        for handler in handlers:
+            handler.addFilter(log_filter)
+        try:
+            yield
+        finally:
+            for handler in handlers:
+                handler.removeFilter(log_filter)
+
+    def clear_line(self):
+        """清除终端中的当前进度行"""
+        with self._lock:
+            self.stream.write("\r\033[K")
+            self.stream.flush()
+            self._last_render = 0.0
+
+    def _fit(self):
+        """拟合单个文件耗时 = 固定开销 + 每字节耗时 × 字节数，返回 (固定开销, 每字节耗时)"""
+        n = self.done_files
+        mean_x = self._sum_x / n
+        mean_y = self._sum_y / n
+        variance = self._sum_xx / n - mean_x * mean_x
+        if variance <= 1e-9 * max(1.0, mean_x * mean_x):
+            # 文件大小几乎相同，无法区分固定开销和每字节耗时，全部按字节分摊
+            return 0.0, mean_y / mean_x if mean_x else 0.0
+        per_byte = max(0.0, (self._sum_xy / n - mean_x * mean_y) / variance)
+        overhead = max(0.0, mean_y - per_byte * mean_x)
+        return overhead, per_byte
+
+    def eta_seconds(self, now: Optional[float] = None) -> Optional[float]:
+        """估算剩余时间（秒），尚无完成文件时返回None"""
+        if not self.done_files:
+            return None
+        now = time.monotonic() if now is None else now
+        overhead, per_byte = self._fit()
+        remaining_work = ((self.total_files - self.done_files) * overhead
+                          + (self.total_bytes - self.done_bytes) * per_byte)
+        # 并行处理时多个文件的耗时重叠，用累计耗时与实际经过时间之比折算
+        elapsed = max(now - self._start, 1e-6)
+        concurrency = max(1.0, self._sum_y / elapsed)
+        return remaining_work / concurrency
+
+    def _format_line(self, now: float) -> str:
+        elapsed = max(now - self._start, 1e-6)
+        eta = self.eta_seconds(now)
+        eta_text = "--:--" if eta is None else format_duration(eta)
+        return (f"⏳ {self.done_files}/{self.total_files} | "
+                f"{self.done_files / elapsed:.2f} 文件/s | "
+                f"{self.done_bytes / elapsed / 1024 / 1024:.2f} MB/s | "
+                f"剩余约 {eta_text}")
+
+    def get_stats(self) -> Dict[str, float]:
+        """进度统计"""
+        with self._lock:
+            now = time.monotonic()
+            elapsed = max(now - self._start, 1e-6)
+            return {
+                "done_files": self.done_files,
+                "total_files": self.total_files,
+                "files_per_s": self.done_files / elapsed,
+                "bytes_per_s": self.done_bytes / elapsed,
+                "eta_s": self.eta_seconds(now),
+            }
+
+
+class _ProgressLogFilter(logging.Filter):
+    """进度显示期间的日志过滤：quiet 时丢弃警告以下的日志，输出前清除进度行"""
+
+    def __init__(self, tracker: ProgressTracker, quiet: bool):
+        super().__init__()
+        self.tracker = tracker
+        self.quiet = quiet
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.quiet and record.levelno < logging.WARNING:
+            return False
+        self.tracker.clear_line()
+        return True
+
+
+def format_duration(seconds: float) -> str:
+    """格式化为 MM:SS 或 H:MM:SS"""
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes:02d}:{seconds:02d}"
+
+
+def test_scheduler():
+    """测试任务调度功能"""
+    import io
+    import tempfile
+
+    print("--- 测试任务调度 ---")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp = Path(temp_dir)
+        Image.new("RGB", (2000, 3000), "white").save(temp / "a_scan.png")
+        Image.new("RGB", (300, 600), "white").save(temp / "b_small.png")
+        Image.new("RGB", (1000, 1000), "white").save(temp / "c_medium.png")
+        (temp / "d_broken.jpg").write_bytes(b"x" * 100)
+
+        # 测试用例1: 读取像素数不解码图片，损坏的图片像素数为None
+        cost = estimate_cost(temp / "a_scan.png")
+        print(f"测试1 - 扫描件成本: {cost}")
+        assert cost.pixels == 6_000_000
+        assert estimate_cost(temp / "d_broken.jpg").pixels is None
+
+        # 测试用例2: 按成本从小到大排序
+        ordered = order_by_cost(sorted(temp.iterdir()))
+        print(f"测试2 - 处理顺序: {[path.name for path in ordered]}")
+        assert [path.name for path in ordered][-2:] == ["c_medium.png", "a_scan.png"]
+
+    # 测试用例3: 拟合固定开销和每字节耗时
+    tracker = ProgressTracker(total_files=4, total_bytes=1000 + 2000 + 3000 + 100_000)
+    tracker.advance(1000, 1.0 + 0.001 * 1000)
+    tracker.advance(2000, 1.0 + 0.001 * 2000)
+    tracker.advance(3000, 1.0 + 0.001 * 3000)
+    overhead, per_byte = tracker._fit()
+    print(f"测试3 - 固定开销 {overhead:.3f}s，每字节 {per_byte * 1000:.3f}ms")
+    assert abs(overhead - 1.0) < 1e-6 and abs(per_byte - 0.001) < 1e-9
+    # 剩余 1 个 100KB 文件：1s + 100s，除以并行度
+    eta = tracker.eta_seconds(tracker._start + tracker._sum_y)
+    print(f"测试3 - 剩余时间: {eta:.1f}s")
+    assert abs(eta - 101.0) < 1e-6
+
+    # 测试用例4: 进度显示
+    stream = io.StringIO()
+    tracker = ProgressTracker(total_files=2, total_bytes=2048, stream=stream, interval=0)
+    tracker.advance(1024, 0.5)
+    tracker.advance(1024, 0.5)
+    lines = stream.getvalue().splitlines()
+    print(f"测试4 - 进度输出: {lines[-1]}")
+    assert lines[-1].startswith("⏳ 2/2")
+    assert format_duration(3725) == "1:02:05"
+
+    # 测试用例5: 终端显示进度行期间只输出警告及以上日志，输出前清除进度行
+    class TerminalStream(io.StringIO):
+        def isatty(self):
+            return True
+
+    terminal = TerminalStream()
+    handler = logging.StreamHandler(terminal)
+    root = logging.getLogger()
+    root.addHandler(handler)
+    try:
+        tracker = ProgressTracker(total_files=2, total_bytes=2048, stream=terminal, interval=0)
+        with tracker.capture_logging():
+            tracker.advance(1024, 0.5)
+            logger.info("开始识别图片: IMG_001.jpg")
+            logger.warning("OCR识别失败 (尝试 1)")
+        logger.info("批量识别完成")
+    finally:
+        root.removeHandler(handler)
+    output = terminal.getvalue()
+    print(f"测试5 - 终端输出: {output!r}")
+    assert "开始识别图片" not in output and "\r\033[KOCR识别失败" in output and "批量识别完成" in output
+
+    print("✅ 所有测试用例通过！")
+
+
+if __name__ == '__main__':
+    # 配置日志以查看详细信息
+    logging.basicConfig(level=logging.INFO)
+    test_scheduler()
@@ -0,0 +1,418 @@
+"""
+识别服务模块
+常驻的本地 HTTP 服务，接收图片上传并返回 ReceiptInfo JSON；
+并发请求合并为微批次，共享同一个 OCR 客户端、识别结果缓存、在途字节预算和速率限制
+"""
+
+import hashlib
+import io
+import json
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from backpressure import RateLimiter, estimate_payload_bytes
+from hedging import LatencyTracker
+from models import ReceiptInfo
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _PendingRequest:
+    """排队中的识别请求"""
+    image_bytes: bytes
+    image_format: str
+    name: str
+    digest: str
+    future: Future = field(default_factory=Future)
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+class MicroBatcher:
+    """
+    微批次调度器
+
+    在时间窗口内收集并发请求组成一个批次：内容相同的图片（同一批次或正在识别中）只识别一次，
+    远程缓存一次往返批量预取，其余请求交给共享线程池识别
+    """
+
+    def __init__(self, ocr_service, detector=None, max_batch: int = 16,
+                 window: float = 0.02, workers: int = 8, rate_limit: float = 0.0):
+        """
+        初始化微批次调度器
+
+        Args:
+            ocr_service: OCR服务（OCRService），所有请求共享
+            detector: 交易记录检测器（ReceiptDetector），用于二次检测
+            max_batch: 每个批次的最大请求数
+            window: 收集批次的时间窗口（秒）
+            workers: 识别线程数
+            rate_limit: 每秒最多发起的API调用数，0 表示不限制
+        """
+        self.ocr_service = ocr_service
+        self.detector = detector
+        self.max_batch = max_batch
+        self.window = window
+        if rate_limit > 0:
+            ocr_service.rate_limiter = RateLimiter(1.0 / rate_limit)
+        self.latency = LatencyTracker(window=1000)
+        self._queue: "queue.Queue[Optional[_PendingRequest]]" = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="service")
+        self._thread = threading.Thread(target=self._dispatch_loop, name="micro-batcher", daemon=True)
+        self._lock = threading.Lock()
+        # 正在识别的内容摘要 -> 等待该结果的请求
+        self._inflight: Dict[str, List[_PendingRequest]] = {}
+        self.requests = 0
+        self.batches = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.largest_batch = 0
+
+    def start(self) -> "MicroBatcher":
+        self._thread.start()
+        return self
+
+    def close(self):
+        """处理完已排队的请求后停止，并释放OCR服务的后台资源"""
+        self._queue.put(None)
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+        self.ocr_service.close()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def submit(self, image_bytes: bytes, image_format: str, name: str = "") -> Future:
+        """
+        提交一张图片，返回识别结果的 Future
+
+        内容摘要在调用方线程中计算，不占用调度线程
+        """
+        with tracer.span("hash_image", file=name):
+            digest = hashlib.sha256(image_bytes).hexdigest()
+        request = _PendingRequest(image_bytes, image_format, name, digest)
+        self._queue.put(request)
+        return request.future
+
+    def recognize(self, image_bytes: bytes, image_format: str, name: str = "",
+                  timeout: Optional[float] = None) -> ReceiptInfo:
+        """提交一张图片并等待识别结果"""
+        return self.submit(image_bytes, image_format, name).result(timeout)
+
+    def _dispatch_loop(self):
+        """收集批次并分发，收到 None 时退出"""
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            stopping = False
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                    break
+                batch.append(request)
+            self._dispatch(batch)
+            if stopping:
+                return
+
+    def _dispatch(self, batch: List[_PendingRequest]):
+        """按内容摘要合并请求，批量预取远程缓存后交给线程池识别"""
+        new_groups: Dict[str, List[_PendingRequest]] = {}
+        with self._lock:
+            self.requests += len(batch)
+            self.batches += 1
+            self.largest_batch = max(self.largest_batch, len(batch))
+            for request in batch:
+                group = self._inflight.get(request.digest)
+                if group is not None:
+                    # 相同内容正在识别，等待同一个结果
+                    group.append(request)
+                    self.coalesced += 1
+                else:
+                    self._inflight[request.digest] = new_groups[request.digest] = [request]
+
+        ocr = self.ocr_service
+        if new_groups and ocr.reads_cache and ocr.cache.remote is not None:
+            with tracer.span("cache_prefetch", category="cache", files=len(new_groups)):
+                ocr.cache.prefetch([ocr.cache_key(digest) for digest in new_groups])
+
+        for digest, requests in new_groups.items():
+            self._executor.submit(self._recognize_group, digest, requests[0])
+
+    def _recognize_group(self, digest: str, first: _PendingRequest):
+        """识别一张图片，结果交给等待相同内容的所有请求"""
+        error = None
+        try:
+            with tracer.span("recognize", file=first.name):
+                # 在途字节预算由 HTTP 层在读取请求体之前申请
+                info = self.ocr_service.recognize_bytes(
+                    first.image_bytes, first.image_format, first.name, digest=digest
+                )
+                if self.detector is not None:
+                    fetch_text = None
+                    if self.ocr_service.lean_schema:
+                        fetch_text = lambda: self.ocr_service.transcribe_bytes(  # noqa: E731
+                            first.image_bytes, first.image_format, first.name
+                        )
+                    self.detector.detect(info, fetch_text)
+        except Exception as e:
+            logger.error(f"识别图片失败 {first.name}: {e}")
+            error = e
+
+        with self._lock:
+            requests = self._inflight.pop(digest)
+            if error is not None:
+                self.errors += len(requests)
+        if error is not None:
+            for request in requests:
+                request.future.set_exception(error)
+            return
+
+        now = time.perf_counter()
+        for request in requests:
+            self.latency.observe(now - request.enqueued_at)
+            request.future.set_result(info)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """批次和延迟统计（毫秒）"""
+        with self._lock:
+            stats: Dict[str, Any] = {
+                "requests": self.requests,
+                "batches": self.batches,
+                "avg_batch_size": self.requests / self.batches if self.batches else 0.0,
+                "largest_batch": self.largest_batch,
+                "coalesced": self.coalesced,
+                "errors": self.errors,
+                "queue_depth": self.queue_depth,
+            }
+        for label, q in (("p50_ms", 0.5), ("p90_ms", 0.9), ("p99_ms", 0.99)):
+            value = self.latency.quantile(q)
+            stats[label] = None if value is None else value * 1000
+        return stats
+
+
+def parse_upload(content_type: str, body: bytes, name: str) -> Tuple[bytes, str]:
+    """
+    解析上传的图片，支持原始图片请求体和 multipart/form-data 的 file 字段
+
+    Returns:
+        (图片内容, 文件名)
+    """
+    if not content_type.startswith("multipart/form-data"):
+        return body, name
+    header = f"Content-Type: {content_type}\r\n\r\n".encode("utf-8")
+    message = BytesParser(policy=HTTP).parsebytes(header + body)
+    for part in message.iter_parts():
+        if part.get_param("name", header="content-disposition") == "file":
+            return part.get_content(), part.get_filename() or name
+    raise ValueError("multipart 请求中缺少 file 字段")
+
+
+class RecognitionServer:
+    """识别 HTTP 服务"""
+
+    # 监听队列长度，支持数百个客户端同时连接
+    REQUEST_QUEUE_SIZE = 512
+
+    def __init__(self, batcher: MicroBatcher, host: str = "127.0.0.1", port: int = 8765,
+                 max_upload_bytes: int = 20 * 1024 * 1024, timeout: float = 300.0):
+        """
+        初始化识别服务
+
+        Args:
+            batcher: 微批次调度器
+            host: 监听地址
+            port: 监听端口，0 表示随机端口
+            max_upload_bytes: 单张图片的最大字节数
+            timeout: 等待识别结果的最长时间（秒）
+        """
+        ocr_service = batcher.ocr_service
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _reply(self, code: int, value: Dict[str, Any]):
+                body = json.dumps(value, ensure_ascii=False).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                path = urlparse(self.path).path
+                if path == "/health":
+                    self._reply(200, {
+                        "status": "ok",
+                        "model": ocr_service.model_id,
+                        "queue_depth": batcher.queue_depth,
+                        "in_flight_bytes": ocr_service.byte_budget.get_stats()["in_flight_bytes"],
+                    })
+                elif path == "/latency":
+                    self._reply(200, batcher.get_stats())
+                else:
+                    self._reply(404, {"error": "not found"})
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                if url.path != "/recognize":
+                    self._reply(404, {"error": "not found"})
+                    return
+                length = int(self.headers.get("Content-Length", 0))
+                if length <= 0:
+                    self._reply(400, {"error": "请求体为空"})
+                    return
+                if length > max_upload_bytes:
+                    self.close_connection = True
+                    self._reply(413, {"error": f"图片超过 {max_upload_bytes // 1024 // 1024}MB"})
+                    return
+
+                name = parse_qs(url.query).get("name", ["upload.jpg"])[0]
+                # 读取请求体之前按 Content-Length 申请在途字节预算，排队中的图片也计入内存上限；
+                # 解析出图片后按图片头部的像素数调整预算，计入裁剪时解码的位图
+                budget = ocr_service.byte_budget
+                reserved = estimate_payload_bytes(length)
+                budget.acquire(reserved)
+                try:
+                    body = self.rfile.read(length)
+                    try:
+                        image_bytes, name = parse_upload(self.headers.get("Content-Type", ""), body, name)
+                    except ValueError as e:
+                        self._reply(400, {"error": str(e)})
+                        return
+                    del body
+                    needed = ocr_service.estimate_payload(len(image_bytes), io.BytesIO(image_bytes))
+                    budget.resize(reserved, needed)
+                    reserved = needed
+                    image_format = ocr_service.get_image_format(Path(name))
+                    try:
+                        info = batcher.recognize(image_bytes, image_format, name, timeout=timeout)
+                    except Exception as e:
+                        self._reply(500, {"error": str(e)})
+                        return
+                finally:
+                    budget.release(reserved)
+                self._reply(200, info.model_dump(mode="json"))
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+            request_queue_size = self.REQUEST_QUEUE_SIZE
+
+        self.batcher = batcher
+        self._server = Server((host, port), Handler)
+        self.url = f"http://{host}:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def start(self) -> "RecognitionServer":
+        """在后台线程中启动服务"""
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """在当前线程中运行服务，直到中断"""
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def test_service():
+    """测试识别服务功能"""
+    import os
+    import urllib.request
+    from types import SimpleNamespace
+
+    os.environ.setdefault("ARK_API_KEY", "test")
+    from ocr_service import OCRService
+
+    print("--- 测试识别服务 ---")
+
+    ocr_service = OCRService()
+    ocr_service.cropper = None
+    api_calls = []
+
+    def fake_api(image_url: str):
+        api_calls.append(image_url)
+        time.sleep(0.3)
+        parsed = ReceiptInfo(is_receipt=True, image_type="截图", platform="微信支付",
+                             amount=len(image_url) % 100, confidence=0.9, raw_text="微信支付")
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(parsed=parsed))])
+
+    ocr_service._call_api = fake_api
+    batcher = MicroBatcher(ocr_service, max_batch=32, window=0.05, workers=8).start()
+    server = RecognitionServer(batcher, port=0).start()
+
+    def post(data: bytes, name: str) -> Dict[str, Any]:
+        request = urllib.request.Request(f"{server.url}/recognize?name={name}", data=data, method="POST")
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+
+    try:
+        # 测试用例1: 并发请求合并为微批次，相同内容只调用一次API
+        uploads = [(b"same-image", "same.jpg")] * 10 + [(f"image-{i}".encode(), f"{i}.png") for i in range(10)]
+        with ThreadPoolExecutor(max_workers=20) as executor:
+            results = list(executor.map(lambda upload: post(*upload), uploads))
+        stats = batcher.get_stats()
+        print(f"测试1 - API调用 {len(api_calls)} 次，统计: {stats}")
+        assert all(result["is_receipt"] for result in results)
+        assert len(api_calls) == 11
+        assert stats["requests"] == 20
+        assert stats["coalesced"] == 9
+        assert stats["batches"] < 20
+
+        # 测试用例2: multipart 上传
+        boundary = "receiptname"
+        body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"m.jpg\"\r\n"
+                f"Content-Type: image/jpeg\r\n\r\n").encode() + b"multipart-image" + f"\r\n--{boundary}--\r\n".encode()
+        request = urllib.request.Request(f"{server.url}/recognize", data=body, method="POST",
+                                         headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+        with urllib.request.urlopen(request) as response:
+            result = json.loads(response.read())
+        print(f"测试2 - multipart 结果: platform={result['platform']}")
+        assert result["platform"] == "微信支付"
+
+        # 测试用例3: 健康检查和延迟统计
+        with urllib.request.urlopen(f"{server.url}/health") as response:
+            health = json.loads(response.read())
+        with urllib.request.urlopen(f"{server.url}/latency") as response:
+            latency = json.loads(response.read())
+        print(f"测试3 - 健康检查: {health}，p50: {latency['p50_ms']:.1f}ms")
+        assert health["status"] == "ok"
+        assert health["in_flight_bytes"] == 0
+        assert latency["p50_ms"] > 0
+    finally:
+        server.stop()
+        batcher.close()
+
+    print("✅ 所有测试用例通过！")
+
+
+if __name__ == '__main__':
+    # 配置日志以查看详细信息
+    logging.basicConfig(level=logging.INFO)
+    test_service()
@@ -87,11 +87,38 @@ def test_image_processing():
         return False
 
 
+def test_replay_rescans_processed_files():
+    """测试回放模式重新处理录制时已经重命名的文件"""
+    print("\n📼 测试回放模式扫描文件...")
+    import tempfile
+
+    from file_renamer import FileRenamer
+    from main import build_parser, scan_pending_images
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        directory = Path(temp_dir)
+        original = directory / "IMG_0001.jpg"
+        original.write_bytes(b"jpeg")
+        receipt = ReceiptInfo(is_receipt=True, platform="微信支付", amount=12.0, confidence=0.9, raw_text="")
+        renamed = FileRenamer(directory).batch_rename({original: receipt})[original]
+
+        parser = build_parser()
+        normal = scan_pending_images(parser.parse_args([]), FileRenamer(directory))
+        replay = scan_pending_images(parser.parse_args(["--replay", temp_dir]), FileRenamer(directory))
+        if normal == [] and replay == [renamed]:
+            print("✅ 回放模式会重新处理已重命名的文件")
+            return True
+        print(f"❌ 回放模式扫描结果不正确: 普通 {normal}，回放 {replay}")
+        return False
+
+
 def main():
     """主测试函数"""
     print("🧪 ReceiptName OCR服务测试")
     print("=" * 50)
     
+    test_replay_rescans_processed_files()
+    
     # 测试配置
     if not test_config():
         return
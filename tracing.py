@@ -0,0 +1,191 @@
+"""
+性能追踪模块
+记录每个文件在各处理阶段的耗时，导出为 Chrome trace-event JSON（可在 Perfetto / chrome://tracing 中查看）
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+class _NullSpan:
+    """追踪关闭时使用的空跨度，不做任何记录"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    """一次阶段耗时记录"""
+
+    __slots__ = ("tracer", "name", "category", "args", "start_ns")
+
+    def __init__(self, tracer: "Tracer", name: str, category: str, args: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start_ns = 0
+
+    def __enter__(self):
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end_ns = time.perf_counter_ns()
+        if exc_type is not None:
+            self.args["error"] = f"{exc_type.__name__}: {exc_value}"
+        self.tracer._add_event(self.name, self.category, self.start_ns, end_ns, self.args)
+        return False
+
+
+class Tracer:
+    """阶段追踪器"""
+
+    def __init__(self):
+        self.enabled = False
+        self._events: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._origin_ns = time.perf_counter_ns()
+
+    def enable(self):
+        """开启追踪，清空已有记录"""
+        with self._lock:
+            self._events = []
+            self._origin_ns = time.perf_counter_ns()
+            self.enabled = True
+        logger.info("阶段追踪已开启")
+
+    def span(self, name: str, category: str = "pipeline", **args: Any):
+        """
+        记录一个阶段的耗时
+
+        Args:
+            name: 阶段名称，如 encode_image、api_call
+            category: 阶段分类
+            **args: 附加信息，如文件名、重试次数
+
+        Returns:
+            上下文管理器，追踪关闭时为空操作
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, category, args)
+
+    def _add_event(self, name: str, category: str, start_ns: int, end_ns: int, args: Dict[str, Any]):
+        """追加一条完整事件（ph=X）"""
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": (start_ns - self._origin_ns) / 1000,
+            "dur": (end_ns - start_ns) / 1000,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": args,
+        }
+        with self._lock:
+            self._events.append(event)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """按阶段汇总次数和总耗时（毫秒）"""
+        totals: Dict[str, Dict[str, float]] = {}
+        with self._lock:
+            events = list(self._events)
+        for event in events:
+            stage = totals.setdefault(event["name"], {"count": 0, "total_ms": 0.0})
+            stage["count"] += 1
+            stage["total_ms"] += event["dur"] / 1000
+        return totals
+
+    def export(self, output_path: Path):
+        """导出 Chrome trace-event JSON"""
+        with self._lock:
+            events = list(self._events)
+        thread_names = {
+            thread.ident: thread.name for thread in threading.enumerate() if thread.ident
+        }
+        metadata = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": os.getpid(),
+                "tid": tid,
+                "args": {"name": thread_names.get(tid, f"thread-{tid}")},
+            }
+            for tid in {event["tid"] for event in events}
+        ]
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"traceEvents": metadata + events, "displayTimeUnit": "ms"},
+                f,
+                ensure_ascii=False,
+            )
+        logger.info(f"追踪结果已导出: {output_path}（{len(events)} 个事件）")
+
+
+# 全局追踪器实例
+tracer = Tracer()
+
+
+def test_tracer():
+    """测试追踪器功能"""
+    import tempfile
+
+    print("--- 测试阶段追踪器 ---")
+    local_tracer = Tracer()
+
+    # 测试用例1: 关闭时不记录
+    with local_tracer.span("encode_image", file="a.jpg"):
+        pass
+    print("测试1 - 关闭时不记录事件")
+    assert local_tracer.summary() == {}
+
+    # 测试用例2: 开启后记录嵌套阶段和异常
+    local_tracer.enable()
+    with local_tracer.span("recognize", file="a.jpg"):
+        with local_tracer.span("encode_image", file="a.jpg"):
+            time.sleep(0.01)
+        try:
+            with local_tracer.span("api_call", category="network", attempt=1):
+                raise TimeoutError("timeout")
+        except TimeoutError:
+            pass
+    summary = local_tracer.summary()
+    print(f"测试2 - 阶段汇总: {summary}")
+    assert summary["encode_image"]["count"] == 1
+    assert summary["encode_image"]["total_ms"] >= 10
+    assert summary["recognize"]["total_ms"] >= summary["encode_image"]["total_ms"]
+
+    # 测试用例3: 导出 Chrome trace 格式
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output = Path(temp_dir) / "trace.json"
+        local_tracer.export(output)
+        with open(output, encoding="utf-8") as f:
+            trace = json.load(f)
+    events = [event for event in trace["traceEvents"] if event["ph"] == "X"]
+    print(f"测试3 - 导出事件数: {len(events)}")
+    assert len(events) == 3
+    api_event = next(event for event in events if event["name"] == "api_call")
+    assert api_event["args"]["error"] == "TimeoutError: timeout"
+    assert any(event["ph"] == "M" for event in trace["traceEvents"])
+
+    print("✅ 所有测试用例通过！")
+
+
+if __name__ == '__main__':
+    # 配置日志以查看详细信息
+    logging.basicConfig(level=logging.INFO)
+    test_tracer()